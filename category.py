@@ -67,9 +67,9 @@ Options for several actions:
                   listed.
 
 For the actions tidy and tree, the bot will store the category structure
-locally in category.dump. This saves time and server load, but if it uses
-these data later, they may be outdated; use the -rebuild parameter in this
-case.
+locally in category.db. This saves time and server load. Categories loaded
+more than config.category_db_maxage seconds ago are loaded again; use the
+-rebuild parameter to discard all stored categories.
 
 For example, to create a new category from a list of persons, type:
 
@@ -103,6 +103,16 @@ import os
 import re
 import pickle
 import bz2
+import threading
+import time
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+try:
+    import json
+except ImportError:
+    import simplejson as json
 import wikipedia as pywikibot
 import catlib
 import config
@@ -130,108 +140,195 @@ cfd_templates = {
 
 
 class CategoryDatabase:
-    '''This is a temporary knowledge base saving for each category the contained
-    subcategories and articles, so that category pages do not need to be loaded
-    over and over again
+    '''This is a knowledge base saving for each category the contained
+    subcategories and articles, and its supercategories, so that category
+    pages do not need to be loaded over and over again
+
+    The categories are kept in a SQLite database in the data directory and
+    are read and written one at a time, so several bots may use it at the
+    same time and nothing is lost if a bot is stopped. Categories loaded
+    more than maxage seconds ago (default: config.category_db_maxage) are
+    loaded from the wiki again.
 
     '''
-    def __init__(self, rebuild=False, filename='category.dump.bz2'):
+    def __init__(self, rebuild=False, filename='category.db', maxage=None):
+        if maxage is None:
+            maxage = config.category_db_maxage
+        self.maxage = maxage
+        self.lock = threading.Lock()
+        # entries used in this run; keys are (table, category)
+        self.cache = {}
+        self.db = None
+        if sqlite3 is not None:
+            if not os.path.isabs(filename):
+                filename = config.datafilepath(filename)
+            try:
+                self.db = sqlite3.connect(filename, timeout=30,
+                                          isolation_level=None,
+                                          check_same_thread=False)
+                for table in ('contents', 'supercats'):
+                    self.db.execute('CREATE TABLE IF NOT EXISTS %s '
+                                    '(site TEXT, title TEXT, fetched REAL, '
+                                    'data TEXT, PRIMARY KEY (site, title))'
+                                    % table)
+                self._init(os.path.join(os.path.dirname(filename),
+                                        'category.dump.bz2'), rebuild)
+            except sqlite3.Error, e:
+                pywikibot.warning(u'Could not open the category database: %s'
+                                  % e)
+                self.db = None
         if rebuild:
             self.rebuild()
-        else:
+
+    def _init(self, dumpfile, rebuild):
+        """Import the dump of older versions into a new database.
+
+        Whether this was done is recorded in the database, in the same
+        transaction, so the dump is imported only once even if several bots
+        are started at the same time.
+
+        """
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            if self.db.execute('PRAGMA user_version').fetchone()[0] == 0:
+                # databases of older versions don't record the import
+                empty = self.db.execute(
+                    'SELECT count(*) FROM contents').fetchone()[0] == 0
+                if empty and not rebuild:
+                    self._importDump(dumpfile)
+                self.db.execute('PRAGMA user_version = 1')
+        except:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    def rebuild(self):
+        """Discard all stored categories."""
+        self.cache = {}
+        if self.db is not None:
+            self.lock.acquire()
+            try:
+                self.db.execute('DELETE FROM contents')
+                self.db.execute('DELETE FROM supercats')
+            finally:
+                self.lock.release()
+
+    def _importDump(self, filename):
+        """Import the pickled database of older versions."""
+        if not os.path.exists(filename):
+            return
+        pywikibot.output(u'Importing dump from %s'
+                         % config.shortpath(filename))
+        try:
+            f = bz2.BZ2File(filename, 'r')
             try:
-                if not os.path.isabs(filename):
-                    filename = config.datafilepath(filename)
-                f = bz2.BZ2File(filename, 'r')
-                pywikibot.output(u'Reading dump from %s'
-                                 % config.shortpath(filename))
                 databases = pickle.load(f)
+            finally:
                 f.close()
-                # keys are categories, values are 2-tuples with lists as
-                # entries.
-                self.catContentDB = databases['catContentDB']
-                # like the above, but for supercategories
-                self.superclassDB = databases['superclassDB']
-                del databases
-            except:
-                # If something goes wrong, just rebuild the database
-                self.rebuild()
-
-    def rebuild(self):
-        self.catContentDB = {}
-        self.superclassDB = {}
+        except Exception:
+            # nothing to import then
+            return
+        # the age of the dump is the age of its entries
+        fetched = os.path.getmtime(filename)
+        for table, entries in (('contents', databases['catContentDB']),
+                               ('supercats', databases['superclassDB'])):
+            self.db.executemany(
+                'INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?)' % table,
+                [(repr(cat.site()), cat.title(), fetched,
+                  self._encode(table, value))
+                 for cat, value in entries.iteritems()])
+
+    def _encode(self, table, value):
+        if table == 'contents':
+            return json.dumps(([page.title() for page in value[0]],
+                               [page.title() for page in value[1]]))
+        return json.dumps([page.title() for page in value])
+
+    def _load(self, table, cat):
+        """Return the stored value for cat, or None if it is outdated."""
+        if (table, cat) in self.cache:
+            return self.cache[table, cat]
+        if self.db is None:
+            return None
+        self.lock.acquire()
+        try:
+            row = self.db.execute(
+                'SELECT data FROM %s WHERE site = ? AND title = ? '
+                'AND fetched >= ?' % table,
+                (repr(cat.site()), cat.title(), time.time() - self.maxage)
+            ).fetchone()
+        finally:
+            self.lock.release()
+        if row is None:
+            return None
+        site = cat.site()
+        data = json.loads(row[0])
+        if table == 'contents':
+            value = ([catlib.Category(site, title) for title in data[0]],
+                     [pywikibot.Page(site, title) for title in data[1]])
+        else:
+            value = [catlib.Category(site, title) for title in data]
+        self.cache[table, cat] = value
+        return value
+
+    def _store(self, table, cat, value):
+        """Store value for cat."""
+        self.cache[table, cat] = value
+        if self.db is None:
+            return
+        self.lock.acquire()
+        try:
+            self.db.execute('INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?)'
+                            % table, (repr(cat.site()), cat.title(),
+                                      time.time(), self._encode(table, value)))
+        finally:
+            self.lock.release()
+
+    def _contents(self, cat):
+        """Return a tuple of the lists of subcategories and articles of cat."""
+        value = self._load('contents', cat)
+        if value is None:
+            value = (cat.subcategoriesList(), cat.articlesList())
+            self._store('contents', cat, value)
+        return value
 
     def getSubcats(self, supercat):
         '''For a given supercategory, return a list of Categorys for all its
-        subcategories. Saves this list in a temporary database so that it won't
-        be loaded from the server next time it's required.
+        subcategories. Saves this list in the database so that it won't be
+        loaded from the server next time it's required.
 
         '''
-        # if we already know which subcategories exist here
-        if supercat in self.catContentDB:
-            return self.catContentDB[supercat][0]
-        else:
-            subcatlist = supercat.subcategoriesList()
-            articlelist = supercat.articlesList()
-            # add to dictionary
-            self.catContentDB[supercat] = (subcatlist, articlelist)
-            return subcatlist
+        return self._contents(supercat)[0]
 
     def getArticles(self, cat):
         '''For a given category, return a list of Pages for all its articles.
-        Saves this list in a temporary database so that it won't be loaded from
-        the server next time it's required.
+        Saves this list in the database so that it won't be loaded from the
+        server next time it's required.
 
         '''
-        # if we already know which articles exist here
-        if cat in self.catContentDB:
-            return self.catContentDB[cat][1]
-        else:
-            subcatlist = cat.subcategoriesList()
-            articlelist = cat.articlesList()
-            # add to dictionary
-            self.catContentDB[cat] = (subcatlist, articlelist)
-            return articlelist
+        return self._contents(cat)[1]
 
     def getSupercats(self, subcat):
-        # if we already know which subcategories exist here
-        if subcat in self.superclassDB:
-            return self.superclassDB[subcat]
-        else:
+        supercatlist = self._load('supercats', subcat)
+        if supercatlist is None:
             supercatlist = subcat.supercategoriesList()
-            # add to dictionary
-            self.superclassDB[subcat] = supercatlist
-            return supercatlist
+            self._store('supercats', subcat, supercatlist)
+        return supercatlist
+
+    def dump(self, filename=None):
+        '''Close the database.
 
-    def dump(self, filename='category.dump.bz2'):
-        '''Saves the contents of the dictionaries superclassDB and catContentDB
-        to disk.
+        All categories are saved as soon as they are loaded, so there is
+        nothing left to write.
 
         '''
-        if not os.path.isabs(filename):
-            filename = config.datafilepath(filename)
-        if self.catContentDB or self.superclassDB:
-            pywikibot.output(u'Dumping to %s, please wait...'
-                             % config.shortpath(filename))
-            f = bz2.BZ2File(filename, 'w')
-            databases = {
-                'catContentDB': self.catContentDB,
-                'superclassDB': self.superclassDB
-            }
-            # store dump to disk in binary format
+        if self.db is not None:
+            self.lock.acquire()
             try:
-                pickle.dump(databases, f, protocol=pickle.HIGHEST_PROTOCOL)
-            except pickle.PicklingError:
-                pass
-            f.close()
-        else:
-            try:
-                os.remove(filename)
-            except EnvironmentError:
-                pass
-            else:
-                pywikibot.output(u'Database is empty. %s removed'
-                                 % config.shortpath(filename))
+                self.db.close()
+                self.db = None
+            finally:
+                self.lock.release()
 
 
 class AddCategory:
@@ -16,9 +16,13 @@ Library to work with category pages on Wikipedia
 __version__ = '$Id$'
 #
 import re
+import sys
+import threading
 import urllib
+import Queue
 import wikipedia as pywikibot
 import query
+from pywikibot.tools import queueGet, queuePut
 
 msg_created_for_renaming = {
     'ar': u'روبوت: نقل من %s. المؤلفون: %s',
@@ -48,6 +52,9 @@ msg_created_for_renaming = {
 # some constants that are used internally
 ARTICLE = 0
 SUBCATEGORY = 1
+# messages of the _walk() worker threads
+_DONE = 2
+_ERROR = 3
 
 
 def isCatTitle(title, site):
@@ -62,6 +69,90 @@ def unique(l):
     return l
 
 
+def _walk(roots, members, maxdepth=None, key=None, seen=None, workers=None):
+    """Yield the contents of the categories roots and their subcategories.
+
+    members(category) must yield (tag, item) tuples, where tag is ARTICLE or
+    SUBCATEGORY. The subcategories are walked breadth-first: members() is
+    called for them in the order they were found by several worker threads,
+    so the categories of a level are loaded concurrently, and the items are
+    yielded as soon as they arrive.
+
+    Every item is yielded only once; key(item) identifies the items (default:
+    the item itself). seen may be a set of keys which are skipped. maxdepth
+    is the number of levels of subcategories to enter; None means no limit.
+
+    This should not be used outside of this module.
+
+    """
+    if key is None:
+        key = lambda item: item
+    if seen is None:
+        seen = set()
+    if workers is None:
+        workers = pywikibot.config.category_workers
+    jobs = Queue.Queue()
+    # buffer about ten API results of members not yet consumed
+    results = Queue.Queue(5000)
+    stopped = threading.Event()
+
+    def worker():
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            category, depth = job
+            try:
+                for tag, item in members(category):
+                    # give up if the walk has been stopped while the queue
+                    # was full
+                    if not queuePut(results, (tag, item, depth), stopped):
+                        return
+            except Exception:
+                queuePut(results, (_ERROR, sys.exc_info(), depth), stopped)
+            queuePut(results, (_DONE, category, depth), stopped)
+
+    pending = 0
+    for category in roots:
+        seen.add(key(category))
+        jobs.put((category, 0))
+        pending += 1
+    threads = []
+    for i in range(max(workers, 1)):
+        thread = threading.Thread(target=worker,
+                                  name='Category-Thread-%d' % i)
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    try:
+        while pending:
+            tag, item, depth = queueGet(results)
+            if tag == _DONE:
+                pending -= 1
+                continue
+            if tag == _ERROR:
+                raise item[0], item[1], item[2]
+            k = key(item)
+            if k in seen:
+                continue
+            seen.add(k)
+            yield tag, item
+            if tag == SUBCATEGORY and (maxdepth is None or depth < maxdepth):
+                jobs.put((item, depth + 1))
+                pending += 1
+    finally:
+        stopped.set()
+        for thread in threads:
+            jobs.put(None)
+
+
+def _maxdepth(recurse):
+    """Return the maxdepth for _walk() given by a recurse parameter."""
+    if recurse is True:
+        return None
+    return recurse
+
+
 class Category(pywikibot.Page):
     """Subclass of Page that has some special tricks that only work for
     category: pages
@@ -109,87 +200,85 @@ class Category(pywikibot.Page):
             return '[[%s]]' % titleWithSortKey
 
     def _getAndCacheContents(self, recurse=False, purge=False, startFrom=None,
-                             cache=None, sortby=None, sortdir=None,
-                             endsort=None):
+                             sortby=None, sortdir=None, endsort=None):
         """Cache results of _parseCategory for a second call.
 
         If recurse is a bool, and value is True, then recursively retrieves
         contents of all subcategories without limit. If recurse is an int,
         recursively retrieves contents of subcategories to that depth only.
+        The subcategories are walked breadth-first, see _walk().
 
         Other parameters are analogous to _parseCategory(). If purge is True,
         cached results will be discarded. If startFrom is used, nothing
-        will be cached.
+        will be cached; it only applies to this category.
 
         This should not be used outside of this module.
 
         """
-        if cache is None:
-            cache = []
+        if not recurse:
+            seen = set()
+            for tag, page in self._cachedContents(purge, startFrom, sortby,
+                                                  sortdir, endsort):
+                if page not in seen:
+                    seen.add(page)
+                    yield tag, page
+            return
+
+        def members(cat):
+            return cat._cachedContents(purge,
+                                       cat is self and startFrom or None,
+                                       sortby, sortdir, endsort)
+        for item in _walk([self], members, _maxdepth(recurse)):
+            yield item
+
+    def _cachedContents(self, purge=False, startFrom=None, sortby=None,
+                        sortdir=None, endsort=None):
+        """Yield the results of _parseCategory, loading them only once."""
         if purge:
             self.completelyCached = False
-        if recurse:
-            if type(recurse) is int:
-                newrecurse = recurse - 1
-            else:
-                newrecurse = recurse
         if self.completelyCached:
             for article in self.articleCache:
-                if article not in cache:
-                    cache.append(article)
-                    yield ARTICLE, article
+                yield ARTICLE, article
             for subcat in self.subcatCache:
-                if subcat not in cache:
-                    cache.append(subcat)
-                    yield SUBCATEGORY, subcat
-                    if recurse:
-                        # contents of subcategory are cached by calling
-                        # this method recursively; therefore, do not cache
-                        # them again
-                        for item in subcat._getAndCacheContents(
-                                newrecurse, purge, cache=cache, sortby=sortby,
-                                sortdir=sortdir, endsort=endsort):
-                            yield item
-        else:
-            for tag, page in self._parseCategory(purge, startFrom, sortby,
-                                                 sortdir, endsort):
-                if tag == ARTICLE:
-                    self.articleCache.append(page)
-                    if page not in cache:
-                        cache.append(page)
-                        yield ARTICLE, page
-                elif tag == SUBCATEGORY:
-                    self.subcatCache.append(page)
-                    if page not in cache:
-                        cache.append(page)
-                        yield SUBCATEGORY, page
-                        if recurse:
-                            # contents of subcategory are cached by calling
-                            # this method recursively; therefore, do not cache
-                            # them again
-                            for item in page._getAndCacheContents(
-                                    newrecurse, purge, cache=cache,
-                                    sortby=sortby, sortdir=sortdir):
-                                yield item
-            if not startFrom:
-                self.completelyCached = True
+                yield SUBCATEGORY, subcat
+            return
+        articles = []
+        subcats = []
+        for tag, page in self._parseCategory(purge, startFrom, sortby,
+                                             sortdir, endsort):
+            if tag == ARTICLE:
+                articles.append(page)
+            elif tag == SUBCATEGORY:
+                subcats.append(page)
+            yield tag, page
+        if not startFrom:
+            self.articleCache = articles
+            self.subcatCache = subcats
+            self.completelyCached = True
 
     def _getContentsNaive(self, recurse=False, startFrom=None, sortby=None,
                           sortdir=None, endsort=None):
         """Simple category content yielder. Naive, do not attempts to
         cache anything
 
+        The subcategories are walked breadth-first, see _walk(); startFrom
+        only applies to this category.
+
         """
-        for tag, page in self._parseCategory(startFrom=startFrom,
-                                             sortby=sortby, sortdir=sortdir,
-                                             endsort=endsort):
-            yield tag, page
-            if tag == SUBCATEGORY and recurse:
-                for item in page._getContentsNaive(recurse=True,
-                                                   sortby=sortby,
-                                                   sortdir=sortdir,
-                                                   endsort=endsort):
-                    yield item
+        if not recurse:
+            for item in self._parseCategory(startFrom=startFrom,
+                                            sortby=sortby, sortdir=sortdir,
+                                            endsort=endsort):
+                yield item
+            return
+
+        def members(cat):
+            return cat._parseCategory(startFrom=cat is self and startFrom
+                                      or None,
+                                      sortby=sortby, sortdir=sortdir,
+                                      endsort=endsort)
+        for item in _walk([self], members, _maxdepth(recurse)):
+            yield item
 
     def _parseCategory(self, purge=False, startFrom=None, sortby=None,
                        sortdir=None, endsort=None):
@@ -212,13 +301,9 @@ class Category(pywikibot.Page):
                 yield tag, page
             return
 
-        currentPageOffset = None
         params = {
-            'action': 'query',
-            'list': 'categorymembers',
             'cmtitle': self.title(),
             'cmprop': ['title', 'ids', 'sortkey', 'timestamp'],
-            #'': '',
         }
         if self.site().versionnumber() > 16:
             params['cmprop'].append('sortkeyprefix')
@@ -226,65 +311,40 @@ class Category(pywikibot.Page):
             params['cmsort'] = sortby
         if sortdir:
             params['cmdir'] = sortdir
-        while True:
-            if pywikibot.config.special_page_limit > 500:
-                params['cmlimit'] = 500
-            else:
-                params['cmlimit'] = pywikibot.config.special_page_limit
-
-            if currentPageOffset:
-                params.update(currentPageOffset)
-                pywikibot.output('Getting [[%s]] list from %s...'
-                                 % (self.title(),
-                                    "%s=%s" % currentPageOffset.popitem()))
-            else:
-                msg = 'Getting [[%s]] list' % self.title()
-                # category sort keys are uppercase
-                if startFrom:
-                    startFrom = startFrom.upper()
-                    params['cmstartsortkey'] = startFrom
-                    msg += ' starting at %s' % startFrom
-                if endsort:
-                    endsort = endsort.upper()
-                    params['cmendsortkey'] = endsort
-                    msg += ' ending at %s' % endsort
-                pywikibot.output(msg + u'...')
-
-            pywikibot.get_throttle()
-            data = query.GetData(params, self.site())
-            if 'error' in data:
-                raise RuntimeError("%s" % data['error'])
-            count = 0
-
-            for memb in data['query']['categorymembers']:
-                count += 1
-                # For MediaWiki versions where subcats look like articles
-                if memb['ns'] == 14:
-                    if 'sortkeyprefix' in memb:
-                        sortKeyPrefix = memb['sortkeyprefix']
-                    else:
-                        sortKeyPrefix = None
-                    yield SUBCATEGORY, Category(self.site(), memb['title'],
-                                                sortKey=memb['sortkey'],
-                                                sortKeyPrefix=sortKeyPrefix)
-                elif memb['ns'] == 6:
-                    yield ARTICLE, pywikibot.ImagePage(self.site(),
-                                                       memb['title'])
+        msg = 'Getting [[%s]] list' % self.title()
+        # category sort keys are uppercase
+        if startFrom:
+            startFrom = startFrom.upper()
+            params['cmstartsortkey'] = startFrom
+            msg += ' starting at %s' % startFrom
+        if endsort:
+            endsort = endsort.upper()
+            params['cmendsortkey'] = endsort
+            msg += ' ending at %s' % endsort
+        pywikibot.output(msg + u'...')
+
+        for memb in query.ListIterator(self.site(), 'categorymembers', 'cm',
+                                       params, throttle=True):
+            # For MediaWiki versions where subcats look like articles
+            if memb['ns'] == 14:
+                if 'sortkeyprefix' in memb:
+                    sortKeyPrefix = memb['sortkeyprefix']
                 else:
-                    page = pywikibot.Page(self.site(), memb['title'],
-                                          defaultNamespace=memb['ns'])
-                    if 'sortkeyprefix' in memb:
-                        page.sortkeyprefix = memb['sortkeyprefix']
-                    else:
-                        page.sortkeyprefix = None
-                    yield ARTICLE, page
-                if count >= params['cmlimit']:
-                    break
-            # try to find a link to the next list page
-            if 'query-continue' in data and count < params['cmlimit']:
-                currentPageOffset = data['query-continue']['categorymembers']
+                    sortKeyPrefix = None
+                yield SUBCATEGORY, Category(self.site(), memb['title'],
+                                            sortKey=memb['sortkey'],
+                                            sortKeyPrefix=sortKeyPrefix)
+            elif memb['ns'] == 6:
+                yield ARTICLE, pywikibot.ImagePage(self.site(),
+                                                   memb['title'])
             else:
-                break
+                page = pywikibot.Page(self.site(), memb['title'],
+                                      defaultNamespace=memb['ns'])
+                if 'sortkeyprefix' in memb:
+                    page.sortkeyprefix = memb['sortkeyprefix']
+                else:
+                    page.sortkeyprefix = None
+                yield ARTICLE, page
 
     def _oldParseCategory(self, purge=False, startFrom=None):
         """Yields all articles and subcategories that are in this category.
@@ -401,7 +461,7 @@ class Category(pywikibot.Page):
                 break
 
     def subcategories(self, recurse=False, startFrom=None, cacheResults=False,
-                      sortby=None, sortdir=None):
+                      sortby=None, sortdir=None, limit=None):
         """Yields all subcategories of the current category.
 
         If recurse is True, also yields subcategories of the subcategories.
@@ -409,22 +469,31 @@ class Category(pywikibot.Page):
         but only at most that number of levels deep (that is, recurse = 0 is
         equivalent to recurse = False, recurse = 1 gives first-level
         subcategories of subcategories but no deeper, etcetera).
+        Subcategories are loaded breadth-first by config.category_workers
+        threads.
 
         cacheResults - cache the category contents: useful if you need to
         do several passes on the category members list. The simple cache
         system is *not* meant to be memory or cpu efficient for large
         categories
 
+        limit - stop after this many subcategories
+
         Results a sorted (as sorted by MediaWiki), but need not be unique.
+        When recursing, each subcategory is yielded only once.
 
         """
         if cacheResults:
             gen = self._getAndCacheContents
         else:
             gen = self._getContentsNaive
+        count = 0
         for tag, subcat in gen(recurse=recurse, startFrom=startFrom,
                                sortby=sortby, sortdir=sortdir):
             if tag == SUBCATEGORY:
+                if limit is not None and count >= limit:
+                    return
+                count += 1
                 yield subcat
 
     def subcategoriesList(self, recurse=False, sortby=None, sortdir=None):
@@ -442,29 +511,36 @@ class Category(pywikibot.Page):
         return unique(subcats)
 
     def articles(self, recurse=False, startFrom=None, cacheResults=False,
-                 sortby=None, sortdir=None, endsort=None):
+                 sortby=None, sortdir=None, endsort=None, limit=None):
         """Yields all articles of the current category.
 
         If recurse is True, also yields articles of the subcategories.
         Recurse can be a number to restrict the depth at which subcategories
-        are included.
+        are included. Subcategories are loaded breadth-first by
+        config.category_workers threads.
 
         cacheResults - cache the category contents: useful if you need to
         do several passes on the category members list. The simple cache
         system is *not* meant to be memory or cpu efficient for large
         categories
 
+        limit - stop after this many articles
+
         Results are unsorted (except as sorted by MediaWiki), and need not
-        be unique.
+        be unique. When recursing, each article is yielded only once.
 
         """
         if cacheResults:
             gen = self._getAndCacheContents
         else:
             gen = self._getContentsNaive
+        count = 0
         for tag, page in gen(recurse=recurse, startFrom=startFrom,
                              sortby=sortby, sortdir=sortdir, endsort=endsort):
             if tag == ARTICLE:
+                if limit is not None and count >= limit:
+                    return
+                count += 1
                 yield page
 
     def articlesList(self, recurse=False, sortby=None, sortdir=None):
@@ -696,55 +772,67 @@ def change_category(article, oldCat, newCat, comment=None, sortKey=None,
                              % (article.title(asLink=True), error.message))
 
 
-def categoryAllElementsAPI(CatName, cmlimit=5000, categories_parsed=[],
+def categoryAllElementsAPI(CatName, cmlimit=5000, categories_parsed=None,
                            site=None):
     """ Category to load all the elements in a category using the APIs.
     Limit: 5000 elements.
 
-    """
-    pywikibot.output("Loading %s..." % CatName)
+    The subcategories are loaded concurrently, see _walk(). Every element is
+    returned once. Categories listed in categories_parsed are not loaded.
+    Return a tuple of the list of elements and the list of the titles of
+    the parsed categories.
 
-    # action=query&list=categorymembers&cmlimit=500&cmtitle=Category:License_tags
-    params = {
-        'action':  'query',
-        'list':    'categorymembers',
-        'cmlimit': cmlimit,
-        'cmtitle': CatName,
-    }
+    """
+    if categories_parsed is None:
+        categories_parsed = []
+
+    def members(category):
+        title = category['title']
+        limit = title == CatName and cmlimit or 5000
+        pywikibot.output("Loading %s..." % title)
+        # action=query&list=categorymembers&cmlimit=500&cmtitle=Category:License_tags
+        params = {
+            'action':  'query',
+            'list':    'categorymembers',
+            'cmlimit': limit,
+            'cmtitle': title,
+        }
+        data = query.GetData(params, site)
+        try:
+            result = data['query']['categorymembers']
+        except KeyError:
+            if int(limit) != 500:
+                pywikibot.output(
+                    u'An Error occured, trying to reload the category.')
+                params['cmlimit'] = limit = 500
+                data = query.GetData(params, site)
+            try:
+                result = data['query']['categorymembers']
+            except KeyError:
+                raise pywikibot.Error(data)
+        if len(result) == int(limit):
+            raise pywikibot.Error(
+                u'The category selected has >= %s elements, limit reached.'
+                % limit)
+        for member in result:
+            if member['ns'] == 14:
+                yield SUBCATEGORY, member
+            else:
+                yield ARTICLE, member
 
-    data = query.GetData(params, site)
+    seen = set(categories_parsed)
+    categories_parsed = list(categories_parsed)
     categories_parsed.append(CatName)
-    try:
-        members = data['query']['categorymembers']
-    except KeyError:
-        if int(cmlimit) != 500:
-            pywikibot.output(
-                u'An Error occured, trying to reload the category.')
-            return categoryAllElementsAPI(CatName, cmlimit=500)
-        else:
-            raise pywikibot.Error(data)
-    if len(members) == int(cmlimit):
-        raise pywikibot.Error(
-            u'The category selected has >= %s elements, limit reached.'
-            % cmlimit)
-    allmembers = members
     results = list()
-    for subcat in members:
-        ns = subcat['ns']
-        title = subcat['title']
-        if ns == 14:
-            if title not in categories_parsed:
-                categories_parsed.append(title)
-                (results_part,
-                 categories_parsed) = categoryAllElementsAPI(title, 5000,
-                                                             categories_parsed)
-                allmembers.extend(results_part)
-    for member in allmembers:
+    for tag, member in _walk([{'title': CatName}], members,
+                             key=lambda member: member['title'], seen=seen):
+        if tag == SUBCATEGORY:
+            categories_parsed.append(member['title'])
         results.append(member)
     return (results, categories_parsed)
 
 
-def categoryAllPageObjectsAPI(CatName, cmlimit=5000, categories_parsed=[],
+def categoryAllPageObjectsAPI(CatName, cmlimit=5000, categories_parsed=None,
                               site=None):
     """From a list of dictionaries, return a list of page objects."""
     final = list()
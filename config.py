@@ -235,6 +235,15 @@ interwiki_graph = False
 # once.
 interwiki_min_subjects = 100
 
+# Number of sites from which interwiki.py loads pages at the same time. Each
+# site is slowed down by its own throttle.
+interwiki_query_sites = 4
+
+# Don't start new subjects while the texts of the pages of the subjects
+# interwiki.py is working on exceed this many bytes, even if there are fewer
+# than interwiki_min_subjects. None means no limit.
+interwiki_max_bytes = None
+
 # If interwiki graphs are enabled, which format(s) should be used?
 # Supported formats include png, jpg, ps, and svg. See:
 # http://www.graphviz.org/doc/info/output.html
@@ -258,9 +267,8 @@ interwiki_graph_url = None
 # Save file with local articles without interwikis.
 without_interwiki = False
 
-# Experimental feature:
-# Store the page contents on disk (/cache/ directory) instead of loading
-# them in RAM.
+# Store the page contents compressed on disk (/cache/ directory) instead of
+# keeping them in RAM.
 interwiki_contents_on_disk = False
 
 ############## SOLVE_DISAMBIGUATION SETTINGS ############
@@ -294,6 +302,12 @@ maxthrottle = 60
 # 'put_throttle' seconds.
 put_throttle = 10
 
+# If True, all bot processes on this computer share one request budget per
+# wiki, stored in a small SQLite database in the data directory, instead of
+# counting each other in the throttle.ctrl file. A process which is idle
+# doesn't use up any of the budget.
+shared_throttle = True
+
 # Sometimes you want to know when a delay is inserted. If a delay is larger
 # than 'noisysleep' seconds, it is logged on the screen.
 noisysleep = 3.0
@@ -331,9 +345,18 @@ table2wikiSkipWarnings = False
 
 # How many external links should weblinkchecker.py check at the same time?
 # If you have a fast connection, you might want to increase this number so
-# that slow servers won't slow you down.
+# that slow servers won't slow you down. All links are checked by a single
+# thread, so this may be set to some hundreds.
 max_external_links = 50
 
+# weblinkchecker.py opens at most this many connections to one web server,
+# and waits this many seconds between two requests to the same server.
+weblink_host_connections = 2
+weblink_host_delay = 1
+
+# Seconds without an answer after which weblinkchecker.py gives up on a link.
+weblink_timeout = 30
+
 report_dead_links_on_talk = False
 
 # Don't alert on links days_dead old or younger
@@ -436,6 +459,18 @@ copyright_economize_query = True
 # Default socket timeout. Set to None to disable timeouts.
 socket_timeout = 120  # set a pretty long timeout just in case...
 
+# Keep HTTP/1.1 connections alive and reuse them for further requests to the
+# same host. This avoids a TCP (and TLS) handshake for every API call or edit.
+persistent_http = True
+# Maximum number of idle connections kept open for every host.
+max_idle_connections = 4
+# Maximum number of idle connections kept open for all hosts together. All
+# urllib2 requests go through the pool, including those to external sites.
+max_total_idle_connections = 16
+# Close connections which have been idle for this many seconds. Servers
+# usually drop kept-alive connections after some time on their own.
+connection_idle_timeout = 30
+
 
 ############## COSMETIC CHANGES SETTINGS ##############
 # The bot can make some additional changes to each page it edits, e.g. fix
@@ -485,9 +520,57 @@ replicate_replace = {}
 # Use the experimental disk cache to prevent huge memory usage
 use_diskcache = False
 
-# Retry loading a page on failure (back off 1 minute, 2 minutes, 4 minutes
-# up to 30 minutes)
+# Retry loading a page on failure. The bot waits about 'retry_wait' seconds
+# before the first retry and four times as long before each further one,
+# but never more than 'retry_max_wait' seconds, unless the server asks for
+# a longer break. The waits are randomized a little, so several bots don't
+# retry all at once. A request is given up after 'maxretries' retries, but
+# only once the waits add up to about 'retry_budget' seconds, so a bot
+# survives a server outage of half an hour.
 retry_on_fail = True
+retry_wait = 0.5
+retry_max_wait = 30 * 60
+retry_budget = 31 * 60
+
+# Server responses taking longer than 'slow_response' seconds are taken as a
+# sign of server overload: like errors, they halve the request rate, which
+# recovers step by step with each fast response. Responses larger than
+# 'slow_response_bytes' (like big Export or getall batches) may take
+# proportionally longer.
+slow_response = 20
+slow_response_bytes = 1024 * 1024
+
+# Number of parsed page titles kept in memory. Creating Page objects for
+# titles seen before is much faster then.
+page_title_cache = 10000
+
+# Keep the site information (general data, namespaces, magic words, ...) and
+# the MediaWiki messages of each site on disk, so later runs don't need to
+# load them from the wiki again. The site information is refreshed in the
+# background if it is older than 'site_snapshot_ttl' seconds; older messages
+# are loaded from the wiki again.
+site_snapshot = True
+site_snapshot_ttl = 24 * 3600
+
+# Keep responses of read-only API queries in a cache on disk and reuse them,
+# also in later runs. 'api_cache_ttl' gives the number of seconds a response
+# is used for each kind of query (meta, list or generator module); queries
+# using a module not listed here are not cached. Queries about some pages and
+# category listings are only reused as long as the last revision and the
+# touched time of the pages have not changed, which is checked with a small
+# info query. Queries with tokens and about the logged in user (userinfo) are
+# never cached.
+api_cache = False
+api_cache_ttl = {
+    'siteinfo': 7 * 24 * 3600,
+    'allmessages': 24 * 3600,
+    'revids': 30 * 24 * 3600,
+    'pages': 30 * 24 * 3600,
+    'categorymembers': 24 * 3600,
+    'backlinks': 3600,
+    'embeddedin': 3600,
+    'imageusage': 3600,
+}
 
 ### Simulate settings ###
 # Defines what actions the bots are NOT allowed to do (e.g. 'edit') on wikipedia
@@ -510,6 +593,30 @@ actions_to_block = ['edit', 'watch', 'move', 'delete', 'undelete', 'protect',
 # processing. As higher this value this effect will decrease.
 max_queue_size = 64
 
+# Queueing further pages waits while the texts in the asynchronous queue are
+# bigger than this many bytes. None means no limit.
+max_queue_bytes = 10 * 1024 * 1024
+
+# PreloadingGenerator loads this many batches of pages in the background
+# while the current batch is processed. Set to 0 to load each batch only
+# when it is needed.
+preload_lookahead = 1
+# Number of threads loading batches in the background. Batches of different
+# sites (or further batches of the same site) are loaded concurrently.
+preload_workers = 2
+# Stop loading further batches in advance if the texts already loaded but
+# not yet processed exceed this many bytes. None means no limit.
+preload_max_bytes = 50 * 1024 * 1024
+
+# Number of threads loading the subcategories of a category tree
+# concurrently when the contents of a category are retrieved recursively.
+category_workers = 4
+
+# category.py keeps the categories loaded for the tidy and tree actions in
+# a database; categories loaded more than this many seconds ago are loaded
+# again.
+category_db_maxage = 7 * 24 * 3600
+
 # Define the line separator. Pages retrieved via API have "\n" whereas
 # pages fetched from screen (mostly) have "\r\n". Interwiki and category
 # separator settings in family files should use multiplied of this.
@@ -187,7 +187,6 @@ _patch_permission = None
 
 import os
 import sys
-import inspect
 import wikipedia as pywikibot  # sets externals path
 #from pywikibot.comms import http
 
@@ -219,6 +218,7 @@ def guess_system():
 
 
 def show_question(module):
+    import inspect
     lowlevel_warning("Required package missing: %s\n"
                      "This package is not installed, but required by the file"
                      " '%s'." % (module, inspect.stack()[2][1]))
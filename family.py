@@ -22,6 +22,9 @@ class Family(object):
         if not hasattr(self, 'name'):
             self.name = None
 
+        # lookup tables for getNamespaceIndex(), built on first use
+        self._namespaceIndexes = {}
+
         # For interwiki sorting order see
         # http://meta.wikimedia.org/wiki/Interwiki_sorting_order
 
@@ -4202,6 +4205,28 @@ class Family(object):
                 return self.namespace(code, ns)
         return value
 
+    def _namespaceIndex(self, lang):
+        """Return a dict mapping the lowercased namespace names defined for
+        lang to the namespace indexes.
+
+        """
+        index = self._namespaceIndexes.get(lang)
+        if index is None:
+            index = {}
+            for n in self.namespaces.keys():
+                try:
+                    nslist = self.namespaces[n][lang]
+                    if type(nslist) is not list:
+                        nslist = [nslist]
+                    for ns in nslist:
+                        # the first namespace using a name wins
+                        index.setdefault(ns.lower(), n)
+                except (KeyError, AttributeError):
+                    # The namespace has no localized name defined
+                    pass
+            self._namespaceIndexes[lang] = index
+        return index
+
     def getNamespaceIndex(self, lang, namespace):
         """Given a namespace, attempt to match it with all available
         namespaces. Sites may have more than one way to write the same
@@ -4210,21 +4235,13 @@ class Family(object):
 
         """
         namespace = namespace.lower()
-        for n in self.namespaces.keys():
-            try:
-                nslist = self.namespaces[n][lang]
-                if type(nslist) is not list:
-                    nslist = [nslist]
-                for ns in nslist:
-                    if ns.lower() == namespace:
-                        return n
-            except (KeyError, AttributeError):
-                # The namespace has no localized name defined
-                pass
+        n = self._namespaceIndex(lang).get(namespace)
+        if n is not None:
+            return n
         if lang != '_default':
             # This is not a localized namespace. Try if it
             # is a default (English) namespace.
-            return self.getNamespaceIndex('_default', namespace)
+            return self._namespaceIndex('_default').get(namespace)
         else:
             # give up
             return None
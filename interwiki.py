@@ -304,11 +304,29 @@ The following arguments influence how many pages the bot works on at once:
     -query:        The maximum number of pages that the bot will load at once.
                    Default value is 50.
 
+    -querysites:   The number of sites the bot will load pages from at the
+                   same time. The default is 4, but can be changed in the
+                   config variable interwiki_query_sites
+
+    -arraybytes:   Don't load new pages from the starting wiki while the
+                   texts of the pages the bot is working on exceed this many
+                   bytes, even if there are fewer subjects than given by
+                   -array. The default is no limit, but can be changed in the
+                   config variable interwiki_max_bytes
+
 Some configuration option can be used to change the working of this robot:
 
 interwiki_min_subjects: the minimum amount of subjects that should be processed
                     at the same time.
 
+interwiki_query_sites: the number of sites to load pages from at the same time.
+
+interwiki_max_bytes: the maximum size of the texts of the pages processed at the
+                    same time.
+
+interwiki_contents_on_disk: store the page texts in a file instead of keeping
+                    them in memory.
+
 interwiki_backlink: if set to True, all problems in foreign wikis will
                     be reported
 
@@ -349,12 +367,17 @@ import os
 import datetime
 import time
 import codecs
+import itertools
 import socket
+import threading
 import webbrowser
+import Queue
 import wikipedia as pywikibot
 import config
 import pagegenerators
 from pywikibot import i18n
+from pywikibot import pagestore
+from pywikibot.tools import queueGet
 import interwiki_graph
 import titletranslate
 
@@ -485,6 +508,8 @@ class Global(object):
     rememberno = False
     followinterwiki = True
     minsubjects = config.interwiki_min_subjects
+    querysites = config.interwiki_query_sites
+    maxbytes = config.interwiki_max_bytes
     nobackonly = False
     askhints = False
     hintnobracket = False
@@ -595,6 +620,10 @@ class Global(object):
             self.minsubjects = int(arg[7:])
         elif arg.startswith('-query:'):
             self.maxquerysize = int(arg[7:])
+        elif arg.startswith('-querysites:'):
+            self.querysites = int(arg[12:])
+        elif arg.startswith('-arraybytes:'):
+            self.maxbytes = int(arg[12:])
         elif arg == '-back':
             self.nobackonly = True
         elif arg == '-quiet':
@@ -629,10 +658,11 @@ class StoredPage(pywikibot.Page):
     # Please prefix the class members names by SP
     # to avoid possible name clashes with pywikibot.Page
 
-    # path to the shelve
-    SPpath = None
-    # shelve
+    # PageStore holding the contents of all StoredPages
     SPstore = None
+    # keys of the contents in SPstore
+    SPkeys = itertools.count()
+    SPlock = threading.Lock()
 
     # attributes created by pywikibot.Page.__init__
     SPcopy = ['_editrestriction',
@@ -651,43 +681,64 @@ class StoredPage(pywikibot.Page):
               '_deletedRevs']
 
     def SPdeleteStore():
-        if StoredPage.SPpath:
-            del StoredPage.SPstore
-            os.unlink(StoredPage.SPpath)
+        if StoredPage.SPstore is not None:
+            if pywikibot.verbose:
+                pywikibot.output(u'Page store: %(texts)i texts, %(size)i '
+                                 u'bytes in a file of %(file)i bytes'
+                                 % StoredPage.SPstore.stats())
+            StoredPage.SPstore.close()
+            StoredPage.SPstore = None
     SPdeleteStore = staticmethod(SPdeleteStore)
 
     def __init__(self, page):
         for attr in StoredPage.SPcopy:
             setattr(self, attr, getattr(page, attr))
 
-        if not StoredPage.SPpath:
-            import shelve
-            index = 1
-            while True:
-                path = config.datafilepath('cache', 'pagestore' + str(index))
-                if not os.path.exists(path):
-                    break
-                index += 1
-            StoredPage.SPpath = path
-            StoredPage.SPstore = shelve.open(path)
-
-        self.SPkey = str(self)
+        StoredPage.SPlock.acquire()
+        try:
+            if StoredPage.SPstore is None:
+                index = 1
+                while True:
+                    path = config.datafilepath('cache',
+                                               'pagestore' + str(index))
+                    if not os.path.exists(path):
+                        break
+                    index += 1
+                StoredPage.SPstore = pagestore.PageStore(path)
+            # the same page may be stored for several subjects
+            self.SPkey = StoredPage.SPkeys.next()
+        finally:
+            StoredPage.SPlock.release()
         self.SPcontentSet = False
+        self.SPsize = 0
 
     def SPgetContents(self):
         return StoredPage.SPstore[self.SPkey]
 
     def SPsetContents(self, contents):
-        self.SPcontentSet = True
         StoredPage.SPstore[self.SPkey] = contents
+        self.SPcontentSet = True
+        self.SPsize = len(contents)
 
     def SPdelContents(self):
         if self.SPcontentSet:
             del StoredPage.SPstore[self.SPkey]
+            self.SPcontentSet = False
+            self.SPsize = 0
 
     _contents = property(SPgetContents, SPsetContents, SPdelContents)
 
 
+def contentSize(page):
+    """Return the length of the text of page loaded by the bot."""
+    if isinstance(page, StoredPage):
+        return page.SPsize
+    try:
+        return len(page._contents)
+    except AttributeError:
+        return 0
+
+
 class PageTree(object):
     """
     Structure to manipulate a set of pages.
@@ -1808,6 +1859,10 @@ u'WARNING: %s is in namespace %i, but %s is in namespace %i. Follow it anyway?'
                 if hasattr(page, '_contents'):
                     del page._contents
 
+    def contentSize(self):
+        """Return the length of the texts loaded for this Subject."""
+        return sum([contentSize(page) for page in self.foundIn])
+
     def replaceLinks(self, page, newPages):
         """
         Returns True if saving was successful.
@@ -2225,6 +2280,10 @@ class InterwikiBot(object):
                 self.pageGenerator = None
                 break
 
+    def contentSize(self):
+        """Return the length of the texts loaded for all subjects."""
+        return sum([subject.contentSize() for subject in self.subjects])
+
     def firstSubject(self):
         """Return the first subject that is still being worked on"""
         if self.subjects:
@@ -2263,7 +2322,10 @@ class InterwikiBot(object):
         # some subjects may need to retrieve a second home-language page!
         if len(self.subjects) - mycount < globalvar.minsubjects:
             # Can we make more home-language queries by adding subjects?
-            if self.pageGenerator and mycount < globalvar.maxquerysize:
+            # Not if the texts loaded already use up the memory budget.
+            if self.pageGenerator and mycount < globalvar.maxquerysize \
+                    and (globalvar.maxbytes is None
+                         or self.contentSize() < globalvar.maxbytes):
                 timeout = 60
                 while timeout < 3600:
                     try:
@@ -2288,10 +2350,26 @@ class InterwikiBot(object):
         # foreign page queries we can find.
         return self.maxOpenSite()
 
+    def querySites(self, site):
+        """Return the sites to load pages from in the next step.
+
+        These are site and the other sites with the most open queries, up to
+        globalvar.querysites sites.
+
+        """
+        others = [other for other, count in self.counts.iteritems()
+                  if count > 0 and other != site]
+        others.sort(key=lambda other: (-self.counts[other], other))
+        return [site] + others[:globalvar.querysites - 1]
+
     def oneQuery(self):
         """
         Perform one step in the solution process.
 
+        The pages of several sites are loaded at the same time, see
+        querySites(). Each subject is told as soon as its batch has been
+        loaded.
+
         Returns True if pages could be preloaded, or false
         otherwise.
         """
@@ -2300,31 +2378,60 @@ class InterwikiBot(object):
         if site is None:
             pywikibot.output(u"NOTE: Nothing left to do")
             return False
-        # Now assemble a reasonable list of pages to get
-        subjectGroup = []
-        pageGroup = []
-        for subject in self.subjects:
-            # Promise the subject that we will work on the site.
-            # We will get a list of pages we can do.
-            pages = subject.whatsNextPageBatch(site)
-            if pages:
-                pageGroup.extend(pages)
-                subjectGroup.append(subject)
-                if len(pageGroup) >= globalvar.maxquerysize:
-                    # We have found enough pages to fill the bandwidth.
-                    break
-        if len(pageGroup) == 0:
+        # Now assemble a reasonable list of pages to get from each site;
+        # a subject can only wait for one batch at a time
+        batches = []
+        busy = set()
+        for site in self.querySites(site):
+            subjectGroup = []
+            pageGroup = []
+            for subject in self.subjects:
+                if subject in busy:
+                    continue
+                # Promise the subject that we will work on the site.
+                # We will get a list of pages we can do.
+                pages = subject.whatsNextPageBatch(site)
+                if pages:
+                    pageGroup.extend(pages)
+                    subjectGroup.append(subject)
+                    busy.add(subject)
+                    if len(pageGroup) >= globalvar.maxquerysize:
+                        # We have found enough pages to fill the bandwidth.
+                        break
+            if pageGroup:
+                batches.append((subjectGroup, pageGroup))
+        if not batches:
             pywikibot.output(u"NOTE: Nothing left to do 2")
             return False
-        # Get the content of the assembled list in one blow
-        gen = pagegenerators.PreloadingGenerator(iter(pageGroup))
-        for page in gen:
-            # we don't want to do anything with them now. The
-            # page contents will be read via the Subject class.
-            pass
-        # Tell all of the subjects that the promised work is done
-        for subject in subjectGroup:
-            subject.batchLoaded(self)
+        # Get the content of each assembled list in one blow; each site is
+        # slowed down by its own throttle
+        done = Queue.Queue()
+
+        def load(batch):
+            error = None
+            try:
+                for page in pagegenerators.PreloadingGenerator(
+                        iter(batch[1]), lookahead=0):
+                    # we don't want to do anything with them now. The
+                    # page contents will be read via the Subject class.
+                    pass
+            except:
+                # raised again by the main thread
+                error = sys.exc_info()
+            done.put((batch, error))
+
+        for batch in batches:
+            thread = threading.Thread(target=load, args=(batch,),
+                                      name='Interwiki-Query-Thread')
+            thread.setDaemon(True)
+            thread.start()
+        for i in xrange(len(batches)):
+            (subjectGroup, pageGroup), error = queueGet(done)
+            if error is not None:
+                raise error[0], error[1], error[2]
+            # Tell the subjects that the promised work is done
+            for subject in subjectGroup:
+                subject.batchLoaded(self)
         return True
 
     def queryStep(self):
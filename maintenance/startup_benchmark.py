@@ -0,0 +1,97 @@
+# -*- coding: utf-8  -*-
+"""
+Measure the startup time of the framework.
+
+Every run starts a new Python interpreter, which imports wikipedia.py and
+then creates a Family, some Site objects and Page objects, like a short bot
+script does. The median times of all runs are printed in milliseconds.
+
+Command line options:
+
+-runs:n         Number of runs (default: 10)
+
+-family:name    Family to use (default: wikipedia)
+
+-sites:n        Number of Site objects created in each run (default: 50)
+
+-pages:n        Number of Page objects created in each run (default: 10000)
+"""
+#
+# (C) Pywikibot team, 2014
+#
+# Distributed under the terms of the MIT license.
+#
+__version__ = '$Id$'
+#
+
+import os
+import subprocess
+import sys
+
+# the code run in each interpreter; it prints the times of every step
+_SNIPPET = r'''
+import sys, time
+start = time.time()
+import wikipedia
+imported = time.time()
+family = wikipedia.Family(%(family)r, force=True)
+familytime = time.time()
+codes = sorted(family.langs.keys())[:%(sites)i]
+sites = [wikipedia.Site(code, family.name) for code in codes]
+sitetime = time.time()
+site = sites[0]
+names = [u'Talk:Page %%i', u'Category:Category %%i', u'Article_%%i']
+for i in xrange(%(pages)i):
+    wikipedia.Page(site, names[i %% 3] %% i)
+pagetime = time.time()
+for s in sites:
+    s.validLanguageLinks()
+linktime = time.time()
+print imported - start, familytime - imported, sitetime - familytime, \
+      pagetime - sitetime, linktime - pagetime
+'''
+
+_STEPS = ['import wikipedia', 'Family()', 'Site()', 'Page()',
+          'validLanguageLinks()']
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    runs = 10
+    options = {'family': 'wikipedia', 'sites': 50, 'pages': 10000}
+    for arg in sys.argv[1:]:
+        if arg.startswith('-runs:'):
+            runs = int(arg[6:])
+        elif arg.startswith('-family:'):
+            options['family'] = arg[8:]
+        elif arg.startswith('-sites:'):
+            options['sites'] = int(arg[7:])
+        elif arg.startswith('-pages:'):
+            options['pages'] = int(arg[7:])
+        else:
+            print __doc__
+            return
+    snippet = _SNIPPET % options
+    basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = [[] for step in _STEPS]
+    for run in range(runs):
+        output = subprocess.Popen([sys.executable, '-c', snippet],
+                                  cwd=basedir,
+                                  stdout=subprocess.PIPE).communicate()[0]
+        times = output.strip().splitlines()[-1].split()
+        for i, value in enumerate(times):
+            results[i].append(float(value))
+    print 'Median of %i runs (%i sites, %i pages):' % (runs, options['sites'],
+                                                       options['pages'])
+    for step, values in zip(_STEPS, results):
+        print '%-22s %8.1f ms' % (step, median(values) * 1000)
+    print '%-22s %8.1f ms' % ('total', sum(median(values)
+                                            for values in results) * 1000)
+
+
+if __name__ == '__main__':
+    main()
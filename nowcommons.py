@@ -258,12 +258,10 @@ class NowCommonsDeleteBot:
             nowCommonsTemplates = [pywikibot.Page(self.site, title,
                                                   defaultNamespace=10)
                                    for title in self.ncTemplates()]
-            gens = [pg.ReferringPageGenerator(t, followRedirects=True,
-                                              onlyTemplateInclusion=True)
-                    for t in nowCommonsTemplates]
-            gen = pg.CombinedPageGenerator(gens)
+            gen = pg.ReferringPagesGenerator(nowCommonsTemplates,
+                                             followRedirects=True,
+                                             onlyTemplateInclusion=True)
             gen = pg.NamespaceFilterPageGenerator(gen, [6])
-            gen = pg.DuplicateFilterPageGenerator(gen)
             gen = pg.PreloadingGenerator(gen)
         return gen
 
@@ -21,14 +21,19 @@ These parameters are supported to specify which pages titles to print:
 __version__ = '$Id$'
 
 import re
+import sys
 import codecs
+import collections
 import date
 import datetime
+import threading
 import traceback
+import Queue
 import wikipedia as pywikibot
 import config
 from pywikibot import i18n
 from pywikibot.support import deprecate_arg
+from pywikibot.tools import itergroup, waitFor
 import catlib
 import userlib
 
@@ -630,6 +635,29 @@ def ReferringPageGenerator(referredPage, followRedirects=False,
         yield page
 
 
+def ReferringPagesGenerator(referredPages, followRedirects=False,
+                            withTemplateInclusion=True,
+                            onlyTemplateInclusion=False):
+    """Yield all pages referring to any of referredPages, once each.
+
+    The references to all pages are retrieved together, so this is much
+    faster than combining a ReferringPageGenerator for each page.
+
+    """
+    referredPages = list(referredPages)
+    if not referredPages:
+        return
+    seen = set()
+    for page, ref in pywikibot.getallReferences(referredPages[0].site(),
+                                                referredPages,
+                                                followRedirects,
+                                                withTemplateInclusion,
+                                                onlyTemplateInclusion):
+        if ref not in seen:
+            seen.add(ref)
+            yield ref
+
+
 def CategorizedPageGenerator(category, recurse=False, start=None):
     """Yield all pages in a specific category.
 
@@ -1134,37 +1162,89 @@ def PageWithTalkPageGenerator(generator):
             yield page.toggleTalkPage()
 
 
+class _PreloadJob(object):
+    """For internal use only - one batch of pages of a single site."""
+
+    def __init__(self, site, pages):
+        self.site = site
+        self.pages = pages
+        self.size = 0
+        self.excinfo = None
+        self.done = threading.Event()
+
+    def run(self):
+        try:
+            try:
+                _preloadSite(self.site, self.pages)
+            except Exception:
+                self.excinfo = sys.exc_info()
+            self.size = sum(len(page._contents) for page in self.pages
+                            if hasattr(page, '_contents'))
+        finally:
+            self.done.set()
+
+    def wait(self):
+        waitFor(self.done.isSet, self.done.wait)
+        if self.excinfo:
+            raise self.excinfo[0], self.excinfo[1], self.excinfo[2]
+
+
+def _preloadSite(site, pages, retry=False):
+    """Load pages of a single site with getall; retry once on SaxError."""
+    try:
+        pywikibot.getall(site, pages)
+    except pywikibot.SaxError:
+        if not retry:
+            # Retry once.
+            _preloadSite(site, pages, retry=True)
+        # Ignore this error, and get the pages the traditional way later.
+
+
 class PreloadingGenerator(object):
     """
     Yields the same pages as generator generator. Retrieves 60 pages (or
     another number specified by pageNumber), loads them using
     Special:Export, and yields them one after the other. Then retrieves more
     pages, etc. Thus, it is not necessary to load each page separately.
-    Operates asynchronously, so the next batch of pages is loaded in the
-    background before the first batch is fully consumed.
+
+    Operates asynchronously: while one batch is consumed, the next lookahead
+    batches are loaded by worker threads in the background. Pages of
+    different sites within a batch are loaded concurrently. No further
+    batch is scheduled as long as the texts loaded in advance exceed
+    maxbytes.
+    With lookahead=0 every batch is loaded right before it is yielded.
+
+    @param lookahead: number of batches loaded in advance
+        (default: config.preload_lookahead)
+    @param workers: number of loading threads
+        (default: config.preload_workers)
+    @param maxbytes: budget for texts loaded in advance; None for no limit
+        (default: config.preload_max_bytes)
 
     """
-    @deprecate_arg("lookahead", None)
-    def __init__(self, generator, pageNumber=60):
+    def __init__(self, generator, pageNumber=60, lookahead=None,
+                 workers=None, maxbytes=None):
         self.wrapped_gen = generator
         self.pageNumber = pageNumber
+        if lookahead is None:
+            lookahead = config.preload_lookahead
+        self.lookahead = lookahead
+        if workers is None:
+            workers = config.preload_workers
+        self.workers = max(workers, 1)
+        if maxbytes is None:
+            maxbytes = config.preload_max_bytes
+        self.maxbytes = maxbytes
 
     def __iter__(self):
         try:
-            # this array will contain up to pageNumber pages and will be flushed
-            # after these pages have been preloaded and yielded.
-            somePages = []
-            for page in self.wrapped_gen:
-                somePages.append(page)
-                # We don't want to load too many pages at once using XML export.
-                # We only get a maximum number at a time.
-                if len(somePages) >= self.pageNumber:
-                    for loaded_page in self.preload(somePages):
-                        yield loaded_page
-                    somePages = []
-            if somePages:
-                # wrapped generator is exhausted but some pages still unloaded
-                # preload remaining pages
+            if self.lookahead > 0:
+                for loaded_page in self._prefetch():
+                    yield loaded_page
+                return
+            for somePages in itergroup(self.wrapped_gen, self.pageNumber):
+                # We don't want to load too many pages at once using XML
+                # export. We only get a maximum number at a time.
                 for loaded_page in self.preload(somePages):
                     yield loaded_page
         except GeneratorExit:
@@ -1173,29 +1253,83 @@ class PreloadingGenerator(object):
             traceback.print_exc()
             pywikibot.output(unicode(e))
 
-    def preload(self, page_list, retry=False):
+    def _bysite(self, page_list):
+        """Split page_list into lists of pages of the same site."""
+        # It might be that the pages are on different sites,
+        # e.g. because the -interwiki parameter was used.
+        groups = []
+        sites = {}
+        for page in page_list:
+            site = page.site()
+            if site not in sites:
+                sites[site] = []
+                groups.append((site, sites[site]))
+            sites[site].append(page)
+        return groups
+
+    def _prefetch(self):
+        queue = Queue.Queue()
+        stopped = threading.Event()
+
+        def worker():
+            while True:
+                job = queue.get()
+                if job is None:
+                    return
+                if stopped.isSet():
+                    job.done.set()
+                else:
+                    job.run()
+
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=worker,
+                                      name='Preload-Thread-%d' % i)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        # batches in order; each batch is a list of _PreloadJob per site
+        pending = collections.deque()
+        source = itergroup(self.wrapped_gen, self.pageNumber)
         try:
-            while len(page_list) > 0:
-                # It might be that the pages are on different sites,
-                # e.g. because the -interwiki parameter was used.
-                # Query the sites one by one.
-                site = page_list[0].site()
-                pagesThisSite = [page for page in page_list
-                                 if page.site() == site]
-                page_list = [page for page in page_list
-                             if page.site() != site]
-                pywikibot.getall(site, pagesThisSite)
-                for page in pagesThisSite:
-                    yield page
-        except IndexError:
-            # Can happen if the pages list is empty. Don't care.
-            pass
-        except pywikibot.SaxError:
-            if not retry:
-                # Retry once.
-                self.preload(page_list, retry=True)
-            # Ignore this error, and get the pages the traditional way later.
-            pass
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) <= self.lookahead \
+                        and not self._overBudget(pending):
+                    try:
+                        somePages = source.next()
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    jobs = [_PreloadJob(site, pages)
+                            for site, pages in self._bysite(somePages)]
+                    for job in jobs:
+                        queue.put(job)
+                    pending.append(jobs)
+                if not pending:
+                    break
+                for job in pending.popleft():
+                    job.wait()
+                    for page in job.pages:
+                        yield page
+        finally:
+            stopped.set()
+            for thread in threads:
+                queue.put(None)
+
+    def _overBudget(self, pending):
+        """Return True if the pages loaded in advance exceed maxbytes."""
+        if not self.maxbytes or not pending:
+            return False
+        size = sum(job.size for jobs in pending for job in jobs
+                   if job.done.isSet())
+        return size > self.maxbytes
+
+    def preload(self, page_list, retry=False):
+        for site, pagesThisSite in self._bysite(page_list):
+            _preloadSite(site, pagesThisSite, retry)
+            for page in pagesThisSite:
+                yield page
 
 
 def main(*args):
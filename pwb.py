@@ -45,6 +45,62 @@ import sys
 import os
 import traceback
 import shelve
+import time
+import __builtin__
+
+
+## Import Time Report; shows which modules slow down the start of a bot
+#
+#  Run with '-importtime' as first option, e.g.
+#  @verbatim python pwb.py -importtime <name_of_script> <options> @endverbatim
+#  The report is written to stderr when the bot has finished; it includes
+#  the modules imported by the script and those imported later on first use.
+#
+class ImportTimer(object):
+
+    def __init__(self):
+        self.start = time.time()
+        self.scriptstart = None
+        self.records = []       # (depth, name, self time, total time)
+        self._stack = [0.0]     # time spent in the imports of each level
+        self._import = __builtin__.__import__
+
+    def install(self):
+        __builtin__.__import__ = self._timedImport
+
+    def _timedImport(self, name, globals=None, locals=None, fromlist=None,
+                     level=-1):
+        count = len(sys.modules)
+        self._stack.append(0.0)
+        start = time.time()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.time() - start
+            children = self._stack.pop()
+            self._stack[-1] += elapsed
+            # only imports which loaded a new module are of interest
+            if len(sys.modules) > count:
+                self.records.append((len(self._stack) - 1, name,
+                                     elapsed - children, elapsed))
+
+    def report(self, limit=30):
+        lines = ['The script was started after %.1f ms; %i modules were '
+                 'imported in %.1f ms.'
+                 % (((self.scriptstart or time.time()) - self.start) * 1000,
+                    len(self.records), self._stack[0] * 1000),
+                 '%10s %10s  module' % ('self [ms]', 'total [ms]')]
+        for depth, name, own, total in sorted(self.records,
+                                              key=lambda r: -r[2])[:limit]:
+            lines.append('%10.1f %10.1f  %s' % (own * 1000, total * 1000,
+                                                name))
+        return '\n'.join(lines) + '\n'
+
+importtimer = None
+if len(sys.argv) > 1 and sys.argv[1] == '-importtime':
+    sys.argv.pop(1)
+    importtimer = ImportTimer()
+    importtimer.install()
 
 # wikipedia-bot imports
 import userlib
@@ -173,6 +229,8 @@ else:
         d.close()
 
         sys.path.append(os.path.split(sys.argv[0])[0])
+        if importtimer:
+            importtimer.scriptstart = time.time()
         execfile(sys.argv[0])
 
         exitcode = ERROR_SGE_ok
@@ -200,6 +258,8 @@ else:
 
         pywikibot.stopme()
         (sys.stdout, sys.stderr) = (sys.__stdout__, sys.__stderr__)
+        if importtimer:
+            sys.stderr.write(importtimer.report())
 
         # use exitcode to control SGE (restart or stop with sending mail)
         # re-raised errors occouring in 'except' clause are skipped because
@@ -0,0 +1,226 @@
+# -*- coding: utf-8  -*-
+"""
+Persistent cache of API responses.
+
+query.GetData() looks up read-only API queries in this cache if
+config.api_cache is True. The responses are kept in a SQLite database in
+the data directory, so they are reused by later runs of the bots.
+
+How long a response is used depends on what was queried (config.api_cache_ttl):
+    - meta information like siteinfo and allmessages is kept for some time,
+    - queries for certain revisions (revids) never change,
+    - queries about some pages (titles, pageids) and category listings are
+      checked against the last revision and the touched timestamp of the
+      pages, which costs a small prop=info query; queries about the pages
+      linked from some pages (generator=links etc.) are not cached,
+    - other lists are kept for their configured time or not at all.
+Queries with tokens, about the user (meta=userinfo) or modifying actions
+are never cached.
+"""
+#
+# (C) Pywikibot team, 2014
+#
+# Distributed under the terms of the MIT license.
+#
+__version__ = '$Id$'
+
+import hashlib
+import threading
+import time
+import zlib
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+import config
+
+# parameters which don't change the result of a query
+_IGNORED_PARAMS = set(['format', 'maxlag', 'requestid', 'noprofile'])
+
+# list modules whose result is checked against the page given by the
+# parameter; as generators the parameters have the prefix 'g'
+_VALIDATED_LISTS = {'categorymembers': ('cmtitle', 'cmpageid')}
+
+# meta modules which are never cached: userinfo depends on the login state
+# and contains tokens, blocks and the new messages flag
+_UNCACHED_METAS = set(['tokens', 'userinfo'])
+
+
+def policy(params):
+    """Return how to cache the query given by params.
+
+    Return None if the query must not be cached, or a (ttl, validate)
+    tuple, where ttl is the time to keep the response in seconds and
+    validate is None or a ('titles'|'pageids', value) tuple of the pages
+    whose last revision and touched timestamp must not have changed.
+
+    """
+    ttls = config.api_cache_ttl
+    if params.get('action') != 'query':
+        return None
+    for key, value in params.iteritems():
+        if key.endswith('token'):
+            return None
+        if key.endswith('prop') and [v for v in _unicode(value).split('|')
+                                     if v.endswith('token')]:
+            return None
+    metas = [m for m in params.get('meta', '').split('|') if m]
+    if _UNCACHED_METAS.intersection(metas):
+        return None
+    lists = [l for l in params.get('list', '').split('|') if l]
+    generator = params.get('generator')
+    ttl = [ttls.get(name) for name in metas]
+    validate = None
+    if 'revids' in params:
+        ttl.append(ttls.get('revids'))
+    elif 'titles' in params or 'pageids' in params:
+        if generator:
+            # the result is about the pages linked from the given pages,
+            # which can't be validated by the given ones
+            return None
+        if 'titles' in params:
+            validate = ('titles', params['titles'])
+        else:
+            validate = ('pageids', params['pageids'])
+        ttl.append(ttls.get('pages'))
+    if generator:
+        lists.append(generator)
+    for name in lists:
+        ttl.append(ttls.get(name))
+        if name not in _VALIDATED_LISTS:
+            continue
+        if validate is not None:
+            # only one set of pages can be validated
+            return None
+        if name == generator and 'prop' in params:
+            # data about the members can't be validated by the category
+            return None
+        prefix = name == generator and 'g' or ''
+        title, pageid = _VALIDATED_LISTS[name]
+        if prefix + title in params:
+            validate = ('titles', params[prefix + title])
+        elif prefix + pageid in params:
+            validate = ('pageids', params[prefix + pageid])
+        else:
+            return None
+    if not ttl or None in ttl:
+        return None
+    return min(ttl), validate
+
+
+def _unicode(value):
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
+
+
+class APICache(object):
+    """SQLite backed store of API responses.
+
+    The responses are stored compressed with the time they were received
+    and, for validated queries, the state of the pages they depend on.
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        # the cache is used by all threads, one at a time
+        self.db = sqlite3.connect(filename, timeout=30,
+                                  check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses '
+                        '(key TEXT PRIMARY KEY, created REAL, '
+                        'validator TEXT, data BLOB)')
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def key(self, site, username, params):
+        """Return the cache key of a query to site made by username."""
+        parts = [repr(site), username or u'']
+        for k in sorted(params):
+            if k not in _IGNORED_PARAMS:
+                parts.append(u'%s=%s' % (k, _unicode(params[k])))
+        return hashlib.sha1(u'\n'.join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key, ttl, validator=None):
+        """Return the cached response text or None.
+
+        The response must not be older than ttl seconds, and it must have
+        been stored with the same validator.
+
+        """
+        self.lock.acquire()
+        try:
+            row = self.db.execute(
+                'SELECT created, validator, data FROM responses '
+                'WHERE key = ?', (key,)).fetchone()
+            if row is None or row[0] < time.time() - ttl:
+                self.misses += 1
+                return None
+            if row[1] != validator:
+                self.invalidated += 1
+                self.misses += 1
+                return None
+            self.hits += 1
+            return zlib.decompress(str(row[2])).decode('utf-8')
+        finally:
+            self.lock.release()
+
+    def put(self, key, text, validator=None):
+        """Store the response text for key."""
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        self.lock.acquire()
+        try:
+            self.db.execute('INSERT OR REPLACE INTO responses '
+                            'VALUES (?, ?, ?, ?)',
+                            (key, time.time(), validator,
+                             sqlite3.Binary(zlib.compress(text))))
+            self.db.commit()
+        finally:
+            self.lock.release()
+
+    def expire(self, maxage):
+        """Remove responses older than maxage seconds."""
+        self.lock.acquire()
+        try:
+            self.db.execute('DELETE FROM responses WHERE created < ?',
+                            (time.time() - maxage,))
+            self.db.commit()
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """Return a dict with the hit and miss counters.
+
+        'invalidated' counts responses which were found but outdated.
+
+        """
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'invalidated': self.invalidated,
+                'hit_rate': total and float(self.hits) / total or 0.0}
+
+    def close(self):
+        """Close the database."""
+        self.lock.acquire()
+        try:
+            self.db.close()
+        finally:
+            self.lock.release()
+
+
+def validator(data):
+    """Return the validator string for the result of a prop=info query."""
+    pages = data.get('query', {}).get('pages', {})
+    state = []
+    for page in pages.itervalues():
+        state.append(u'%s %s %s' % (page.get('title', page.get('pageid')),
+                                    page.get('lastrevid', u'missing'),
+                                    page.get('touched', u'')))
+    state.sort()
+    return u'\n'.join(state)
@@ -0,0 +1,332 @@
+# -*- coding: utf-8  -*-
+"""
+Persistent HTTP/1.1 connection pool for urllib2.
+
+The handlers in this module replace the default urllib2 HTTP and HTTPS
+handlers of the framework's URL opener. Instead of opening (and closing)
+a new connection for every request, connections are kept alive and reused
+for subsequent requests to the same scheme and host. This saves the TCP
+and TLS handshake on every API call or edit.
+
+The pool
+    - keeps at most 'maxsize' idle connections per host and 'maxtotal'
+      idle connections altogether,
+    - closes connections which were idle for more than 'idletimeout' secs,
+      whenever a connection is taken from or given back to the pool,
+    - reconnects once if the server has closed a reused connection,
+    - counts requests, reused connections and handshakes.
+
+Usage example:
+
+    >>> pool = ConnectionPool(maxsize=2)
+    >>> opener = urllib2.build_opener(HTTPHandler(pool), HTTPSHandler(pool))
+    >>> pool.stats()['requests']
+    0
+
+"""
+#
+# (C) Pywikibot team, 2014
+#
+# Distributed under the terms of the MIT license.
+#
+__version__ = '$Id$'
+
+import errno
+import httplib
+import socket
+import threading
+import time
+import urllib2
+
+# Errors signalling that the server has dropped a kept-alive connection.
+# They are only retried (once) if the connection has been used before.
+_RESET_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+
+class ConnectionPool(object):
+    """Thread-safe pool of idle httplib connections keyed per host and scheme.
+
+    @param maxsize: maximum number of idle connections kept for one key.
+    @param idletimeout: seconds after which an idle connection is dropped.
+    @param maxtotal: maximum number of idle connections kept for all keys;
+        the least recently used one is closed to make room for another.
+
+    """
+
+    def __init__(self, maxsize=4, idletimeout=30, maxtotal=16):
+        self.maxsize = maxsize
+        self.maxtotal = maxtotal
+        self.idletimeout = idletimeout
+        self._lock = threading.Lock()
+        self._idle = {}
+        self.requests = 0
+        self.reused = 0
+        self.handshakes = 0
+        self.resets = 0
+        self.evicted = 0
+
+    def get(self, key):
+        """Return an idle connection for key or None if there is none."""
+        now = time.time()
+        self._lock.acquire()
+        try:
+            self.requests += 1
+            self._prune(now)
+            idle = self._idle.get(key)
+            if idle:
+                conn, lastused = idle.pop()
+                if not idle:
+                    del self._idle[key]
+                self.reused += 1
+                return conn
+            self.handshakes += 1
+            return None
+        finally:
+            self._lock.release()
+
+    def put(self, key, conn):
+        """Give an unused connection back to the pool."""
+        now = time.time()
+        self._lock.acquire()
+        try:
+            self._prune(now)
+            idle = self._idle.get(key, [])
+            if len(idle) >= self.maxsize or self.maxtotal < 1:
+                self.evicted += 1
+                conn.close()
+                return
+            if sum(len(v) for v in self._idle.itervalues()) >= self.maxtotal:
+                self._evictOldest()
+            self._idle.setdefault(key, []).append((conn, now))
+        finally:
+            self._lock.release()
+
+    def _prune(self, now):
+        """Close expired connections; the lock must be held."""
+        for key, idle in self._idle.items():
+            for item in idle[:]:
+                if now - item[1] > self.idletimeout:
+                    idle.remove(item)
+                    self.evicted += 1
+                    item[0].close()
+            if not idle:
+                del self._idle[key]
+
+    def _evictOldest(self):
+        """Close the least recently used connection; the lock must be held."""
+        key, item = min(((k, idle[0]) for k, idle in self._idle.iteritems()),
+                        key=lambda pair: pair[1][1])
+        idle = self._idle[key]
+        idle.remove(item)
+        if not idle:
+            del self._idle[key]
+        self.evicted += 1
+        item[0].close()
+
+    def reset(self):
+        """Count a dropped connection which had to be opened again."""
+        self._lock.acquire()
+        try:
+            self.resets += 1
+            self.reused -= 1
+            self.handshakes += 1
+        finally:
+            self._lock.release()
+
+    def prune(self):
+        """Close all connections idle for longer than idletimeout."""
+        now = time.time()
+        self._lock.acquire()
+        try:
+            self._prune(now)
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """Close all idle connections."""
+        self._lock.acquire()
+        try:
+            for idle in self._idle.itervalues():
+                for conn, lastused in idle:
+                    conn.close()
+            self._idle.clear()
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """Return a dict with the pool counters.
+
+        'reuse_rate' is the fraction of requests served by a kept-alive
+        connection, 'handshakes_avoided' the number of such requests.
+
+        """
+        self._lock.acquire()
+        try:
+            idle = sum(len(v) for v in self._idle.itervalues())
+            if self.requests:
+                rate = float(self.reused) / self.requests
+            else:
+                rate = 0.0
+            return {'requests': self.requests,
+                    'reused': self.reused,
+                    'handshakes': self.handshakes,
+                    'handshakes_avoided': self.reused,
+                    'reuse_rate': rate,
+                    'resets': self.resets,
+                    'evicted': self.evicted,
+                    'idle': idle}
+        finally:
+            self._lock.release()
+
+
+class _PooledResponse(object):
+    """httplib.HTTPResponse wrapper releasing its connection at end of body.
+
+    urllib2 reads the response through socket._fileobject which calls
+    recv(); as soon as the body is completely read, the connection is given
+    back to the pool. Closing a response which was not read completely
+    discards the connection.
+
+    """
+
+    def __init__(self, pool, key, conn, response):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.msg = response.msg
+        self.status = response.status
+        self.reason = response.reason
+        self._check()
+
+    def _check(self):
+        if self._conn is not None and self._response.isclosed():
+            conn, self._conn = self._conn, None
+            if self._response.will_close:
+                conn.close()
+            else:
+                self._pool.put(self._key, conn)
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        if not data or amt is None:
+            # httplib does not close a response of unknown length by itself
+            self._response.close()
+        self._check()
+        return data
+
+    recv = read
+
+    def close(self):
+        self._response.close()
+        if self._conn is not None:
+            # body not read completely; the connection can't be reused
+            self._conn.close()
+            self._conn = None
+
+    def fileno(self):
+        return self._response.fileno()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+class _PoolMixin(object):
+    """Common code of the keep-alive HTTP and HTTPS handlers."""
+
+    def _key(self, req):
+        return (req.get_type(), req.get_host(), req._tunnel_host)
+
+    def _newconn(self, http_class, req, tunnel_headers, **kwargs):
+        conn = http_class(req.get_host(), timeout=req.timeout, **kwargs)
+        conn.set_debuglevel(self._debuglevel)
+        if req._tunnel_host:
+            conn.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+        return conn
+
+    def _request(self, conn, req, headers):
+        conn.request(req.get_method(), req.get_selector(), req.data, headers)
+        try:
+            return conn.getresponse(buffering=True)
+        except TypeError:
+            return conn.getresponse()
+
+    def do_open_pooled(self, http_class, req, **kwargs):
+        """Like urllib2.AbstractHTTPHandler.do_open, but reuse connections."""
+        if not req.get_host():
+            raise urllib2.URLError('no host given')
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                            if k not in headers))
+        headers['Connection'] = 'keep-alive'
+        headers = dict((name.title(), val) for name, val in headers.items())
+        tunnel_headers = {}
+        if req._tunnel_host and 'Proxy-Authorization' in headers:
+            tunnel_headers['Proxy-Authorization'] = headers.pop(
+                'Proxy-Authorization')
+
+        key = self._key(req)
+        conn = self.pool.get(key)
+        if conn is not None:
+            if conn.sock is not None and req.timeout is not None \
+               and req.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                conn.sock.settimeout(req.timeout)
+            try:
+                r = self._request(conn, req, headers)
+            except httplib.HTTPException:
+                conn.close()
+                conn = None
+            except socket.error, err:
+                conn.close()
+                if err.errno not in _RESET_ERRNOS:
+                    raise urllib2.URLError(err)
+                conn = None
+            if conn is None:
+                # the server dropped the kept-alive connection; reconnect
+                self.pool.reset()
+        if conn is None:
+            conn = self._newconn(http_class, req, tunnel_headers, **kwargs)
+            try:
+                r = self._request(conn, req, headers)
+            except socket.error, err:
+                conn.close()
+                raise urllib2.URLError(err)
+        r = _PooledResponse(self.pool, key, conn, r)
+        fp = socket._fileobject(r, close=True)
+        resp = urllib2.addinfourl(fp, r.msg, req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        return resp
+
+
+class HTTPHandler(_PoolMixin, urllib2.HTTPHandler):
+    """urllib2 handler using persistent HTTP connections from a pool."""
+
+    def __init__(self, pool, debuglevel=0):
+        urllib2.HTTPHandler.__init__(self, debuglevel)
+        self.pool = pool
+
+    def http_open(self, req):
+        return self.do_open_pooled(httplib.HTTPConnection, req)
+
+
+class HTTPSHandler(_PoolMixin, urllib2.HTTPSHandler):
+    """urllib2 handler using persistent HTTPS connections from a pool."""
+
+    def __init__(self, pool, debuglevel=0, context=None):
+        urllib2.HTTPSHandler.__init__(self, debuglevel)
+        self.pool = pool
+        self._poolcontext = context
+
+    def https_open(self, req):
+        if self._poolcontext is not None:
+            return self.do_open_pooled(httplib.HTTPSConnection, req,
+                                       context=self._poolcontext)
+        return self.do_open_pooled(httplib.HTTPSConnection, req)
+
+
+if __name__ == "__main__":
+    def _test():
+        import doctest
+        doctest.testmod()
+    _test()
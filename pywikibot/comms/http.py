@@ -18,7 +18,9 @@ This module is responsible for
 
 __version__ = '$Id$'
 
+import time
 import urllib2
+import urlparse
 
 import config
 from pywikibot import *
@@ -110,13 +112,19 @@ def request(site, uri, retry=None, sysop=False, data=None, compress=True,
         url = '%s://%s%s' % (site.protocol(), site.hostname(), uri)
     data = site.urlEncode(data)
 
+    if no_hostname:
+        # don't slow down the wiki if a foreign host has problems
+        host = urlparse.urlparse(url)[1]
+    else:
+        host = site
+
     # Try to retrieve the page until it was successfully loaded (just in
     # case the server is down or overloaded).
-    # Wait for retry_idle_time minutes (growing!) between retries.
-    retry_idle_time = 1
+    # Wait according to pywikibot.retry_policy between retries.
     retry_attempt = 0
     while True:
         try:
+            started = time.time()
             req = urllib2.Request(url, data, headers)
             f = buffered_addinfourl(MyURLopener.open(req))
 
@@ -127,6 +135,8 @@ def request(site, uri, retry=None, sysop=False, data=None, compress=True,
                                   u'that correct? Downloading will take some '
                                   u'time, please be patient.')
             text = f.read()
+            pywikibot.retry_policy.success(host, time.time() - started,
+                                           len(text))
             break
         except KeyboardInterrupt:
             raise
@@ -140,22 +150,17 @@ def request(site, uri, retry=None, sysop=False, data=None, compress=True,
                 raise PageNotFound(
                     u'Page %s could not be retrieved. Check your virus wall.'
                     % url)
-            elif e.code in [500, 502, 503, 504]:
+            elif e.code in [429, 500, 502, 503, 504]:
                 pywikibot.output(u'HTTPError: %s %s' % (e.code, e.msg))
                 if retry:
                     retry_attempt += 1
-                    if retry_attempt > config.maxretries:
+                    retryafter = pywikibot.parseRetryAfter(
+                        e.info().get('Retry-After'))
+                    if not pywikibot.retry_policy.retry(
+                            host, retry_attempt,
+                            u"Could not open '%s'.Maybe the server or\n "
+                            u"your connection is down." % url, retryafter):
                         raise MaxTriesExceededError()
-                    pywikibot.warning(
-                        u"Could not open '%s'.Maybe the server or\n "
-                        u"your connection is down. Retrying in %i minutes..."
-                        % (url, retry_idle_time))
-                    time.sleep(retry_idle_time * 60)
-                    # Next time wait longer,
-                    # but not longer than half an hour
-                    retry_idle_time *= 2
-                    if retry_idle_time > 30:
-                        retry_idle_time = 30
                     continue
                 raise
             else:
@@ -165,16 +170,11 @@ def request(site, uri, retry=None, sysop=False, data=None, compress=True,
             pywikibot.exception()
             if retry:
                 retry_attempt += 1
-                if retry_attempt > config.maxretries:
+                if not pywikibot.retry_policy.retry(
+                        host, retry_attempt,
+                        u"Could not open '%s'. Maybe the server or\n your "
+                        u"connection is down." % url):
                     raise MaxTriesExceededError()
-                pywikibot.warning(
-                    u"Could not open '%s'. Maybe the server or\n your "
-                    u"connection is down. Retrying in %i minutes..."
-                    % (url, retry_idle_time))
-                time.sleep(retry_idle_time * 60)
-                retry_idle_time *= 2
-                if retry_idle_time > 30:
-                    retry_idle_time = 30
                 continue
 
             raise
@@ -0,0 +1,685 @@
+# -*- coding: utf-8  -*-
+"""
+Checking many external links at the same time in a single thread.
+
+The LinkCheckEngine keeps all its connections in one asyncore loop, so
+thousands of links may be checked at once without a thread for each of them.
+Every web server gets a few connections at most, which are kept open and
+reused, and requests to the same server are spread out by a delay. Every
+URL is checked only once per run; further pages linking to it get the same
+result.
+
+A link is first checked with a HEAD request, which saves downloading the
+page. Only if the answer says the link is dead, or the server does not
+understand HEAD, it is checked again with GET.
+
+The host names are looked up by a few threads, as the resolver of the
+socket module blocks.
+"""
+#
+# (C) Pywikibot team, 2014
+#
+# Distributed under the terms of the MIT license.
+#
+__version__ = '$Id$'
+
+import asyncore
+import collections
+import errno
+import httplib
+import Queue
+import re
+import select
+import socket
+import sys
+import threading
+import time
+import urllib
+import urlparse
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+import wikipedia as pywikibot
+from pywikibot.tools import LRUCache
+
+HEADERS = (
+    # we fake being Firefox because some webservers block unknown clients,
+    # e.g. http://images.google.de/images?q=Albit gives a 403 when using the
+    # PyWikipediaBot user agent.
+    ('User-agent', 'Mozilla/5.0 (X11; U; Linux i686; de; rv:1.8) '
+                   'Gecko/20051128 SUSE/1.5-0.1 Firefox/1.5'),
+    ('Accept', 'text/xml,application/xml,application/xhtml+xml,text/html;'
+               'q=0.9,text/plain;q=0.8,image/png,*/*;q=0.5'),
+    ('Accept-Language', 'de-de,de;q=0.8,en-us;q=0.5,en;q=0.3'),
+    ('Accept-Charset', 'ISO-8859-1,utf-8;q=0.7,*;q=0.7'),
+    ('Accept-Encoding', 'identity'),
+    ('Connection', 'keep-alive'),
+)
+
+# longest redirect chain which is followed
+MAX_REDIRECTS = 19
+
+statusR = re.compile(r'HTTP/(\d+)\.(\d+)\s+(\d{3})\s*(.*)$')
+
+
+class NotAnURLError(BaseException):
+    pass
+
+
+def errorMessage(error):
+    """Return the message reported for a link which failed with error."""
+    if isinstance(error, UnicodeError):
+        return u'Encoding Error: %s (%s)' % (error.__class__.__name__,
+                                             unicode(error))
+    if isinstance(error, httplib.HTTPException):
+        return u'HTTP Error: %s' % error.__class__.__name__
+    if isinstance(error, socket.error):
+        # the value is either a string telling what went wrong or a pair
+        # (errno, string)
+        if len(error.args) > 1:
+            msg = error.args[1]
+        elif error.args:
+            msg = error.args[0]
+        else:
+            msg = str(error)
+        return u'Socket Error: %s' % repr(msg)
+    return u'Error: %s' % error
+
+
+class _Check(object):
+    """The check of one URL.
+
+    url is the URL as found on the wiki; the check follows the redirects
+    from there, chain being the URLs requested so far.
+
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.callbacks = []
+        self.method = 'HEAD'
+        # set to retry a request which failed on a reused connection
+        self.retried = False
+        self.chain = []
+        self.moveTo(url)
+
+    def moveTo(self, url):
+        """Make url the next URL to be requested."""
+        parts = urlparse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise NotAnURLError(url)
+        try:
+            port = parts.port
+        except ValueError:
+            raise NotAnURLError(url)
+        if not parts.hostname:
+            raise NotAnURLError(url)
+        hostname = parts.hostname
+        if isinstance(hostname, unicode):
+            hostname = hostname.encode('idna')
+        if parts.scheme == 'https':
+            port = port or 443
+        else:
+            port = port or 80
+        # we ignore the fragment
+        path = parts.path or '/'
+        query = parts.query
+        # encode non-ASCII characters inside path or query
+        if isinstance(path, unicode):
+            try:
+                path = path.encode('ascii')
+            except UnicodeError:
+                path = urllib.quote(path.encode('utf-8'))
+        if isinstance(query, unicode):
+            try:
+                query = query.encode('ascii')
+            except UnicodeError:
+                query = urllib.quote(query.encode('utf-8'), '=&')
+        if query:
+            path += '?' + query
+        self.current = url
+        self.scheme = parts.scheme
+        self.key = (parts.scheme, hostname, port)
+        if port in (80, 443):
+            self.hostHeader = hostname
+        else:
+            self.hostHeader = '%s:%i' % (hostname, port)
+        self.path = path
+        self.chain.append(url)
+
+    def redirectTarget(self, location):
+        """Return the URL a redirect to location leads to."""
+        try:
+            location.encode('ascii')
+        except UnicodeError:
+            # most browsers use ISO 8859-1 (Latin-1) as the default.
+            location = location.decode('iso8859-1')
+        if location.startswith('http://') or location.startswith('https://'):
+            return location
+        protocol, rest = self.current.split('://', 1)
+        host = urlparse.urlsplit(self.current)[1]
+        if location.startswith('/'):
+            return u'%s://%s%s' % (protocol, host, location)
+        # redirect to relative position; cut off filename
+        path = urlparse.urlsplit(self.current)[2] or '/'
+        directory = path[:path.rindex('/') + 1]
+        # handle redirect to parent directory
+        while location.startswith('../'):
+            location = location[3:]
+            # some servers redirect to .. although we are already in the
+            # root directory; ignore this.
+            if directory != '/':
+                # change /foo/bar/ to /foo/
+                directory = directory[:-1]
+                directory = directory[:directory.rindex('/') + 1]
+        return u'%s://%s%s%s' % (protocol, host, directory, location)
+
+
+class _Host(object):
+    """A web server and the checks waiting for it."""
+
+    def __init__(self, key):
+        self.key = key
+        # (family, address) once the name is resolved
+        self.address = None
+        # the error if the name could not be resolved
+        self.error = None
+        self.resolving = False
+        self.waiting = collections.deque()
+        # open connections without a request
+        self.idle = []
+        # number of requests in progress
+        self.active = 0
+        # time when the next request may be started
+        self.next = 0
+
+
+class _Channel(asyncore.dispatcher):
+    """A connection to a web server, making one request after the other."""
+
+    def __init__(self, engine, host):
+        asyncore.dispatcher.__init__(self, map=engine.map)
+        self.engine = engine
+        self.host = host
+        self.check = None
+        self.reused = False
+        self.handshaking = False
+        self.wantWrite = False
+        self.secure = False
+        self.out = ''
+        self.buffer = ''
+        self.lastActivity = time.time()
+        family, address = host.address
+        self.create_socket(family, socket.SOCK_STREAM)
+        try:
+            self.connect(address)
+        except socket.error:
+            self.close()
+            raise
+
+    def request(self, check):
+        """Send the request for check."""
+        self.check = check
+        self.buffer = ''
+        self.lastActivity = time.time()
+        self.out = '%s %s HTTP/1.1\r\nHost: %s\r\n%s\r\n' % (
+            check.method, check.path, check.hostHeader, self.engine.headers)
+
+    def readable(self):
+        return not self.connecting
+
+    def writable(self):
+        return (self.connecting or self.wantWrite
+                or (bool(self.out) and not self.handshaking))
+
+    def handle_connect(self):
+        if self.host.key[0] != 'https':
+            return
+        if ssl is None:
+            raise httplib.HTTPException('no SSL support')
+        if hasattr(ssl, 'SSLContext'):
+            context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            context.verify_mode = ssl.CERT_NONE
+            self.socket = context.wrap_socket(self.socket,
+                                              server_hostname=self.host.key[1],
+                                              do_handshake_on_connect=False)
+        else:
+            self.socket = ssl.wrap_socket(self.socket,
+                                          do_handshake_on_connect=False)
+        self.secure = True
+        self.handshaking = True
+        self._handshake()
+
+    def _handshake(self):
+        try:
+            self.socket.do_handshake()
+        except ssl.SSLError, error:
+            if error.args[0] == ssl.SSL_ERROR_WANT_READ:
+                self.wantWrite = False
+                return
+            if error.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                self.wantWrite = True
+                return
+            raise
+        self.handshaking = False
+        self.wantWrite = False
+        self.lastActivity = time.time()
+
+    def _wouldBlock(self, error):
+        if self.secure and isinstance(error, ssl.SSLError):
+            return error.args[0] in (ssl.SSL_ERROR_WANT_READ,
+                                     ssl.SSL_ERROR_WANT_WRITE)
+        return error.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK)
+
+    def handle_write(self):
+        if self.handshaking:
+            self._handshake()
+            return
+        if not self.out:
+            return
+        try:
+            sent = self.socket.send(self.out)
+        except socket.error, error:
+            if self._wouldBlock(error):
+                return
+            raise
+        self.out = self.out[sent:]
+        self.lastActivity = time.time()
+
+    def handle_read(self):
+        if self.handshaking:
+            self._handshake()
+            return
+        while True:
+            try:
+                data = self.socket.recv(65536)
+            except socket.error, error:
+                if self._wouldBlock(error):
+                    return
+                raise
+            if not data:
+                self.handle_close()
+                return
+            if self.check is None:
+                # an idle connection is not supposed to send anything
+                self.engine._dropIdle(self)
+                return
+            self.buffer += data
+            self.lastActivity = time.time()
+            if self._parse():
+                return
+            if not (self.secure and self.socket.pending()):
+                return
+
+    def _parse(self):
+        """Handle the response once its header is complete.
+
+        Return True if it was.
+
+        """
+        end = self.buffer.find('\r\n\r\n')
+        if end < 0:
+            if len(self.buffer) > 65536:
+                raise httplib.LineTooLong('header')
+            return False
+        lines = self.buffer[:end].split('\r\n')
+        rest = self.buffer[end + 4:]
+        match = statusR.match(lines[0])
+        if not match:
+            raise httplib.BadStatusLine(lines[0])
+        major, minor, status, reason = match.groups()
+        status = int(status)
+        if status < 200:
+            # skip informational responses
+            self.buffer = rest
+            return self._parse()
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        connection = headers.get('connection', '').lower()
+        # the bodies of GET responses are not read, so those connections
+        # can't be used again
+        if (major, minor) == ('1', '0'):
+            keep = connection == 'keep-alive'
+        else:
+            keep = connection != 'close'
+        keep = keep and self.check.method == 'HEAD' and not rest
+        check = self.check
+        self.engine._release(self, keep)
+        self.engine._response(check, status, reason.strip(), headers)
+        return True
+
+    def handle_close(self):
+        if self.check is None:
+            self.engine._dropIdle(self)
+        else:
+            # httplib raises this if the server closes the connection
+            # before a complete response
+            self.fail(httplib.BadStatusLine(self.buffer))
+
+    def handle_expt(self):
+        self.handle_close()
+
+    def handle_error(self):
+        error = sys.exc_info()[1]
+        if self.check is None:
+            self.engine._dropIdle(self)
+        elif isinstance(error, (socket.error, httplib.HTTPException,
+                                UnicodeError)):
+            self.fail(error)
+        else:
+            check = self.check
+            self.engine._release(self, False)
+            self.engine._drop(check)
+
+    def fail(self, error):
+        """Close the connection and report error for its check."""
+        check = self.check
+        # servers close idle connections; if nothing came back, the request
+        # is tried again
+        retry = self.reused and not self.buffer
+        self.engine._release(self, False)
+        self.engine._error(check, error, retry)
+
+
+class LinkCheckEngine(object):
+    """Check external links in one thread.
+
+    check() queues a URL, and poll() or run() do the checking. The results
+    are passed to the callbacks from there.
+
+    @param connections: maximum number of requests at the same time
+    @param hostConnections: maximum number of connections to one server
+    @param hostDelay: seconds between two requests to the same server
+    @param timeout: seconds without an answer after which a request fails
+    @param HTTPignore: HTTP status codes which are reported as dead links
+    @param cacheSize: number of results kept to answer repeated checks
+    @param resolvers: number of threads looking up host names
+
+    """
+
+    def __init__(self, connections=50, hostConnections=2, hostDelay=1.0,
+                 timeout=30, HTTPignore=(), cacheSize=100000, resolvers=4):
+        self.connections = connections
+        self.hostConnections = hostConnections
+        self.hostDelay = hostDelay
+        self.timeout = timeout
+        # connections which had no request for that long are closed
+        self.idleTimeout = 15
+        self.HTTPignore = HTTPignore
+        self.headers = ''.join(['%s: %s\r\n' % header for header in HEADERS])
+        # asyncore socket map of the connections
+        self.map = {}
+        self.hosts = {}
+        # hosts with checks waiting for a connection
+        self.waiting = set()
+        # checks in progress by URL
+        self.checks = {}
+        self.results = LRUCache(cacheSize)
+        # checks which are done, with their results
+        self.finished = []
+        self.busy = 0
+        self.idle = 0
+        self.lastSweep = time.time()
+        self.resolvers = resolvers
+        self.resolverThreads = []
+        self.resolveQueue = Queue.Queue()
+        self.resolved = Queue.Queue()
+        if hasattr(select, 'poll'):
+            self._poll = asyncore.poll2
+        else:
+            self._poll = asyncore.poll
+
+    def check(self, url, callback):
+        """Check url and call callback(ok, message) with the result.
+
+        ok is True if the link is alive, message the server status or the
+        error. Raise NotAnURLError if url is not an HTTP URL.
+
+        """
+        result = self.results.get(url)
+        if result is not None:
+            callback(*result)
+            return
+        if url in self.checks:
+            self.checks[url].callbacks.append(callback)
+            return
+        try:
+            check = _Check(url)
+        except UnicodeError, error:
+            callback(False, errorMessage(error))
+            return
+        check.callbacks.append(callback)
+        self.checks[url] = check
+        self._queue(check)
+
+    def pending(self):
+        """Return the number of URLs being checked."""
+        return len(self.checks)
+
+    def poll(self, timeout=0.0):
+        """Check links until timeout seconds have passed or some I/O was
+        done, and call the callbacks of the finished checks."""
+        self._resolved()
+        self._start()
+        if self.map:
+            self._poll(timeout, self.map)
+        elif timeout:
+            # waiting for the resolvers or a host delay
+            time.sleep(min(timeout, 0.05))
+        now = time.time()
+        for channel in self.map.values():
+            if (channel.check is not None
+                    and now - channel.lastActivity > self.timeout):
+                channel.fail(socket.timeout('timed out'))
+        if now - self.lastSweep > 5:
+            self._sweep(now)
+        finished, self.finished = self.finished, []
+        for check, ok, message in finished:
+            for callback in check.callbacks:
+                callback(ok, message)
+
+    def run(self, maxpending=0, timeout=None):
+        """Check links until at most maxpending URLs are left.
+
+        Return False if that takes longer than timeout seconds.
+
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+        self.poll()
+        while len(self.checks) > maxpending:
+            if timeout is not None and time.time() > deadline:
+                return False
+            self.poll(0.1)
+        return True
+
+    def close(self):
+        """Close all connections and stop the resolver threads."""
+        for channel in self.map.values():
+            channel.close()
+        for thread in self.resolverThreads:
+            self.resolveQueue.put(None)
+        self.resolverThreads = []
+
+    def _queue(self, check, front=False):
+        host = self.hosts.get(check.key)
+        if host is None:
+            host = self.hosts[check.key] = _Host(check.key)
+        if host.error is not None:
+            self._done(check, False, errorMessage(host.error))
+            return
+        if front:
+            host.waiting.appendleft(check)
+        else:
+            host.waiting.append(check)
+        self.waiting.add(host)
+        if host.address is None and not host.resolving:
+            host.resolving = True
+            if len(self.resolverThreads) < self.resolvers:
+                thread = threading.Thread(target=self._resolver,
+                                          name='Resolver-Thread')
+                thread.setDaemon(True)
+                self.resolverThreads.append(thread)
+                thread.start()
+            self.resolveQueue.put(host)
+
+    def _resolver(self):
+        while True:
+            host = self.resolveQueue.get()
+            if host is None:
+                return
+            try:
+                info = socket.getaddrinfo(host.key[1], host.key[2], 0,
+                                          socket.SOCK_STREAM)
+                self.resolved.put((host, (info[0][0], info[0][4]), None))
+            except socket.error, error:
+                self.resolved.put((host, None, error))
+
+    def _resolved(self):
+        while True:
+            try:
+                host, address, error = self.resolved.get_nowait()
+            except Queue.Empty:
+                return
+            host.resolving = False
+            host.address = address
+            host.error = error
+            if error is not None:
+                message = errorMessage(error)
+                while host.waiting:
+                    self._done(host.waiting.popleft(), False, message)
+                self.waiting.discard(host)
+
+    def _start(self):
+        """Start the requests which may be made now."""
+        now = time.time()
+        for host in list(self.waiting):
+            if self.busy >= self.connections:
+                return
+            if (host.address is None or now < host.next
+                    or host.active >= self.hostConnections):
+                continue
+            check = host.waiting.popleft()
+            if not host.waiting:
+                self.waiting.discard(host)
+            host.next = now + self.hostDelay
+            if host.idle:
+                channel = host.idle.pop()
+                channel.reused = True
+                self.idle -= 1
+            else:
+                try:
+                    channel = _Channel(self, host)
+                except socket.error, error:
+                    self._done(check, False, errorMessage(error))
+                    continue
+            host.active += 1
+            self.busy += 1
+            channel.request(check)
+
+    def _release(self, channel, keep):
+        """Mark channel as done with its request; keep it open if keep."""
+        host = channel.host
+        host.active -= 1
+        self.busy -= 1
+        channel.check = None
+        channel.reused = False
+        if (keep and self.idle < self.connections
+                and len(host.idle) < self.hostConnections):
+            channel.lastActivity = time.time()
+            host.idle.append(channel)
+            self.idle += 1
+        else:
+            channel.close()
+
+    def _dropIdle(self, channel):
+        if channel in channel.host.idle:
+            channel.host.idle.remove(channel)
+            self.idle -= 1
+        channel.close()
+
+    def _sweep(self, now):
+        """Close old idle connections and forget unused hosts."""
+        self.lastSweep = now
+        for key, host in self.hosts.items():
+            for channel in host.idle[:]:
+                if now - channel.lastActivity > self.idleTimeout:
+                    self._dropIdle(channel)
+            if (not host.waiting and not host.active and not host.idle
+                    and not host.resolving and now >= host.next):
+                del self.hosts[key]
+
+    def _response(self, check, status, reason, headers):
+        location = headers.get('location')
+        if 300 <= status <= 399 and location:
+            try:
+                target = check.redirectTarget(location)
+            except UnicodeError, error:
+                self._done(check, False, errorMessage(error))
+                return
+            if target in check.chain or len(check.chain) >= MAX_REDIRECTS:
+                if check.method == 'HEAD':
+                    # Some servers don't seem to handle HEAD requests
+                    # properly, which leads to a cyclic or long list of
+                    # redirects. We simply start from the beginning, but
+                    # this time, we use GET requests.
+                    check.method = 'GET'
+                    check.chain = []
+                    check.moveTo(check.url)
+                    self._queue(check)
+                    return
+                urls = ' -> '.join(['[%s]' % url
+                                    for url in check.chain + [target]])
+                if target in check.chain:
+                    message = u'HTTP Redirect Loop: %s' % urls
+                else:
+                    message = u'Long Chain of Redirects: %s' % urls
+                self._done(check, False, message)
+                return
+            try:
+                check.moveTo(target)
+            except (NotAnURLError, UnicodeError), error:
+                self._done(check, False, errorMessage(error))
+                return
+            self._queue(check)
+            return
+        # site down if the server status is between 400 and 499
+        alive = not (400 <= status <= 499) and status not in self.HTTPignore
+        if not alive and check.method == 'HEAD':
+            # make sure with GET, as some servers don't answer HEAD requests
+            # properly
+            check.method = 'GET'
+            self._queue(check, front=True)
+            return
+        self._done(check, alive, '%s %s' % (status, reason))
+
+    def _error(self, check, error, retry):
+        if retry and not check.retried:
+            check.retried = True
+            self._queue(check, front=True)
+        elif (isinstance(error, httplib.BadStatusLine)
+                and check.method == 'HEAD'):
+            # Some servers don't seem to handle HEAD requests properly,
+            # e.g. http://www.radiorus.ru/ which is running on a very old
+            # Apache server. Using GET instead works on these.
+            check.method = 'GET'
+            self._queue(check, front=True)
+        else:
+            self._done(check, False, errorMessage(error))
+
+    def _done(self, check, ok, message):
+        del self.checks[check.url]
+        self.results[check.url] = (ok, message)
+        self.finished.append((check, ok, message))
+
+    def _drop(self, check):
+        """Give up check after an unexpected exception."""
+        pywikibot.output(u'Exception while processing URL %s' % check.url)
+        pywikibot.exception(tb=True)
+        del self.checks[check.url]
@@ -0,0 +1,147 @@
+# -*- coding: utf-8  -*-
+"""
+Compact storage of page texts on disk.
+
+A PageStore keeps texts in a single file. Every text is appended to the file
+compressed, and an index in memory maps the keys to the position of their
+record. Deleted and replaced records are left in the file as garbage; when
+the garbage outweighs the texts still in use, the live records are copied
+into a new file.
+"""
+#
+# (C) Pywikibot team, 2014
+#
+# Distributed under the terms of the MIT license.
+#
+__version__ = '$Id$'
+
+import os
+import threading
+import zlib
+
+
+class PageStore(object):
+    """Append-only store of unicode texts in the file filename.
+
+    The file is created empty, and removed by close(). The store may be used
+    by several threads.
+
+    >>> import tempfile
+    >>> store = PageStore(tempfile.mktemp())
+    >>> store['a'] = u'text'
+    >>> store['a']
+    u'text'
+    >>> 'a' in store, len(store)
+    (True, 1)
+    >>> del store['a']
+    >>> store.close()
+
+    """
+
+    def __init__(self, filename, mingarbage=1024 * 1024):
+        self.filename = filename
+        # don't compact files with less garbage than this many bytes
+        self.mingarbage = mingarbage
+        self.lock = threading.Lock()
+        # keys are mapped to (offset, length, size) of their records; length
+        # is the compressed length, size the length of the encoded text
+        self.index = {}
+        self.file = open(filename, 'w+b')
+        self.end = 0
+        # bytes of records in the file which are no longer used
+        self.garbage = 0
+        # encoded size of the stored texts
+        self.size = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key):
+        self.lock.acquire()
+        try:
+            offset, length, size = self.index[key]
+            self.file.seek(offset)
+            data = self.file.read(length)
+        finally:
+            self.lock.release()
+        return zlib.decompress(data).decode('utf-8')
+
+    def __setitem__(self, key, text):
+        data = text.encode('utf-8')
+        size = len(data)
+        data = zlib.compress(data)
+        self.lock.acquire()
+        try:
+            self._forget(key)
+            self.file.seek(self.end)
+            self.file.write(data)
+            self.index[key] = (self.end, len(data), size)
+            self.end += len(data)
+            self.size += size
+        finally:
+            self.lock.release()
+
+    def __delitem__(self, key):
+        self.lock.acquire()
+        try:
+            if key not in self.index:
+                raise KeyError(key)
+            self._forget(key)
+            if self.garbage > max(self.mingarbage, self.end - self.garbage):
+                self._compact()
+        finally:
+            self.lock.release()
+
+    def _forget(self, key):
+        if key in self.index:
+            offset, length, size = self.index.pop(key)
+            self.garbage += length
+            self.size -= size
+
+    def _compact(self):
+        """Copy the live records into a new file."""
+        tempname = self.filename + '.new'
+        new = open(tempname, 'w+b')
+        end = 0
+        index = {}
+        # copy in file order, so the old file is read sequentially
+        for key, (offset, length, size) in sorted(self.index.iteritems(),
+                                                  key=lambda item: item[1]):
+            self.file.seek(offset)
+            new.write(self.file.read(length))
+            index[key] = (end, length, size)
+            end += length
+        self.file.close()
+        new.close()
+        # os.rename() does not replace existing files on Windows
+        os.remove(self.filename)
+        os.rename(tempname, self.filename)
+        self.file = open(self.filename, 'r+b')
+        self.index = index
+        self.end = end
+        self.garbage = 0
+
+    def stats(self):
+        """Return a dict with the number of texts and the sizes in bytes.
+
+        'size' is the size of the encoded texts, 'file' the size of the
+        file and 'garbage' the size of the unused records in it.
+
+        """
+        return {'texts': len(self.index),
+                'size': self.size,
+                'file': self.end,
+                'garbage': self.garbage}
+
+    def close(self):
+        """Close and remove the file."""
+        self.lock.acquire()
+        try:
+            self.file.close()
+            os.remove(self.filename)
+            self.index = {}
+        finally:
+            self.lock.release()
@@ -0,0 +1,195 @@
+# -*- coding: utf-8  -*-
+"""
+Asynchronous saving of pages, with one lane per site.
+
+Page.put_async() hands the edits to the PutScheduler. Every site has its own
+lane: a thread which saves the edits for that site one after the other,
+slowed down by the put throttle of the site. So the lanes of different sites
+save their edits at the same time, and an edit never waits for the throttle
+of another site.
+
+Within a lane, edits with a higher priority are saved first; edits with the
+same priority are saved in the order they were queued. Queueing an edit
+blocks while the queued texts exceed the configured number of pages or
+bytes.
+"""
+#
+# (C) Pywikibot team, 2014
+#
+# Distributed under the terms of the MIT license.
+#
+__version__ = '$Id$'
+
+import heapq
+import itertools
+import threading
+
+import wikipedia as pywikibot
+from pywikibot.tools import waitFor
+
+
+class PutRequest(object):
+    """An edit queued by Page.put_async().
+
+    It is returned by put_async() and tells whether the edit was done.
+
+    """
+
+    def __init__(self, page, newtext, comment=None, watchArticle=None,
+                 minorEdit=True, force=False, callback=None, priority=0):
+        self.page = page
+        self.newtext = newtext
+        self.comment = comment
+        self.watchArticle = watchArticle
+        self.minorEdit = minorEdit
+        self.force = force
+        self.callback = callback
+        self.priority = priority
+        self.size = len(newtext.encode('utf-8'))
+        # the exception which prevented the edit, if any
+        self.error = None
+        self._done = threading.Event()
+
+    def done(self):
+        """Return True if the edit has been made or has failed."""
+        return self._done.isSet()
+
+    def wait(self, timeout=None):
+        """Wait until the edit is done; return True if it is."""
+        self._done.wait(timeout)
+        return self._done.isSet()
+
+    def run(self):
+        """Save the page and report the result."""
+        try:
+            try:
+                self.page.put(self.newtext, self.comment, self.watchArticle,
+                              self.minorEdit, self.force)
+            except Exception, error:
+                self.error = error
+        finally:
+            self._done.set()
+        if self.callback is not None:
+            self.callback(self.page, self.error)
+            # if callback is provided, it is responsible for exception
+            # handling
+            return
+        error = self.error
+        page = self.page
+        if isinstance(error, pywikibot.SpamfilterError):
+            pywikibot.output(u"Saving page %s prevented by spam filter: %s"
+                             % (page, error.url))
+        elif isinstance(error, pywikibot.PageNotSaved):
+            pywikibot.output(u"Saving page %s failed: %s" % (page, error))
+        elif isinstance(error, pywikibot.LockedPage):
+            pywikibot.output(u"Page %s is locked; not saved." % page)
+        elif isinstance(error, pywikibot.NoUsername):
+            pywikibot.output(u"Page %s not saved; sysop privileges required."
+                             % page)
+        elif error is not None:
+            pywikibot.exception(error, tb=True)
+            pywikibot.output(u"Saving page %s failed!" % page)
+
+
+class PutScheduler(object):
+    """Queue of edits, saved by one thread per site.
+
+    @param maxsize: maximum number of queued edits; 0 means no limit
+    @param maxbytes: maximum size of the queued texts; None means no limit
+
+    """
+
+    def __init__(self, maxsize=0, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.lock = threading.Condition()
+        # edits of each site, a heap of (-priority, number, request)
+        self.lanes = {}
+        # the running lane thread of each site
+        self.threads = {}
+        self.count = 0
+        self.bytes = 0
+        self._numbers = itertools.count()
+
+    def _full(self, request):
+        if not self.count:
+            # a single edit is always accepted
+            return False
+        if self.maxsize > 0 and self.count >= self.maxsize:
+            return True
+        return (self.maxbytes is not None
+                and self.bytes + request.size > self.maxbytes)
+
+    def put(self, request):
+        """Queue request; block while the queue is full."""
+        site = request.page.site()
+        self.lock.acquire()
+        try:
+            waitFor(lambda: not self._full(request), self.lock.wait)
+            heapq.heappush(self.lanes.setdefault(site, []),
+                           (-request.priority, self._numbers.next(),
+                            request))
+            self.count += 1
+            self.bytes += request.size
+            if site not in self.threads:
+                thread = threading.Thread(target=self._lane, args=(site,),
+                                          name='Put-Thread-%s' % site)
+                thread.setDaemon(True)
+                self.threads[site] = thread
+                thread.start()
+        finally:
+            self.lock.release()
+
+    def _lane(self, site):
+        """Save the queued edits for site; stop when there are none left."""
+        while True:
+            self.lock.acquire()
+            try:
+                lane = self.lanes.get(site)
+                if not lane:
+                    self.lanes.pop(site, None)
+                    del self.threads[site]
+                    self.lock.notifyAll()
+                    return
+                request = heapq.heappop(lane)[2]
+            finally:
+                self.lock.release()
+            try:
+                request.run()
+            finally:
+                self.lock.acquire()
+                try:
+                    self.count -= 1
+                    self.bytes -= request.size
+                    self.lock.notifyAll()
+                finally:
+                    self.lock.release()
+
+    def pending(self):
+        """Return a dict of the number of edits left for each site.
+
+        The edit being saved is included.
+
+        """
+        self.lock.acquire()
+        try:
+            result = dict((site, len(lane))
+                          for site, lane in self.lanes.iteritems())
+            for site in self.threads:
+                # count the edit the lane is working on
+                result[site] = result.get(site, 0) + 1
+            return result
+        finally:
+            self.lock.release()
+
+    def join(self, timeout=None):
+        """Wait until all edits are done or timeout seconds have passed.
+
+        Return True if all edits are done.
+
+        """
+        self.lock.acquire()
+        try:
+            return waitFor(lambda: not self.threads, self.lock.wait, timeout)
+        finally:
+            self.lock.release()
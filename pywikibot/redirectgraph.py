@@ -0,0 +1,291 @@
+# -*- coding: utf-8  -*-
+"""
+The redirects of a wiki as a compact graph.
+
+Every title is given a number, and the redirects are kept in arrays indexed
+by these numbers: the number of the target of each page (or NONE if it is not
+a redirect) and whether the page exists. So even the millions of redirects
+of a large wiki take only some bytes each besides their titles.
+
+As every page redirects to at most one other page, analyze() finds the
+broken and double redirects, the length of every redirect chain and the
+redirect loops in a single pass over the arrays.
+
+The graph can be saved and loaded again, so a later run only needs to apply
+the changes made on the wiki since the timestamp of the graph.
+"""
+#
+# (C) Pywikibot team, 2014
+#
+# Distributed under the terms of the MIT license.
+#
+__version__ = '$Id$'
+
+import array
+import os
+import cPickle as pickle
+
+# target of a page which is not a redirect
+NONE = -1
+# target of a redirect whose target is not known
+UNKNOWN = -2
+# chain length of redirects in or leading to a loop
+LOOP = -1
+
+
+class RedirectGraph(object):
+    """Redirects and pages of a wiki.
+
+    >>> graph = RedirectGraph()
+    >>> graph.addRedirect(u'A', u'B')
+    >>> graph.addRedirect(u'B', u'C')
+    >>> graph.addPage(u'C')
+    >>> graph.addRedirect(u'D', u'E')
+    >>> list(graph.doubleRedirects()), list(graph.brokenRedirects())
+    ([u'A'], [u'D'])
+    >>> graph.chainLength(u'A'), graph.finalTarget(u'A')
+    (2, u'C')
+
+    """
+
+    def __init__(self, site=None, timestamp=None):
+        # repr() of the site the graph belongs to
+        self.site = site
+        # time of the last change included, as a MediaWiki timestamp
+        self.timestamp = timestamp
+        self.ids = {}
+        self.titles = []
+        self.targets = array.array('i')
+        self.exists = array.array('b')
+        # chain lengths computed by analyze(), None if outdated
+        self.lengths = None
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __contains__(self, title):
+        return title in self.ids
+
+    def _id(self, title):
+        """Return the number of title, adding it if necessary."""
+        try:
+            return self.ids[title]
+        except KeyError:
+            i = self.ids[title] = len(self.titles)
+            self.titles.append(title)
+            self.targets.append(NONE)
+            self.exists.append(0)
+            return i
+
+    def addPage(self, title):
+        """Record that title exists and is not a redirect."""
+        i = self._id(title)
+        self.targets[i] = NONE
+        self.exists[i] = 1
+        self.lengths = None
+
+    def addRedirect(self, title, target=None):
+        """Record that title redirects to target.
+
+        If target is None, title is a redirect to an unknown page; a target
+        known already is kept then.
+
+        """
+        i = self._id(title)
+        if target is not None:
+            self.targets[i] = self._id(target)
+        elif self.targets[i] < 0:
+            self.targets[i] = UNKNOWN
+        self.exists[i] = 1
+        self.lengths = None
+
+    def removePage(self, title):
+        """Record that title does not exist."""
+        if title in self.ids:
+            i = self.ids[title]
+            self.targets[i] = NONE
+            self.exists[i] = 0
+            self.lengths = None
+
+    def isRedirect(self, title):
+        return title in self.ids and self.targets[self.ids[title]] != NONE
+
+    def target(self, title):
+        """Return the target of the redirect title, or None."""
+        target = self.targets[self.ids[title]]
+        if target >= 0:
+            return self.titles[target]
+        return None
+
+    def redirects(self):
+        """Yield the (title, target) pairs of all redirects.
+
+        target is None if it is not known.
+
+        """
+        titles = self.titles
+        for i, target in enumerate(self.targets):
+            if target >= 0:
+                yield titles[i], titles[target]
+            elif target == UNKNOWN:
+                yield titles[i], None
+
+    def analyze(self):
+        """Compute the length of every redirect chain.
+
+        The length of a redirect is the number of redirects passed until a
+        page is reached which is not a redirect: 1 for a normal redirect,
+        2 or more for double redirects, LOOP for redirects in or leading
+        into a loop. Redirects to an unknown target count as 1.
+
+        """
+        targets = self.targets
+        n = len(targets)
+        lengths = array.array('i', [0]) * n
+        # 0: not seen yet, 1: on the current path, 2: done
+        state = bytearray(n)
+        for start in xrange(n):
+            if state[start] or targets[start] == NONE:
+                continue
+            if targets[start] == UNKNOWN:
+                lengths[start] = 1
+                state[start] = 2
+                continue
+            # follow the chain until a page is reached whose length is
+            # known
+            path = []
+            node = start
+            while targets[node] >= 0 and not state[node]:
+                state[node] = 1
+                path.append(node)
+                node = targets[node]
+            if targets[node] == NONE:
+                length = 0
+            elif targets[node] == UNKNOWN:
+                length = 1
+                lengths[node] = 1
+                state[node] = 2
+            elif state[node] == 2:
+                length = lengths[node]
+            else:
+                # back on the current path
+                length = LOOP
+            for node in reversed(path):
+                if length != LOOP:
+                    length += 1
+                lengths[node] = length
+                state[node] = 2
+        self.lengths = lengths
+        return lengths
+
+    def _lengths(self):
+        if self.lengths is None:
+            self.analyze()
+        return self.lengths
+
+    def chainLength(self, title):
+        """Return the chain length of redirect title; None for loops."""
+        length = self._lengths()[self.ids[title]]
+        if length == LOOP:
+            return None
+        return length
+
+    def finalTarget(self, title):
+        """Return the page the chain of title ends at; None for loops and
+        unknown targets."""
+        i = self.ids[title]
+        length = self._lengths()[i]
+        if length == LOOP:
+            return None
+        for step in xrange(length):
+            i = self.targets[i]
+            if i < 0:
+                return None
+        return self.titles[i]
+
+    def follow(self, title, maxlen):
+        """Return the chain length and the final target of title, like
+        chainLength() and finalTarget(), but only following maxlen redirects.
+
+        Chains which are longer or loops give (maxlen + 1, None). Unlike
+        analyze(), this does not look at the rest of the graph.
+
+        """
+        targets = self.targets
+        i = self.ids[title]
+        length = 0
+        while length <= maxlen:
+            target = targets[i]
+            if target == NONE:
+                return length, self.titles[i]
+            if target == UNKNOWN:
+                return length + 1, None
+            i = target
+            length += 1
+        return maxlen + 1, None
+
+    def isBroken(self, title):
+        """Return True if title is a redirect to a missing page."""
+        target = self.targets[self.ids[title]]
+        return (target >= 0 and self.targets[target] == NONE
+                and not self.exists[target])
+
+    def brokenRedirects(self):
+        """Yield the titles of the redirects to missing pages."""
+        targets = self.targets
+        exists = self.exists
+        for i, target in enumerate(targets):
+            if target >= 0 and targets[target] == NONE and not exists[target]:
+                yield self.titles[i]
+
+    def doubleRedirects(self):
+        """Yield the titles of the redirects to redirects, including
+        loops."""
+        lengths = self._lengths()
+        for i, length in enumerate(lengths):
+            if length > 1 or length == LOOP:
+                yield self.titles[i]
+
+    def loops(self):
+        """Yield the titles of the redirects in or leading into loops."""
+        lengths = self._lengths()
+        for i, length in enumerate(lengths):
+            if length == LOOP:
+                yield self.titles[i]
+
+    def save(self, filename):
+        """Write the graph to filename."""
+        data = {
+            'version': 1,
+            'site': self.site,
+            'timestamp': self.timestamp,
+            'titles': u'\n'.join(self.titles).encode('utf-8'),
+            'targets': self.targets.tostring(),
+            'exists': self.exists.tostring(),
+        }
+        tempname = filename + '.new'
+        f = open(tempname, 'wb')
+        try:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        # os.rename() does not replace existing files on Windows
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tempname, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """Return the graph saved in filename."""
+        f = open(filename, 'rb')
+        try:
+            data = pickle.load(f)
+        finally:
+            f.close()
+        graph = cls(data['site'], data['timestamp'])
+        if data['titles']:
+            graph.titles = data['titles'].decode('utf-8').split(u'\n')
+        graph.ids = dict((title, i) for i, title in enumerate(graph.titles))
+        graph.targets.fromstring(data['targets'])
+        graph.exists.fromstring(data['exists'])
+        return graph
@@ -0,0 +1,193 @@
+# -*- coding: utf-8  -*-
+"""
+Snapshots of site metadata shared between bot runs.
+
+The site information (general data, namespaces, magic words, ...) and the
+MediaWiki messages of a site are loaded from the wiki only once and then kept
+in a SQLite database in the data directory. Later runs of the bots read them
+from there instead of asking the wiki again, which makes short scripts start
+much faster. Several bots may use the database at the same time.
+
+Each snapshot is stored with a version made from the snapshot format and the
+MediaWiki version of the family file, so a snapshot is discarded after the
+family file has been updated. Snapshots older than config.site_snapshot_ttl
+seconds are refreshed by the Site object.
+"""
+#
+# (C) Pywikibot team, 2014
+#
+# Distributed under the terms of the MIT license.
+#
+__version__ = '$Id$'
+
+import threading
+import time
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import config
+
+# increase this when the layout of the stored data changes
+FORMAT = 1
+
+
+class SiteDataStore(object):
+    """SQLite backed store of site metadata snapshots.
+
+    A snapshot is a JSON serializable dict stored for a site and a kind,
+    e.g. 'siteinfo' or 'messages'.
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        # single statements are committed at once, transactions are
+        # started explicitly
+        self.db = sqlite3.connect(filename, timeout=30,
+                                  isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS snapshots '
+                        '(site TEXT, kind TEXT, version TEXT, created REAL, '
+                        'data TEXT, PRIMARY KEY (site, kind))')
+
+    def load(self, site, kind, version):
+        """Return a (data, age) tuple or None if there is no snapshot.
+
+        Snapshots of another version are ignored.
+
+        """
+        self.lock.acquire()
+        try:
+            row = self.db.execute(
+                'SELECT created, data FROM snapshots WHERE site = ? '
+                'AND kind = ? AND version = ?', (site, kind, version)
+            ).fetchone()
+        finally:
+            self.lock.release()
+        if row is None:
+            return None
+        return json.loads(row[1]), time.time() - row[0]
+
+    def save(self, site, kind, version, data):
+        """Replace the snapshot of kind for site by data."""
+        self.lock.acquire()
+        try:
+            self.db.execute('INSERT OR REPLACE INTO snapshots '
+                            'VALUES (?, ?, ?, ?, ?)',
+                            (site, kind, version, time.time(),
+                             json.dumps(data)))
+        finally:
+            self.lock.release()
+
+    def update(self, site, kind, version, data, maxAge=None):
+        """Add the items of data to the snapshot of kind for site.
+
+        Other processes may add items at the same time, so the snapshot is
+        read and written again in one transaction. The age of an existing
+        snapshot is kept, unless it is older than maxAge seconds; then it is
+        replaced by data, as its items are being loaded again.
+
+        """
+        self.lock.acquire()
+        try:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.db.execute(
+                    'SELECT created, data FROM snapshots WHERE site = ? '
+                    'AND kind = ? AND version = ?', (site, kind, version)
+                ).fetchone()
+                now = time.time()
+                if row is None or maxAge is not None and \
+                        now - row[0] > maxAge:
+                    created, old = now, {}
+                else:
+                    created, old = row[0], json.loads(row[1])
+                old.update(data)
+                self.db.execute('INSERT OR REPLACE INTO snapshots '
+                                'VALUES (?, ?, ?, ?, ?)',
+                                (site, kind, version, created,
+                                 json.dumps(old)))
+            except:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+        finally:
+            self.lock.release()
+
+    def delete(self, site=None):
+        """Delete the snapshots of site, or all snapshots."""
+        self.lock.acquire()
+        try:
+            if site is None:
+                self.db.execute('DELETE FROM snapshots')
+            else:
+                self.db.execute('DELETE FROM snapshots WHERE site = ?',
+                                (site,))
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """Close the database."""
+        self.lock.acquire()
+        try:
+            self.db.close()
+        finally:
+            self.lock.release()
+
+
+_store = None
+
+
+def getStore():
+    """Return the snapshot store, or None if snapshots are disabled."""
+    global _store
+    if not config.site_snapshot or sqlite3 is None:
+        return None
+    if _store is None:
+        _store = SiteDataStore(config.datafilepath('pywikibot',
+                                                   'sitedata.db'))
+    return _store
+
+
+def version(site):
+    """Return the snapshot version for site."""
+    return u'%i:%s' % (FORMAT, site.family.version(site.lang))
+
+
+def load(site, kind):
+    """Return a (data, age) tuple of the snapshot of kind for site or None."""
+    store = getStore()
+    if store is None:
+        return None
+    try:
+        return store.load(repr(site), kind, version(site))
+    except (sqlite3.Error, ValueError):
+        # a broken snapshot is loaded from the wiki again
+        return None
+
+
+def save(site, kind, data, merge=False):
+    """Store data as the snapshot of kind for site.
+
+    If merge is True, data is added to the existing snapshot, unless that
+    one is older than config.site_snapshot_ttl.
+
+    """
+    store = getStore()
+    if store is None:
+        return
+    try:
+        if merge:
+            store.update(repr(site), kind, version(site), data,
+                         config.site_snapshot_ttl)
+        else:
+            store.save(repr(site), kind, version(site), data)
+    except sqlite3.Error:
+        pass
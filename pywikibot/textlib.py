@@ -16,6 +16,8 @@ __version__ = '$Id$'
 
 import wikipedia as pywikibot
 import re
+import sre_constants
+import sre_parse
 from HTMLParser import HTMLParser
 import config
 
@@ -35,77 +37,80 @@ def unescape(s):
     return s
 
 
-def replaceExcept(text, old, new, exceptions, caseInsensitive=False,
-                  allowoverlap=False, marker='', site=None):
-    """
-    Return text with 'old' replaced by 'new', ignoring specified types of text.
-
-    Skips occurences of 'old' within exceptions; e.g., within nowiki tags or
-    HTML comments. If caseInsensitive is true, then use case insensitive
-    regex matching. If allowoverlap is true, overlapping occurences are all
-    replaced (watch out when using this, it might lead to infinite loops!).
-
-    Parameters:
-        text            - a unicode string
-        old             - a compiled or uncompiled regular expression
-        new             - a unicode string (which can contain regular
-                          expression references), or a function which takes
-                          a match object as parameter. See parameter repl of
-                          re.sub().
-        exceptions      - a list of strings which signal what to leave out,
-                          e.g. ['math', 'table', 'template']
-        caseInsensitive - a boolean
-        marker          - a string that will be added to the last replacement;
-                          if nothing is changed, it is added at the end
-
-    """
-    if site is None:
-        site = pywikibot.getSite()
-
-    exceptionRegexes = {
-        'comment':      re.compile(r'(?s)<!--.*?-->'),
-        # section headers
-        'header':       re.compile(r'\r?\n=+.+=+ *\r?\n'),
-        # preformatted text
-        'pre':          re.compile(r'(?ism)<pre>.*?</pre>'),
-        'source':       re.compile(r'(?is)<source .*?</source>'),
-        'score':        re.compile(r'(?is)<score.*?</score>'),
-        # inline references
-        'ref':          re.compile(r'(?ism)<ref[ >].*?</ref>'),
-        # lines that start with a space are shown in a monospace font and
-        # have whitespace preserved.
-        'startspace':   re.compile(r'(?m)^ (.*?)$'),
-        # tables often have whitespace that is used to improve wiki
-        # source code readability.
-        # TODO: handle nested tables.
-        'table':        re.compile(r'(?ims)^{\|.*?^\|}|<table>.*?</table>'),
+# Exception regexes which are the same for all sites; see replaceExcept().
+_EXCEPTION_REGEXES = {
+    'comment':      re.compile(r'(?s)<!--.*?-->'),
+    # section headers
+    'header':       re.compile(r'\r?\n=+.+=+ *\r?\n'),
+    # preformatted text
+    'pre':          re.compile(r'(?ism)<pre>.*?</pre>'),
+    'source':       re.compile(r'(?is)<source .*?</source>'),
+    'score':        re.compile(r'(?is)<score.*?</score>'),
+    # inline references
+    'ref':          re.compile(r'(?ism)<ref[ >].*?</ref>'),
+    # lines that start with a space are shown in a monospace font and
+    # have whitespace preserved.
+    'startspace':   re.compile(r'(?m)^ (.*?)$'),
+    # tables often have whitespace that is used to improve wiki
+    # source code readability.
+    # TODO: handle nested tables.
+    'table':        re.compile(r'(?ims)^{\|.*?^\|}|<table>.*?</table>'),
+    'gallery':      re.compile(r'(?is)<gallery.*?>.*?</gallery>'),
+    # this matches internal wikilinks, but also interwiki, categories, and
+    # images.
+    'link':         re.compile(r'\[\[[^\]\|]*(\|[^\]]*)?\]\]'),
+    # Wikidata property inclusions
+    'property':     re.compile(r'(?i)\{\{\s*#property:\s*p\d+\s*\}\}'),
+    # Module invocations (currently only Lua)
+    'invoke':       re.compile(r'(?i)\{\{\s*#invoke:.*?}\}'),
+}
+
+# site -> dict of the exception regexes depending on the site
+_siteExceptionRegexes = {}
+# (site, exceptions) -> (list of regexes, except_templates)
+_exceptionsCache = {}
+
+_GROUP_REGEX = re.compile(r'\\(?P<number>\d+)|\\g<(?P<name>.+?)>')
+_VALUE_REGEX = re.compile('{{{.+?}}}')
+
+
+def _getExceptionRegexes(site):
+    """Return the dict of exception regexes for site, compiled only once."""
+    try:
+        return _siteExceptionRegexes[site]
+    except KeyError:
+        pass
+    exceptionRegexes = dict(_EXCEPTION_REGEXES)
+    exceptionRegexes.update({
         'hyperlink':    compileLinkR(),
-        'gallery':      re.compile(r'(?is)<gallery.*?>.*?</gallery>'),
-        # this matches internal wikilinks, but also interwiki, categories, and
-        # images.
-        'link':         re.compile(r'\[\[[^\]\|]*(\|[^\]]*)?\]\]'),
         # also finds links to foreign sites with preleading ":"
         'interwiki':    re.compile(r'(?i)\[\[:?(%s)\s?:[^\]]*\]\][\s]*'
                                    % '|'.join(site.validLanguageLinks() +
                                               site.family.obsolete.keys())),
-        # Wikidata property inclusions
-        'property':     re.compile(r'(?i)\{\{\s*#property:\s*p\d+\s*\}\}'),
-        # Module invocations (currently only Lua)
-        'invoke':       re.compile(r'(?i)\{\{\s*#invoke:.*?}\}'),
         # categories
         'category':     re.compile(u'\[\[ *(?:%s)\s*:.*?\]\]' % u'|'.join(site.namespace(14, all=True))),
         #files
         'file':         re.compile(u'\[\[ *(?:%s)\s*:.*?\]\]' % u'|'.join(site.namespace(6, all=True))),
+    })
+    _siteExceptionRegexes[site] = exceptionRegexes
+    return exceptionRegexes
 
-    }
 
-    # if we got a string, compile it as a regular expression
-    if isinstance(old, basestring):
-        if caseInsensitive:
-            old = re.compile(old, re.IGNORECASE | re.UNICODE)
-        else:
-            old = re.compile(old)
+def _compileExceptions(exceptions, site):
+    """Return the regexes for the exceptions and whether to skip templates.
 
+    The result is memoized for each site and list of exceptions.
+
+    """
+    try:
+        key = (site, tuple(exceptions))
+        return _exceptionsCache[key]
+    except TypeError:
+        # unhashable exceptions; don't cache them
+        key = None
+    except KeyError:
+        pass
+    exceptionRegexes = _getExceptionRegexes(site)
     dontTouchRegexes = []
     except_templates = False
     for exc in exceptions:
@@ -128,21 +133,30 @@ def replaceExcept(text, old, new, exceptions, caseInsensitive=False,
         else:
             # assume it's a regular expression
             dontTouchRegexes.append(exc)
+    if key is not None:
+        if len(_exceptionsCache) >= 1000:
+            _exceptionsCache.clear()
+        _exceptionsCache[key] = (dontTouchRegexes, except_templates)
+    return dontTouchRegexes, except_templates
 
-    # mark templates
-    # don't care about mw variables and parser functions
-    if except_templates:
+
+class _TemplateHider(object):
+    """Replace templates and template parameters in a text by markers.
+
+    restore() puts them back into the text. The regex matching the template
+    markers is stored in Rmarker1.
+
+    """
+
+    def __init__(self, text):
         marker1 = findmarker(text)
         marker2 = findmarker(text, u'##', u'#')
-        Rvalue = re.compile('{{{.+?}}}')
-        Rmarker1 = re.compile('%(mark)s(\d+)%(mark)s' % {'mark': marker1})
-        Rmarker2 = re.compile('%(mark)s(\d+)%(mark)s' % {'mark': marker2})
-        # hide the flat template marker
-        dontTouchRegexes.append(Rmarker1)
+        self.Rmarker1 = re.compile('%(mark)s(\d+)%(mark)s' % {'mark': marker1})
+        self.Rmarker2 = re.compile('%(mark)s(\d+)%(mark)s' % {'mark': marker2})
         origin = text
         values = {}
         count = 0
-        for m in Rvalue.finditer(text):
+        for m in _VALUE_REGEX.finditer(text):
             count += 1
             # If we have digits between brackets, restoring from dict may fail.
             # So we need to change the index. We have to search in the origin.
@@ -166,11 +180,110 @@ def replaceExcept(text, old, new, exceptions, caseInsensitive=False,
                 text = text.replace(item, '%s%d%s' % (marker1, count, marker1))
 
                 # Make sure stored templates don't contain markers
-                for m2 in Rmarker1.finditer(item):
+                for m2 in self.Rmarker1.finditer(item):
                     item = item.replace(m2.group(), inside[int(m2.group(1))])
-                for m2 in Rmarker2.finditer(item):
+                for m2 in self.Rmarker2.finditer(item):
                     item = item.replace(m2.group(), values[int(m2.group(1))])
                 inside[count] = item
+        self.text = text
+        self.inside = inside
+        self.values = values
+
+    def restore(self, text):
+        for m2 in self.Rmarker1.finditer(text):
+            text = text.replace(m2.group(), self.inside[int(m2.group(1))])
+        for m2 in self.Rmarker2.finditer(text):
+            text = text.replace(m2.group(), self.values[int(m2.group(1))])
+        return text
+
+
+def _compileOld(old, caseInsensitive):
+    # if we got a string, compile it as a regular expression
+    if isinstance(old, basestring):
+        if caseInsensitive:
+            old = re.compile(old, re.IGNORECASE | re.UNICODE)
+        else:
+            old = re.compile(old)
+    return old
+
+
+def _expandReplacement(new, match):
+    """Return the replacement for match; see parameter new of replaceExcept.
+    """
+    if callable(new):
+        # the parameter new can be a function which takes the match
+        # as a parameter.
+        return new(match)
+    # it is not a function, but a string.
+
+    # it is a little hack to make \n work. It would be better
+    # to fix it previously, but better than nothing.
+    new = new.replace('\\n', '\n')
+
+    # We cannot just insert the new string, as it may contain regex
+    # group references such as \2 or \g<name>.
+    # On the other hand, this approach does not work because it
+    # can't handle lookahead or lookbehind (see bug #1731008):
+    #replacement = old.sub(new, text[match.start():match.end()])
+    #text = text[:match.start()] + replacement + text[match.end():]
+
+    # So we have to process the group references manually.
+    replacement = new
+
+    while True:
+        groupMatch = _GROUP_REGEX.search(replacement)
+        if not groupMatch:
+            break
+        groupID = (groupMatch.group('name') or
+                   int(groupMatch.group('number')))
+        try:
+            replacement = (replacement[:groupMatch.start()] +
+                           ('' if match.group(groupID) is None else match.group(groupID)) + \
+                           replacement[groupMatch.end():])
+        except IndexError:
+            pywikibot.output('\nInvalid group reference: %s' % groupID)
+            pywikibot.output('Groups found:\n%s' % match.groups())
+            raise IndexError
+    return replacement
+
+
+def replaceExcept(text, old, new, exceptions, caseInsensitive=False,
+                  allowoverlap=False, marker='', site=None):
+    """
+    Return text with 'old' replaced by 'new', ignoring specified types of text.
+
+    Skips occurences of 'old' within exceptions; e.g., within nowiki tags or
+    HTML comments. If caseInsensitive is true, then use case insensitive
+    regex matching. If allowoverlap is true, overlapping occurences are all
+    replaced (watch out when using this, it might lead to infinite loops!).
+
+    Parameters:
+        text            - a unicode string
+        old             - a compiled or uncompiled regular expression
+        new             - a unicode string (which can contain regular
+                          expression references), or a function which takes
+                          a match object as parameter. See parameter repl of
+                          re.sub().
+        exceptions      - a list of strings which signal what to leave out,
+                          e.g. ['math', 'table', 'template']
+        caseInsensitive - a boolean
+        marker          - a string that will be added to the last replacement;
+                          if nothing is changed, it is added at the end
+
+    """
+    if site is None:
+        site = pywikibot.getSite()
+
+    old = _compileOld(old, caseInsensitive)
+    dontTouchRegexes, except_templates = _compileExceptions(exceptions, site)
+
+    # mark templates
+    # don't care about mw variables and parser functions
+    if except_templates:
+        hider = _TemplateHider(text)
+        text = hider.text
+        # hide the flat template marker
+        dontTouchRegexes = dontTouchRegexes + [hider.Rmarker1]
     index = 0
     markerpos = len(text)
     while True:
@@ -195,42 +308,7 @@ def replaceExcept(text, old, new, exceptions, caseInsensitive=False,
             index = nextExceptionMatch.end()
         else:
             # We found a valid match. Replace it.
-            if callable(new):
-                # the parameter new can be a function which takes the match
-                # as a parameter.
-                replacement = new(match)
-            else:
-                # it is not a function, but a string.
-
-                # it is a little hack to make \n work. It would be better
-                # to fix it previously, but better than nothing.
-                new = new.replace('\\n', '\n')
-
-                # We cannot just insert the new string, as it may contain regex
-                # group references such as \2 or \g<name>.
-                # On the other hand, this approach does not work because it
-                # can't handle lookahead or lookbehind (see bug #1731008):
-                #replacement = old.sub(new, text[match.start():match.end()])
-                #text = text[:match.start()] + replacement + text[match.end():]
-
-                # So we have to process the group references manually.
-                replacement = new
-
-                groupR = re.compile(r'\\(?P<number>\d+)|\\g<(?P<name>.+?)>')
-                while True:
-                    groupMatch = groupR.search(replacement)
-                    if not groupMatch:
-                        break
-                    groupID = (groupMatch.group('name') or
-                               int(groupMatch.group('number')))
-                    try:
-                        replacement = (replacement[:groupMatch.start()] +
-                                       ('' if match.group(groupID) is None else match.group(groupID)) + \
-                                       replacement[groupMatch.end():])
-                    except IndexError:
-                        pywikibot.output('\nInvalid group reference: %s' % groupID)
-                        pywikibot.output('Groups found:\n%s' % match.groups())
-                        raise IndexError
+            replacement = _expandReplacement(new, match)
             text = text[:match.start()] + replacement + text[match.end():]
 
             # continue the search on the remaining text
@@ -242,13 +320,412 @@ def replaceExcept(text, old, new, exceptions, caseInsensitive=False,
     text = text[:markerpos] + marker + text[markerpos:]
 
     if except_templates:  # restore templates from dict
-        for m2 in Rmarker1.finditer(text):
-            text = text.replace(m2.group(), inside[int(m2.group(1))])
-        for m2 in Rmarker2.finditer(text):
-            text = text.replace(m2.group(), values[int(m2.group(1))])
+        text = hider.restore(text)
     return text
 
 
+def _findExceptionSpans(text, dontTouchRegexes):
+    """Return the sorted list of [start, end] spans protected by exceptions.
+
+    The spans are the ones replaceExcept would skip when scanning text.
+
+    """
+    spans = []
+    index = 0
+    while index <= len(text):
+        nextExceptionMatch = None
+        for dontTouchR in dontTouchRegexes:
+            excMatch = dontTouchR.search(text, index)
+            if excMatch and (
+                    nextExceptionMatch is None or
+                    excMatch.start() < nextExceptionMatch.start()):
+                nextExceptionMatch = excMatch
+        if nextExceptionMatch is None:
+            break
+        spans.append([nextExceptionMatch.start(), nextExceptionMatch.end()])
+        index = max(nextExceptionMatch.end(), index + 1)
+    return spans
+
+
+def _replaceOutsideSpans(text, spans, old, new, allowoverlap=False,
+                         markerpos=None, changes=None):
+    """Replace old by new in text, skipping matches starting in a span.
+
+    spans is a sorted list of [start, end] lists as returned by
+    _findExceptionSpans(). Return the new text, the spans moved to their
+    positions in the new text, and the end of the last replacement (or
+    markerpos if nothing was replaced).
+
+    If changes is a list, the (start, end) positions of the replacements in
+    the new text are appended to it.
+
+    """
+    if allowoverlap:
+        # a replacement may create new matches; replace in place
+        spans = [list(span) for span in spans]
+        index = 0
+        i = 0  # index of the first span which may lie behind index
+        while True:
+            match = old.search(text, index)
+            if not match:
+                break
+            start = match.start()
+            while i < len(spans) and spans[i][1] <= start \
+                    and spans[i][0] < start:
+                i += 1
+            if i < len(spans) and spans[i][0] <= start:
+                # the match starts within a protected span. Skip.
+                index = max(spans[i][1], index + 1)
+                continue
+            replacement = _expandReplacement(new, match)
+            text = text[:start] + replacement + text[match.end():]
+            # move the spans behind the replaced text
+            delta = len(replacement) - (match.end() - start)
+            for span in spans[i:]:
+                if span[0] < match.end():
+                    # the match overlapped the span; shorten it
+                    span[0] = match.end()
+                    span[1] = max(span[0], span[1])
+                span[0] += delta
+                span[1] += delta
+            index = start + 1
+            markerpos = start + len(replacement)
+            if changes is not None:
+                # later replacements may move this one; report everything
+                changes[:] = [(0, len(text))]
+        return text, spans, markerpos
+
+    # Scan the text once and collect the pieces of the new text.
+    pieces = []
+    newspans = []
+    pos = 0  # end of the text already copied to pieces
+    index = 0
+    i = 0
+    delta = 0  # difference of the lengths of new and old text so far
+    lastpos = None
+    while True:
+        match = old.search(text, index)
+        if not match:
+            break
+        start, end = match.span()
+        while i < len(spans) and spans[i][1] <= start \
+                and spans[i][0] < start:
+            newspans.append([spans[i][0] + delta, spans[i][1] + delta])
+            i += 1
+        if i < len(spans) and spans[i][0] <= start:
+            # the match starts within a protected span. Skip.
+            index = max(spans[i][1], index + 1)
+            continue
+        replacement = _expandReplacement(new, match)
+        pieces.append(text[pos:start])
+        pieces.append(replacement)
+        # the match may overlap the following spans; shorten them
+        j = i
+        while j < len(spans) and spans[j][0] < end:
+            spans[j] = [end, max(end, spans[j][1])]
+            j += 1
+        lastpos = start + delta + len(replacement)
+        if changes is not None:
+            changes.append((start + delta, lastpos))
+        delta += len(replacement) - (end - start)
+        pos = end
+        index = end if end > start else end + 1
+    if lastpos is None:
+        return text, spans, markerpos
+    for span in spans[i:]:
+        newspans.append([span[0] + delta, span[1] + delta])
+    pieces.append(text[pos:])
+    return ''.join(pieces), newspans, lastpos
+
+
+def replaceExceptMulti(text, replacements, exceptions, caseInsensitive=False,
+                       allowoverlap=False, marker='', site=None):
+    """
+    Return text with all replacements done, ignoring specified types of text.
+
+    Does the same as calling replaceExcept() for each (old, new) tuple of
+    replacements in turn, using a MultipleReplacer.
+
+    Parameters:
+        replacements    - a list of (old, new) tuples; see replaceExcept()
+                          for the meaning of old and new.
+        For the other parameters see replaceExcept().
+
+    """
+    replacer = MultipleReplacer(replacements, exceptions, caseInsensitive,
+                                allowoverlap, site)
+    return replacer.replace(text, marker)
+
+
+def _literalOf(regex, prefix=False):
+    """Return the text a compiled regex matches literally, or None.
+
+    If prefix is True, return the longest literal text which is part of
+    every match of the regex instead (or None if there is none).
+
+    """
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except (sre_constants.error, TypeError):
+        return None
+    if (regex.flags | parsed.pattern.flags) & re.IGNORECASE:
+        return None
+    runs = [[]]
+    for op, av in parsed:
+        if op == sre_constants.LITERAL:
+            runs[-1].append(unichr(av))
+        elif prefix:
+            runs.append([])
+        else:
+            return None
+    literal = max([u''.join(run) for run in runs], key=len)
+    return literal or None
+
+
+def _trieRegex(words):
+    """Return a regex string matching any of the words, built as a trie.
+
+    The regex tries the longest word first at every position.
+
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[None] = None
+
+    def toRegex(node):
+        alternatives = [re.escape(char) + toRegex(child)
+                        for char, child in sorted(node.items())
+                        if char is not None]
+        if not alternatives:
+            return u''
+        if len(alternatives) == 1:
+            regex = alternatives[0]
+        else:
+            regex = u'(?:%s)' % u'|'.join(alternatives)
+        if None in node:
+            if len(alternatives) == 1 and len(regex) > 1:
+                regex = u'(?:%s)' % regex
+            regex += u'?'
+        return regex
+
+    return toRegex(trie)
+
+
+class MultipleReplacer(object):
+    """
+    Apply many replacements to texts, e.g. the ones of a fix of fixes.py.
+
+    Does the same as calling replaceExcept() for each (old, new) tuple of
+    replacements in turn, but
+        - the literal text each regex needs to match is searched for in one
+          pass over the text, and only replacements which can match are
+          applied (candidates()),
+        - the text parts protected by the exceptions are searched again only
+          after a replacement changed the text,
+        - if there are no exceptions, consecutive replacements of literal
+          text which don't interfere with each other are done together in a
+          single pass.
+
+    Parameters:
+        replacements    - a list of (old, new) tuples; see replaceExcept()
+        For the other parameters see replaceExcept().
+
+    """
+
+    def __init__(self, replacements, exceptions, caseInsensitive=False,
+                 allowoverlap=False, site=None):
+        if site is None:
+            site = pywikibot.getSite()
+        self.site = site
+        self.exceptions = exceptions
+        self.allowoverlap = allowoverlap
+        self.replacements = [(_compileOld(old, caseInsensitive), new)
+                             for old, new in replacements]
+        # literal text which is replaced by a literal text for each
+        # replacement, or None
+        self._literals = []
+        # index of replacements without any required literal text
+        self._always = set()
+        required = {}
+        for i, (old, new) in enumerate(self.replacements):
+            literal = None
+            if isinstance(new, basestring) \
+                    and not re.search(r'\\(\d|g<)', new):
+                literal = _literalOf(old)
+            self._literals.append(literal)
+            if literal is None:
+                literal = _literalOf(old, prefix=True)
+            if literal is None:
+                self._always.add(i)
+            else:
+                required.setdefault(literal, set()).add(i)
+        # for each required literal text, the replacements needing one of
+        # its prefixes, because the scanner finds the longest one only
+        self._byLiteral = {}
+        for literal in required:
+            self._byLiteral[literal] = set()
+            for j in range(1, len(literal) + 1):
+                self._byLiteral[literal].update(
+                    required.get(literal[:j], ()))
+        # length of the longest required literal text
+        self._maxlength = max([len(literal) for literal in required] or [0])
+        if required:
+            self._scanner = re.compile(
+                u'(?=(%s))' % _trieRegex(required), re.UNICODE)
+        else:
+            self._scanner = None
+        self._conflicts = {}
+
+    def candidates(self, text):
+        """Return the set of indices of the replacements which may match.
+
+        The other replacements can't match text because it doesn't contain
+        the literal text they require.
+
+        """
+        found = set(self._always)
+        if self._scanner is not None:
+            for literal in set(self._scanner.findall(text)):
+                found.update(self._byLiteral[literal])
+        return found
+
+    def _addCandidates(self, candidates, text, changes):
+        """Add the replacements which may match the changed parts of text.
+
+        changes is a list of the (start, end) positions of the changes.
+
+        """
+        if self._scanner is None:
+            return
+        # a new match of a required literal text overlaps a change
+        margin = self._maxlength - 1
+        start = end = 0
+        for changeStart, changeEnd in changes + [(None, None)]:
+            if changeStart is not None and changeStart - margin <= end:
+                end = changeEnd + margin
+                continue
+            if end > start:
+                candidates.update(self.candidates(text[start:end]))
+            if changeStart is not None:
+                start = max(0, changeStart - margin)
+                end = changeEnd + margin
+
+    def _conflict(self, i, j):
+        """Return True if literal replacement j can't be done together with i.
+
+        i must come before j. This is the case if the texts they replace
+        overlap, or if the replacement of i may create text j matches.
+
+        """
+        key = (i, j)
+        if key not in self._conflicts:
+            a, b = self._literals[i], self._literals[j]
+            self._conflicts[key] = a in b or b in a \
+                or any(a.endswith(b[:k]) or b.endswith(a[:k])
+                       for k in range(1, min(len(a), len(b)))) \
+                or self._creates(i, b)
+        return self._conflicts[key]
+
+    def _creates(self, i, literal):
+        """Return True if replacement i may create a match of literal.
+
+        Removing text may join the text around it, otherwise the literal
+        text must contain a character of the replacement.
+
+        """
+        new = self.replacements[i][1]
+        return not new or bool(set(new) & set(literal))
+
+    def _nextStep(self, candidates, start, merge=True):
+        """Return the next replacement step and the index to continue at.
+
+        A step is an (old, new) tuple, either one replacement or, if merge
+        is True, several literal ones merged into a single regex.
+
+        """
+        group = [start]
+        if merge and self._literals[start] is not None \
+                and not self.allowoverlap:
+            for j in range(start + 1, len(self.replacements)):
+                if j not in candidates:
+                    # the group must not create text it could match
+                    literal = self._literals[j] or _literalOf(
+                        self.replacements[j][0], prefix=True)
+                    if literal is None or any(self._creates(g, literal)
+                                              for g in group):
+                        break
+                    continue
+                if self._literals[j] is None \
+                        or any(self._conflict(g, j) for g in group):
+                    break
+                group.append(j)
+        if len(group) == 1:
+            return self.replacements[start], start + 1
+        table = dict((self._literals[g],
+                      self.replacements[g][1].replace('\\n', '\n'))
+                     for g in group)
+        words = sorted(table, key=len, reverse=True)
+        old = re.compile(u'|'.join(re.escape(word) for word in words),
+                         re.UNICODE)
+        return (old, lambda match: table[match.group()]), group[-1] + 1
+
+    def replace(self, text, marker=''):
+        """Return text with all replacements done.
+
+        marker is added to the last replacement; if nothing is changed,
+        it is added at the end.
+
+        """
+        candidates = self.candidates(text)
+        if not candidates:
+            return text + marker
+        dontTouchRegexes, except_templates = _compileExceptions(
+            self.exceptions, self.site)
+        # a replacement may create text protected by the exceptions, which
+        # can't be foreseen when merging replacements
+        merge = not dontTouchRegexes and not except_templates
+
+        def protect(text):
+            """Hide the templates of text and find its exception spans."""
+            hider = None
+            regexes = dontTouchRegexes
+            if except_templates:
+                hider = _TemplateHider(text)
+                text = hider.text
+                regexes = regexes + [hider.Rmarker1]
+            return text, hider, _findExceptionSpans(text, regexes)
+
+        text, hider, spans = protect(text)
+        markerpos = None
+        i = 0
+        while i < len(self.replacements):
+            if i not in candidates:
+                i += 1
+                continue
+            (old, new), i = self._nextStep(candidates, i, merge)
+            changes = []
+            text, spans, markerpos = _replaceOutsideSpans(
+                text, spans, old, new, self.allowoverlap, markerpos, changes)
+            if not changes:
+                continue
+            # the following replacements may match the new text now
+            self._addCandidates(candidates, text, changes)
+            # the changes may have created or destroyed protected text, like
+            # replaceExcept() sees it when called for each replacement
+            if hider is not None:
+                markerpos = len(hider.restore(text[:markerpos]))
+                text = hider.restore(text)
+            text, hider, spans = protect(text)
+        if hider is not None:  # restore templates from dict
+            text = hider.restore(text)
+        if markerpos is None:
+            markerpos = len(text)
+        return text[:markerpos] + marker + text[markerpos:]
+
+
 def removeDisabledParts(text, tags=['*']):
     """
     Return text without portions where wiki markup is disabled
@@ -1,6 +1,15 @@
 # -*- coding: utf-8  -*-
 """
 Mechanics to slow down wiki read and/or write rate.
+
+All bot processes running on the same computer share the allowed request
+rate for a wiki. If config.shared_throttle is True, the processes reserve
+their requests in a SQLite database (see SharedThrottleState); otherwise
+each process counts the others in the throttle.ctrl file and multiplies its
+delays by their number.
+
+Failed requests are retried according to a RetryPolicy, which also slows
+down the requests to a site while it is in trouble.
 """
 #
 # (C) Pywikipedia bot team, 2008
@@ -12,9 +21,16 @@ __version__ = '$Id$'
 import wikipedia as pywikibot
 import config
 
+import email.utils
 import math
+import random
+import re
 import threading
 import time
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
 
 pid = False     # global process identifier
                 # when the first Throttle is instantiated, it will set this
@@ -22,6 +38,267 @@ pid = False     # global process identifier
                 # throttle objects created by this process.
 
 
+def parseRetryAfter(value):
+    """Return the seconds to wait given by a Retry-After header, or None.
+
+    The header contains either a number of seconds or an HTTP date.
+
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(date) - time.time())
+
+
+def parseLag(info):
+    """Return the lag reported by a maxlag error message, or None."""
+    m = re.search(r'Waiting for [^:]+: (\d+(?:\.\d+)?) seconds? lagged', info)
+    if m:
+        return float(m.group(1))
+    return None
+
+
+class RetryPolicy(object):
+    """Common policy of the retry loops of the framework.
+
+    A failed request is retried after a randomized, exponentially growing
+    delay starting at a fraction of a second (see config.retry_wait and
+    config.retry_max_wait). Longer delays requested by the server through a
+    Retry-After header or a maxlag error are respected.
+
+    A request is given up after config.maxretries retries, but not before
+    the waits add up to about config.retry_budget seconds.
+
+    The policy also adapts the request rate to each site: every error or
+    very slow response halves the rate, every fast response raises it again
+    by a small step (AIMD). Large responses may take proportionally longer
+    (see config.slow_response_bytes). Throttles divide their delays by
+    share(site).
+
+    """
+
+    # growth of the delay per retry
+    factor = 4
+    # smallest share of the normal request rate
+    minshare = 1.0 / 64
+    # increase of the share per successful request
+    increase = 1.0 / 16
+
+    def __init__(self, basewait=None, maxwait=None, maxretries=None,
+                 slow=None, budget=None, slowbytes=None):
+        self.basewait = basewait
+        if self.basewait is None:
+            self.basewait = config.retry_wait
+        self.maxwait = maxwait
+        if self.maxwait is None:
+            self.maxwait = config.retry_max_wait
+        self.maxretries = maxretries
+        if self.maxretries is None:
+            self.maxretries = config.maxretries
+        self.slow = slow
+        if self.slow is None:
+            self.slow = config.slow_response
+        self.budget = budget
+        if self.budget is None:
+            self.budget = config.retry_budget
+        self.slowbytes = slowbytes
+        if self.slowbytes is None:
+            self.slowbytes = config.slow_response_bytes
+        self.lock = threading.Lock()
+        self._shares = {}
+
+    def share(self, site):
+        """Return the current share of the normal request rate for site."""
+        return self._shares.get(str(site), 1.0)
+
+    def success(self, site, latency=None, size=0):
+        """Record a successful request to site which took latency seconds.
+
+        size is the length of the response; responses larger than
+        slowbytes may take proportionally longer than slow seconds.
+
+        """
+        if latency is not None and \
+           latency > self.slow * max(1.0, float(size) / self.slowbytes):
+            self.failure(site)
+            return
+        self.lock.acquire()
+        try:
+            key = str(site)
+            if key in self._shares:
+                share = self._shares[key] + self.increase
+                if share >= 1.0:
+                    del self._shares[key]
+                else:
+                    self._shares[key] = share
+        finally:
+            self.lock.release()
+
+    def failure(self, site):
+        """Record a failed request to site."""
+        self.lock.acquire()
+        try:
+            self._shares[str(site)] = max(self.minshare,
+                                          self.share(site) / 2)
+        finally:
+            self.lock.release()
+
+    def _maxdelay(self, attempt):
+        return min(self.maxwait, self.basewait * self.factor ** (attempt - 1))
+
+    def delay(self, attempt, retryafter=None):
+        """Return the seconds to wait before retry number attempt.
+
+        retryafter is the delay requested by the server, if any.
+
+        """
+        delay = self._maxdelay(attempt)
+        # spread the retries of several bots
+        delay = random.uniform(delay / 2, delay)
+        if retryafter is not None:
+            delay = max(delay, min(retryafter, self.maxwait))
+        return delay
+
+    def wait(self, site, attempt, message=None, retryafter=None):
+        """Record a failed request to site and wait before retrying it.
+
+        attempt is the number of the retry, starting at 1; retryafter is
+        the delay requested by the server, if any. If message is given, it
+        is shown together with the delay.
+
+        """
+        self.failure(site)
+        delay = self.delay(attempt, retryafter)
+        if message:
+            pywikibot.warning(u'%s Retrying in %.1f seconds...'
+                              % (message, delay))
+        time.sleep(delay)
+
+    def retry(self, site, attempt, message=None, retryafter=None):
+        """Like wait(), but give up after config.maxretries retries.
+
+        Return False without waiting if attempt exceeds the maximum number
+        of retries and the previous waits took about the retry budget,
+        otherwise True after the delay.
+
+        """
+        # the waits are randomized; count the longest possible ones
+        waited = sum(self._maxdelay(i) for i in range(1, attempt))
+        if attempt > self.maxretries and waited >= self.budget:
+            self.failure(site)
+            return False
+        self.wait(site, attempt, message, retryafter)
+        return True
+
+
+class SharedThrottleState(object):
+    """Throttle state shared by the bot processes of this computer.
+
+    The state is kept in a SQLite database. For each site and for reads and
+    writes separately, it stores the earliest time the next request may be
+    made, and each process reserves the time of its request in a single
+    transaction. So all processes share one budget, and a process which
+    does not make any requests does not slow down the others.
+
+    The database also keeps the list of running processes.
+
+    """
+
+    def __init__(self, filename, timeout=30):
+        self.filename = filename
+        # transactions are started explicitly; the throttle's lock ensures
+        # that the connection is used by one thread at a time
+        self.db = sqlite3.connect(filename, timeout=timeout,
+                                  isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS processes '
+                        '(pid INTEGER, site TEXT, time REAL, '
+                        'PRIMARY KEY (pid, site))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS slots '
+                        '(site TEXT, write INTEGER, next REAL, '
+                        'PRIMARY KEY (site, write))')
+
+    def _transaction(self, function, *args):
+        """Call function(*args) inside of a write transaction."""
+        # BEGIN IMMEDIATE locks the database until COMMIT, so no other
+        # process can read the same slot in between
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            result = function(*args)
+        except:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+        return result
+
+    def register(self, pid, site, dropdelay, releasepid):
+        """Record that process pid is running for site.
+
+        If pid is 0, a new process id is assigned. Return the process id and
+        the number of processes running for site, including this one.
+
+        """
+        return self._transaction(self._register, pid, site, dropdelay,
+                                 releasepid)
+
+    def _register(self, pid, site, dropdelay, releasepid):
+        now = time.time()
+        self.db.execute('DELETE FROM processes WHERE time < ?',
+                        (now - releasepid,))
+        if not pid:
+            maxpid = self.db.execute(
+                'SELECT MAX(pid) FROM processes').fetchone()[0]
+            pid = (maxpid or 0) + 1
+        self.db.execute('INSERT OR REPLACE INTO processes VALUES (?, ?, ?)',
+                        (pid, site, now))
+        count = self.db.execute(
+            'SELECT COUNT(*) FROM processes WHERE site = ? AND time >= ?',
+            (site, now - dropdelay)).fetchone()[0]
+        return pid, count
+
+    def unregister(self, pid):
+        """Remove process pid from the list of running processes."""
+        self._transaction(self.db.execute,
+                          'DELETE FROM processes WHERE pid = ?', (pid,))
+
+    def nextTime(self, site, write=False):
+        """Return the earliest time of the next request to site."""
+        row = self.db.execute(
+            'SELECT next FROM slots WHERE site = ? AND write = ?',
+            (site, int(write))).fetchone()
+        return row and row[0] or 0.0
+
+    def reserve(self, site, delay, write=False):
+        """Reserve the next request to site; return the time to make it.
+
+        The request after this one is allowed delay seconds later.
+
+        """
+        return self._transaction(self._reserve, site, delay, write)
+
+    def _reserve(self, site, delay, write):
+        start = max(time.time(), self.nextTime(site, write))
+        self.db.execute('INSERT OR REPLACE INTO slots VALUES (?, ?, ?)',
+                        (site, int(write), start + delay))
+        return start
+
+    def postpone(self, site, until):
+        """Don't allow any request to site before the time until."""
+        self._transaction(self._postpone, site, until)
+
+    def _postpone(self, site, until):
+        for write in (0, 1):
+            if self.nextTime(site, write) < until:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO slots VALUES (?, ?, ?)',
+                    (site, write, until))
+
+
 class Throttle(object):
     """Control rate of access to wiki server
 
@@ -30,13 +307,18 @@ class Throttle(object):
 
     The framework initiates two Throttle objects: get_throttle to control
     the rate of read access, and put_throttle to control the rate of write
-    access.
+    access. Both throttle the requests to the default site; a throttle for
+    another site is made with the site parameter.
 
     """
     def __init__(self, mindelay=None, maxdelay=None, writedelay=None,
-                 multiplydelay=True, verbosedelay=False, write=False):
+                 multiplydelay=True, verbosedelay=False, write=False,
+                 policy=None, site=None):
         self.lock = threading.RLock()
-        self.mysite = None
+        # RetryPolicy adapting the delays to the state of the site
+        self.policy = policy
+        self.site = site
+        self.mysite = site and str(site)
         self.ctrlfilename = config.datafilepath('pywikibot', 'throttle.ctrl')
         self.mindelay = mindelay
         if self.mindelay is None:
@@ -59,19 +341,55 @@ class Throttle(object):
         self.checktime = 0
         self.verbosedelay = verbosedelay
         self.multiplydelay = multiplydelay
-        if self.multiplydelay:
-            self.checkMultiplicity()
+        # The shared state is opened and the processes are counted when the
+        # throttle is used first, so importing the framework stays cheap.
+        self._shared = False
+        self.process_multiplicity = 1
+        self.registered = False
         self.setDelay()
         self.write = write
 
+    def _getShared(self):
+        if self._shared is False:
+            self._shared = None
+            if config.shared_throttle and sqlite3 is not None:
+                try:
+                    self._shared = SharedThrottleState(
+                        config.datafilepath('pywikibot', 'throttle.db'))
+                except sqlite3.Error, e:
+                    pywikibot.warning(u'Could not open the shared throttle '
+                                      u'database: %s' % e)
+        return self._shared
+
+    def _setShared(self, value):
+        self._shared = value
+
+    shared = property(_getShared, _setShared, doc=
+        "The SharedThrottleState, or None if the throttle.ctrl file is used.")
+
     def checkMultiplicity(self):
         """Count running processes for site and set process_multiplicity."""
         global pid
         self.lock.acquire()
-        mysite = self.mysite = str(pywikibot.getSite())
+        mysite = self.mysite = str(self.site or pywikibot.getSite())
+        self.registered = True
         if pywikibot.verbose:
             pywikibot.output(u"Checking multiplicity: pid = %(pid)s" % globals())
         try:
+            if self.shared is not None:
+                try:
+                    pid, count = self.shared.register(
+                        pid, mysite, self.dropdelay, self.releasepid)
+                except sqlite3.Error, e:
+                    self._sharedFailed(e)
+                else:
+                    self.checktime = time.time()
+                    self.process_multiplicity = count
+                    if self.verbosedelay or pywikibot.verbose:
+                        pywikibot.output(
+                            u"Found %(count)s %(mysite)s processes running, including this one."
+                            % locals())
+                    return
             processes = []
             my_pid = pid or 1  # start at 1 if global pid not yet set
             count = 1
@@ -131,6 +449,13 @@ class Throttle(object):
         finally:
             self.lock.release()
 
+    def _sharedFailed(self, error):
+        """Give up the shared state and count processes in the file."""
+        pywikibot.warning(u'Shared throttle failed, using %s instead: %s'
+                          % (self.ctrlfilename, error))
+        self.shared = None
+        self.checktime = 0
+
     def setDelay(self, delay=None, writedelay=None, absolute=False):
         """Set the nominal delays in seconds. Defaults to config values."""
         self.lock.acquire()
@@ -169,7 +494,11 @@ class Throttle(object):
                 thisdelay = self.mindelay * self.next_multiplicity
             elif thisdelay > self.maxdelay:
                 thisdelay = self.maxdelay
-            thisdelay *= self.process_multiplicity
+            if self.shared is None:
+                # with a shared state, the processes share the delay anyway
+                thisdelay *= self.process_multiplicity
+        if self.policy is not None:
+            thisdelay /= self.policy.share(self._site())
         return thisdelay
 
     def waittime(self, write=False):
@@ -178,6 +507,11 @@ class Throttle(object):
         # delay this time
         thisdelay = self.getDelay(write=write)
         now = time.time()
+        if self.shared is not None:
+            try:
+                return max(0.0, self.shared.nextTime(self._site(), write) - now)
+            except sqlite3.Error, e:
+                self._sharedFailed(e)
         if write:
             ago = now - self.last_write
         else:
@@ -188,10 +522,22 @@ class Throttle(object):
         else:
             return 0.0
 
+    def _site(self):
+        return self.mysite or str(pywikibot.getSite())
+
     def drop(self):
         """Remove me from the list of running bot processes."""
         # drop all throttles with this process's pid, regardless of site
         self.checktime = 0
+        if not self.registered:
+            # this process has never been counted
+            return
+        if self.shared is not None:
+            try:
+                self.shared.unregister(pid)
+                return
+            except sqlite3.Error, e:
+                self._sharedFailed(e)
         processes = []
         try:
             f = open(self.ctrlfilename, 'r')
@@ -240,7 +586,7 @@ class Throttle(object):
 
         self.lock.acquire()
         try:
-            wait = self.waittime(write=write or self.write)
+            wait = self._reserve(write=write or self.write)
             # Calculate the multiplicity of the next delay based on how
             # big the request is that is being posted now.
             # We want to add "one delay" for each factor of two in the
@@ -264,10 +610,28 @@ class Throttle(object):
         finally:
             self.lock.release()
 
-    def lag(self, lagtime):
+    def _reserve(self, write=False):
+        """Return the time to wait before the next request may be made.
+
+        With a shared state, the request is booked, so other processes
+        wait for it.
+
+        """
+        if self.shared is not None:
+            try:
+                start = self.shared.reserve(self._site(),
+                                            self.getDelay(write=write), write)
+            except sqlite3.Error, e:
+                self._sharedFailed(e)
+            else:
+                return max(0.0, start - time.time())
+        return self.waittime(write=write)
+
+    def lag(self, lagtime, retryafter=None):
         """Seize the throttle lock due to server lag.
 
-        This will prevent any thread from accessing this site.
+        This will prevent any thread from accessing this site. retryafter
+        is the delay requested by the server, if any.
 
         """
         started = time.time()
@@ -276,8 +640,18 @@ class Throttle(object):
             # start at 1/2 the current server lag time
             # wait at least 5 seconds but not more than 120 seconds
             delay = min(max(5, lagtime//2), 120)
+            if retryafter is not None:
+                delay = retryafter
+            if self.policy is not None:
+                self.policy.failure(self._site())
             # account for any time we waited while acquiring the lock
             wait = delay - (time.time() - started)
+            if self.shared is not None:
+                # let the other processes wait for the server as well
+                try:
+                    self.shared.postpone(self._site(), time.time() + wait)
+                except sqlite3.Error, e:
+                    self._sharedFailed(e)
             if wait > 0:
                 if wait > config.noisysleep:
                     pywikibot.output(
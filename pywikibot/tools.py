@@ -96,6 +96,58 @@ class ThreadedGenerator(threading.Thread):
         self.stop()
 
 
+class LRUCache(object):
+    """Cache keeping about the 'size' least recently used items.
+
+    The items are kept in two generations of at most size/2 items. New
+    items are added to the current generation; when it is full, it replaces
+    the old generation, whose items are dropped. Items found in the old
+    generation are moved back to the current one. So every access only
+    costs a few dict operations.
+
+    >>> cache = LRUCache(4)
+    >>> cache['a'] = 1
+    >>> cache.get('a')
+    1
+    >>> cache.get('b') is None
+    True
+
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._half = max(1, size // 2)
+        self._current = {}
+        self._old = {}
+
+    def get(self, key, default=None):
+        """Return the item for key or default if it is not cached."""
+        try:
+            return self._current[key]
+        except KeyError:
+            pass
+        try:
+            value = self._old.pop(key)
+        except KeyError:
+            return default
+        self[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        if len(self._current) >= self._half:
+            self._old = self._current
+            self._current = {}
+        self._current[key] = value
+
+    def __len__(self):
+        return len(self._current) + len(self._old)
+
+    def clear(self):
+        """Remove all items."""
+        self._current = {}
+        self._old = {}
+
+
 def itergroup(iterable, size):
     """Make an iterator that returns lists of (up to) size items from iterable.
 
@@ -124,6 +176,62 @@ def itergroup(iterable, size):
         yield group
 
 
+# Longest time a thread blocks at once in the wait helpers below. Waiting
+# without a timeout, the main thread wouldn't receive KeyboardInterrupt.
+WAIT_INTERVAL = 0.25
+
+
+def waitFor(predicate, wait, timeout=None):
+    """Call wait until predicate() returns a true value and return it.
+
+    wait is called with the seconds to wait at most, e.g. the wait method of
+    an Event or of a Condition which is acquired. After timeout seconds the
+    last (false) result of predicate() is returned.
+
+    >>> event = threading.Event()
+    >>> waitFor(event.isSet, event.wait, timeout=0.1)
+    False
+
+    """
+    if timeout is not None:
+        deadline = time.time() + timeout
+    while True:
+        result = predicate()
+        if result:
+            return result
+        interval = WAIT_INTERVAL
+        if timeout is not None:
+            left = deadline - time.time()
+            if left <= 0:
+                return result
+            interval = min(interval, left)
+        wait(interval)
+
+
+def queueGet(queue):
+    """Remove and return an item from queue, waiting until there is one."""
+    while True:
+        try:
+            return queue.get(True, WAIT_INTERVAL)
+        except Queue.Empty:
+            pass
+
+
+def queuePut(queue, item, stop=None):
+    """Put item into queue, waiting until there is room.
+
+    Return False if the stop Event is set before.
+
+    """
+    while stop is None or not stop.isSet():
+        try:
+            queue.put(item, True, WAIT_INTERVAL)
+            return True
+        except Queue.Full:
+            pass
+    return False
+
+
 class ThreadList(list):
     """A simple threadpool class to limit the number of simultaneous threads.
 
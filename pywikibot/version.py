@@ -77,7 +77,7 @@ def getversiondict():
         if os.path.isdir(os.path.join(_program_dir, '.svn')):
             (tag, rev, date, hsh) = getversion_svn(_program_dir)
         else:
-            (tag, rev, date, hsh) = getversion_git(_program_dir)
+            (tag, rev, date, hsh) = getversion_git_cached(_program_dir)
     except ParseError:
         try:
             (tag, rev, date, hsh) = getversion_nightly()
@@ -256,6 +256,70 @@ def getversion_git(path=None):
     return (tag, rev, date, hsh)
 
 
+def _git_state(path):
+    """Return a string which changes whenever the checked out commit does."""
+    gitdir = os.path.join(path, '.git')
+    files = ['HEAD', 'packed-refs', 'config']
+    try:
+        head = open(os.path.join(gitdir, 'HEAD')).read().strip()
+    except IOError:
+        raise ParseError
+    if head.startswith('ref: '):
+        files.append(head[5:])
+    state = [head]
+    for name in files:
+        try:
+            st = os.stat(os.path.join(gitdir, name))
+        except OSError:
+            continue
+        state.append('%s %r %s' % (name, st.st_mtime, st.st_size))
+    return '\n'.join(state)
+
+
+def getversion_git_cached(path=None):
+    """Get version info for a Git clone, using the result of the last run.
+
+    Calling git costs some time at every start of a bot, so the result of
+    getversion_git() is kept in the data directory until another commit is
+    checked out.
+
+    @param path: directory of the Git checkout
+    """
+    import config
+    try:
+        import json
+    except ImportError:
+        import simplejson as json
+    _program_dir = path or _get_program_dir()
+    state = _git_state(_program_dir)
+    filename = config.datafilepath('cache', 'gitversion')
+    try:
+        f = open(filename)
+        try:
+            data = json.load(f)
+        finally:
+            f.close()
+        if data['program_dir'] == _program_dir and data['state'] == state:
+            return (data['tag'].encode('utf-8'), data['rev'].encode('utf-8'),
+                    time.strptime(data['date'], '%Y-%m-%dT%H:%M:%S'),
+                    data['hsh'].encode('utf-8'))
+    except (IOError, ValueError, KeyError, TypeError, AttributeError):
+        # no result of an earlier run, or a broken one
+        pass
+    (tag, rev, date, hsh) = getversion_git(_program_dir)
+    try:
+        f = open(filename, 'w')
+        try:
+            json.dump({'program_dir': _program_dir, 'state': state,
+                       'tag': tag, 'rev': rev, 'hsh': hsh,
+                       'date': time.strftime('%Y-%m-%dT%H:%M:%S', date)}, f)
+        finally:
+            f.close()
+    except IOError:
+        pass
+    return (tag, rev, date, hsh)
+
+
 def getversion_nightly():
     """Get version info for a nightly release.
 
@@ -26,10 +26,15 @@ This module allow you to use the API in a simple and easy way.
 __version__ = '$Id$'
 #
 
-import time
+import sys
+import threading
+import Queue
+
 import wikipedia as pywikibot
 import config
+from pywikibot import apicache
 from pywikibot.support import deprecate_arg
+from pywikibot.tools import queueGet, queuePut
 try:
     import json
 except ImportError:
@@ -38,8 +43,12 @@ except ImportError:
 
 @deprecate_arg("encodeTitle", None)
 def GetData(params, site=None, useAPI=True, retryCount=config.maxretries,
-            encodeTitle=True, sysop=False, back_response=False):
+            encodeTitle=True, sysop=False, back_response=False, cache=True):
     """Get data from the query api, and convert it into a data object
+
+    Read-only queries are answered from the API response cache if
+    config.api_cache is enabled; set cache to False to bypass it.
+
     """
     if ('action' in params) and pywikibot.simulate and \
        (params['action'] in pywikibot.config.actions_to_block):
@@ -129,12 +138,19 @@ def GetData(params, site=None, useAPI=True, retryCount=config.maxretries,
         else:
             pywikibot.output(u"Requesting API query from %s" % site)
 
+    cached = None
+    if cache and not back_response and useAPI and config.api_cache:
+        cached = _cacheLookup(site, sysop, params, data)
+        if cached is not None and cached[0] is not None:
+            return json.loads(cached[0])
+
     lastError = None
-    retry_idle_time = 1
+    retry_attempt = 0
 
     while retryCount >= 0:
         try:
             jsontext = "Nothing received"
+            res = None
             if params['action'] == 'upload' and ('file' in data):
                 import upload
                 res, jsontext = upload.post_multipart(
@@ -157,6 +173,7 @@ def GetData(params, site=None, useAPI=True, retryCount=config.maxretries,
             # converted from \u notation
 ##            decodedObj = eval(jsontext)
 
+            rawtext = jsontext
             jsontext = json.loads(jsontext)
 
             if "error" in jsontext:
@@ -167,7 +184,24 @@ def GetData(params, site=None, useAPI=True, retryCount=config.maxretries,
                     params['token'] = site.getToken(sysop=sysop,
                                                     getagain=True)
                     continue
+                elif errorDetails["code"] == 'maxlag' and retryCount > 0:
+                    # wait as long as the server asks for, or for the lag
+                    retryCount -= 1
+                    retry_attempt += 1
+                    retryafter = None
+                    if hasattr(res, 'info'):
+                        retryafter = pywikibot.parseRetryAfter(
+                            res.info().get('Retry-After'))
+                    if retryafter is None:
+                        retryafter = pywikibot.parseLag(
+                            errorDetails.get('info', u''))
+                    pywikibot.retry_policy.wait(
+                        site, retry_attempt,
+                        u'Database server of %s lagged.' % site, retryafter)
+                    continue
 
+            if cached is not None and "error" not in jsontext:
+                cached[1].put(cached[2], rawtext, cached[3])
             if back_response:
                 return res, jsontext
             else:
@@ -185,12 +219,9 @@ def GetData(params, site=None, useAPI=True, retryCount=config.maxretries,
             pywikibot.output(u"Request %s:%s" % (site.lang, path))
             lastError = error
             if retryCount >= 0:
-                pywikibot.output(u"Retrying in %i minutes..." % retry_idle_time)
-                time.sleep(retry_idle_time * 60)
-                # Next time wait longer, but not longer than half an hour
-                retry_idle_time *= 2
-                if retry_idle_time > 30:
-                    retry_idle_time = 30
+                retry_attempt += 1
+                pywikibot.retry_policy.wait(site, retry_attempt,
+                                            u'Invalid API response.')
             else:
                 pywikibot.debugDump('ApiGetDataParse', site,
                                     str(error) + '\n%s\n%s' % (site.hostname(),
@@ -199,6 +230,203 @@ def GetData(params, site=None, useAPI=True, retryCount=config.maxretries,
     raise lastError
 
 
+_cache = None
+
+
+def getCache():
+    """Return the API response cache, or None if it is not available."""
+    global _cache
+    if _cache is None:
+        if apicache.sqlite3 is None:
+            _cache = False
+        else:
+            _cache = apicache.APICache(
+                config.datafilepath('pywikibot', 'apicache.db'))
+    return _cache or None
+
+
+def _cacheLookup(site, sysop, params, data):
+    """Look up a query in the API response cache.
+
+    Return None if the query is not cached at all, otherwise a tuple
+    (text, cache, key, validator) where text is the cached response or None.
+
+    """
+    allparams = dict(params)
+    allparams.update(data)
+    how = apicache.policy(allparams)
+    if how is None:
+        return None
+    cache = getCache()
+    if cache is None:
+        return None
+    ttl, validate = how
+    validator = None
+    if validate:
+        info = GetData({'action': 'query', 'prop': 'info',
+                        validate[0]: validate[1]},
+                       site, sysop=sysop, cache=False)
+        validator = apicache.validator(info)
+    key = cache.key(site, site.username(sysop), allparams)
+    return cache.get(key, ttl, validator), cache, key, validator
+
+
+def checkResult(data):
+    """Raise RuntimeError if data is an API error, and print its warnings."""
+    if 'error' in data:
+        raise RuntimeError("API query error: %s" % data['error'])
+    for mod, warning in data.get('warnings', {}).items():
+        if mod == 'info':
+            continue
+        if '*' in warning:
+            text = warning['*']
+        elif 'html' in warning:
+            # Bugzilla 49978
+            text = warning['html']['*']
+        else:
+            pywikibot.warning(u'API warning (%s) of unknown format: %s'
+                              % (mod, warning))
+            continue
+        # multiple warnings are in text separated by a newline
+        for single_warning in text.splitlines():
+            pywikibot.warning(u"API warning (%s): %s"
+                              % (mod, single_warning))
+
+
+# the largest limits the wikis allowed, by (site, module, sysop)
+_maxLimits = {}
+
+
+class ListIterator(object):
+    """Iterate over the results of an API list query.
+
+    The query is continued until all results, or total results, have been
+    retrieved. Both the old query-continue and the new continue style are
+    supported; add 'continue': '' to params for the latter. While the
+    results of one request are consumed, the next request is already made
+    in the background unless prefetch is False.
+
+    module is the name of the list and prefix the prefix of its parameters,
+    e.g. 'allpages' and 'ap'. The limit is chosen by the iterator: the
+    largest one the wiki allows is asked for once and then remembered.
+
+    The results are yielded as the dicts returned by the API, or as Page
+    objects if pages is True.
+
+    check is called with every response and may raise an exception; it
+    defaults to checkResult. If throttle is True, get_throttle is waited
+    for before every request.
+
+    """
+
+    def __init__(self, site, module, prefix, params=None, total=None,
+                 pages=False, prefetch=True, throttle=False, check=None,
+                 sysop=False):
+        self.site = site
+        self.module = module
+        self.prefix = prefix
+        self.params = dict(params or {})
+        self.params['action'] = 'query'
+        self.params['list'] = module
+        self.total = total
+        self.pages = pages
+        self.prefetch = prefetch
+        self.throttle = throttle
+        self.check = check or checkResult
+        self.sysop = sysop
+
+    def limit(self, fetched=0):
+        """Return the limit for the next request, after fetched results."""
+        key = repr(self.site), self.module, self.sysop
+        limit = _maxLimits.get(key)
+        if limit is None:
+            # 'max' does not work with wikia 1.15.5
+            if self.site.versionnumber() >= 16:
+                limit = 'max'
+            elif not self.site.isAllowed('apihighlimits', self.sysop) and \
+                    pywikibot.config.special_page_limit > 500:
+                limit = 500
+            else:
+                limit = pywikibot.config.special_page_limit
+        if self.total is not None:
+            remaining = self.total - fetched
+            # every list allows at least 50 results per request
+            if limit == 'max' and remaining <= 50 or \
+               limit != 'max' and remaining < limit:
+                limit = remaining
+        return limit
+
+    def chunks(self):
+        """Yield the results of every request as a list."""
+        params = dict(self.params)
+        fetched = 0
+        while self.total is None or fetched < self.total:
+            params[self.prefix + 'limit'] = self.limit(fetched)
+            if self.throttle:
+                pywikibot.get_throttle()
+            data = GetData(dict(params), self.site, sysop=self.sysop)
+            self.check(data)
+            if self.module in data.get('limits', {}):
+                _maxLimits[repr(self.site), self.module, self.sysop] = \
+                    int(data['limits'][self.module])
+            results = data.get('query', {}).get(self.module, [])
+            fetched += len(results)
+            yield results
+            if 'continue' in data:
+                params.update(data['continue'])
+            elif 'query-continue' in data:
+                for values in data['query-continue'].itervalues():
+                    params.update(values)
+            else:
+                break
+
+    def _prefetched(self, chunks):
+        """Yield the items of chunks, retrieving each in advance by a
+        thread."""
+        results = Queue.Queue(1)
+        stop = threading.Event()
+
+        def run():
+            try:
+                for chunk in chunks:
+                    if not queuePut(results, (chunk, None), stop):
+                        return
+            except Exception:
+                queuePut(results, (None, sys.exc_info()), stop)
+            else:
+                queuePut(results, (None, None), stop)
+
+        thread = threading.Thread(target=run)
+        thread.setDaemon(True)
+        thread.start()
+        try:
+            while True:
+                chunk, error = queueGet(results)
+                if error is not None:
+                    raise error[0], error[1], error[2]
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            stop.set()
+
+    def __iter__(self):
+        chunks = self.chunks()
+        if self.prefetch:
+            chunks = self._prefetched(chunks)
+        count = 0
+        for chunk in chunks:
+            if self.total is not None:
+                chunk = chunk[:self.total - count]
+            count += len(chunk)
+            if self.pages:
+                chunk = pywikibot.normalizedPages(self.site, chunk)
+            for item in chunk:
+                yield item
+            if self.total is not None and count >= self.total:
+                return
+
+
 def GetInterwikies(site, titles, extraParams=None):
     """ Usage example: data = GetInterwikies('ru','user:yurik')
     titles may be either ane title (as a string), or a list of strings
@@ -47,6 +47,11 @@ and arguments can be:
 -total:n       With -fullscan, the maximum count of redirects to work upon.
                Otherwise ignored. Use 0 for unlimited
 
+-graph         Keep the redirects found with -xml or -fullscan in a file, and
+               only load the pages changed since then in the next run.
+               Argument can also be given as "-graph:filename". Implies
+               -fullscan unless -xml is given.
+
 -always        Don't prompt you for each replacement.
 
 """
@@ -61,23 +66,31 @@ and arguments can be:
 __version__ = '$Id$'
 #
 
+import os
 import re
 import datetime
 import wikipedia as pywikibot
 from pywikibot import i18n
+from pywikibot import redirectgraph
 import config
 import query
 import xmlreader
 
 SPECIALPAGE_REGEX = '\<li\>\<a href=".+?" title=".*?">(.+?)</a>'
 
+# days the recent changes of a wiki go back at least; older redirect graphs
+# are built again
+RC_MAX_AGE = 30
+
 
 class RedirectGenerator:
     def __init__(self, xmlFilename=None, namespaces=[], offset=-1,
                  use_move_log=False, use_api=False, start=None, until=None,
-                 number=None):
+                 number=None, graphFilename=None):
         self.site = pywikibot.getSite()
         self.xmlFilename = xmlFilename
+        self.graphFilename = graphFilename
+        self.graph = None
         self.namespaces = namespaces
         if use_api and not self.namespaces:
             self.namespaces = [0]
@@ -94,71 +107,90 @@ class RedirectGenerator:
             else:
                 self.api_number = 'max'
 
-    def get_redirects_from_dump(self, alsoGetPageTitles=False):
+    def _normalize(self, title):
+        """Return title the way it is stored in the redirect graph."""
+        title = title.replace('_', ' ').strip()
+        # capitalize the first letter
+        if not self.site.nocapitalize:
+            title = title[:1].upper() + title[1:]
+        return title
+
+    def _dump_target(self, title, target):
+        """Return the normalized target of a redirect found in the dump, or
+        None if it leads to another wiki."""
+        # There might be redirects to another wiki. Ignore these.
+        for code in self.site.family.iwkeys:
+            if target.startswith('%s:' % code) \
+                    or target.startswith(':%s:' % code):
+                if code == self.site.language():
+                    # link to our wiki, but with the lang prefix
+                    target = target[(len(code) + 1):]
+                    if target.startswith(':'):
+                        target = target[1:]
+                else:
+                    pywikibot.output(
+                        u'NOTE: Ignoring %s which is a redirect to %s:'
+                        % (title, code))
+                    return None
+        if '#' in target:
+            target = target[:target.index('#')]
+        if '|' in target:
+            pywikibot.output(u'HINT: %s is a redirect with a pipelink.'
+                             % title)
+            target = target[:target.index('|')]
+        # in case preceding steps left nothing
+        return self._normalize(target) or None
+
+    def get_redirect_graph_from_dump(self):
         '''
-        Load a local XML dump file, look at all pages which have the
-        redirect flag set, and find out where they're pointing at. Return
-        a dictionary where the redirect names are the keys and the redirect
-        targets are the values.
+        Load a local XML dump file and return a RedirectGraph of all its
+        pages. Only the targets of the redirects in the namespaces to be
+        processed are recorded, but all pages are included, so redirects to
+        other namespaces are not taken for broken ones.
         '''
-        xmlFilename = self.xmlFilename
-        redict = {}
+        graph = redirectgraph.RedirectGraph(repr(self.site))
         # open xml dump and read page titles out of it
-        dump = xmlreader.XmlDump(xmlFilename)
+        dump = xmlreader.XmlDump(self.xmlFilename)
         redirR = self.site.redirectRegex()
         readPagesCount = 0
-        if alsoGetPageTitles:
-            pageTitles = set()
+        timestamp = u''
         for entry in dump.parse():
             readPagesCount += 1
             # always print status message after 10000 pages
             if readPagesCount % 10000 == 0:
                 pywikibot.output(u'%i pages read...' % readPagesCount)
-            if len(self.namespaces) > 0:
-                if pywikibot.Page(self.site, entry.title).namespace() \
-                        not in self.namespaces:
-                    continue
-            if alsoGetPageTitles:
-                pageTitles.add(entry.title.replace(' ', '_'))
-
+            timestamp = max(timestamp, entry.timestamp)
+            source = self._normalize(entry.title)
             m = redirR.match(entry.text)
-            if m:
-                target = m.group(1)
-                # There might be redirects to another wiki. Ignore these.
-                for code in self.site.family.iwkeys:
-                    if target.startswith('%s:' % code) \
-                            or target.startswith(':%s:' % code):
-                        if code == self.site.language():
-                            # link to our wiki, but with the lang prefix
-                            target = target[(len(code) + 1):]
-                            if target.startswith(':'):
-                                target = target[1:]
-                        else:
-                            pywikibot.output(
-                                u'NOTE: Ignoring %s which is a redirect to %s:'
-                                % (entry.title, code))
-                            target = None
-                            break
-                # if the redirect does not link to another wiki
+            if not m:
+                graph.addPage(source)
+            elif self.namespaces and pywikibot.Page(
+                    self.site, entry.title).namespace() not in self.namespaces:
+                graph.addRedirect(source)
+            else:
+                target = self._dump_target(entry.title, m.group(1))
                 if target:
-                    source = entry.title.replace(' ', '_')
-                    target = target.replace(' ', '_')
-                    # remove leading and trailing whitespace
-                    target = target.strip('_')
-                    # capitalize the first letter
-                    if not pywikibot.getSite().nocapitalize:
-                        source = source[:1].upper() + source[1:]
-                        target = target[:1].upper() + target[1:]
-                    if '#' in target:
-                        target = target[:target.index('#')].rstrip("_")
-                    if '|' in target:
-                        pywikibot.output(
-                            u'HINT: %s is a redirect with a pipelink.'
-                            % entry.title)
-                        target = target[:target.index('|')].rstrip("_")
-                    if target:  # in case preceding steps left nothing
-                        redict[source] = target
+                    graph.addRedirect(source, target)
+                else:
+                    graph.addPage(source)
+        graph.timestamp = timestamp or None
+        return graph
+
+    def get_redirects_from_dump(self, alsoGetPageTitles=False):
+        '''
+        Load a local XML dump file, look at all pages which have the
+        redirect flag set, and find out where they're pointing at. Return
+        a dictionary where the redirect names are the keys and the redirect
+        targets are the values.
+        '''
+        graph = self.get_redirect_graph_from_dump()
+        redict = dict((source.replace(' ', '_'), target.replace(' ', '_'))
+                      for source, target in graph.redirects()
+                      if target is not None)
         if alsoGetPageTitles:
+            pageTitles = set(title.replace(' ', '_')
+                             for i, title in enumerate(graph.titles)
+                             if graph.exists[i])
             return redict, pageTitles
         else:
             return redict
@@ -169,33 +201,18 @@ class RedirectGenerator:
 
         """
         params = {
-            'action': 'query',
-            'list': 'allpages',
             'apfilterredir': 'redirects',
-            'aplimit': self.api_number,
             'apdir': 'ascending',
         }
         for ns in self.namespaces:
             params['apnamespace'] = ns
             if self.api_start:
                 params['apfrom'] = self.api_start
-            done = False
-            while not done:
-                pywikibot.output(u'\nRetrieving pages...', newline=False)
-                data = query.GetData(params, self.site)
-                if 'error' in data:
-                    raise RuntimeError("API query error: %s" % data['error'])
-                if "limits" in data:  # process aplimit = max
-                    params['aplimit'] = int(data['limits']['allpages'])
-                for x in data['query']['allpages']:
-                    done = self.api_until and x['title'] >= self.api_until
-                    if done:
-                        return
-                    yield x['pageid']
-                if not done and 'query-continue' in data:
-                    params.update(data['query-continue']['allpages'])
-                else:
-                    break
+            pywikibot.output(u'\nRetrieving pages...', newline=False)
+            for x in query.ListIterator(self.site, 'allpages', 'ap', params):
+                if self.api_until and x['title'] >= self.api_until:
+                    return
+                yield x['pageid']
 
     def _next_redirect_group(self):
         """
@@ -211,6 +228,122 @@ class RedirectGenerator:
         if apiQ:
             yield apiQ
 
+    def _load_into_graph(self, graph, params):
+        """Query the pages given by params and record them in graph.
+
+        Return the titles of the redirects found.
+
+        """
+        params = dict(params, action='query', redirects=1, prop='info')
+        data = query.GetData(params, self.site)
+        if 'error' in data:
+            raise RuntimeError("API query error: %s" % data)
+        if data == [] or 'query' not in data:
+            raise RuntimeError("No results given.")
+        pages = data['query'].get('pages', {}).values()
+        invalid = set(page['title'] for page in pages if 'invalid' in page)
+        sources = []
+        for redirect in data['query'].get('redirects', []):
+            if 'tointerwiki' in redirect or redirect['to'] in invalid:
+                # the target is not a page of this wiki; record it as
+                # unknown, so the redirect is not taken as broken
+                graph.removePage(redirect['from'])
+                graph.addRedirect(redirect['from'])
+            else:
+                graph.addRedirect(redirect['from'], redirect['to'])
+            sources.append(redirect['from'])
+        # the targets of the redirects, and the pages which aren't redirects
+        for page in pages:
+            title = page['title']
+            if title in sources or 'invalid' in page:
+                continue
+            if 'missing' in page:
+                graph.removePage(title)
+            elif 'redirect' in page:
+                graph.addRedirect(title)
+            else:
+                graph.addPage(title)
+        return sources
+
+    def _now(self):
+        return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def get_redirect_graph_via_api(self):
+        """Return a RedirectGraph of the redirects in the namespaces to be
+        processed, loaded from the API."""
+        graph = redirectgraph.RedirectGraph(repr(self.site), self._now())
+        for apiQ in self._next_redirect_group():
+            pywikibot.output(u'.', newline=False)
+            self._load_into_graph(graph, {'pageids': apiQ})
+        return graph
+
+    def update_redirect_graph(self, graph):
+        """Apply the changes made since graph.timestamp to graph.
+
+        Return False if the recent changes don't go back that far.
+
+        """
+        if not graph.timestamp or not self.site.has_api():
+            return False
+        then = datetime.datetime.strptime(graph.timestamp,
+                                          '%Y-%m-%dT%H:%M:%SZ')
+        if datetime.datetime.utcnow() - then > datetime.timedelta(
+                days=RC_MAX_AGE):
+            return False
+        now = self._now()
+        params = {
+            'rcdir': 'newer',
+            'rcstart': graph.timestamp,
+            'rctype': 'edit|new|log',
+            'rcprop': 'title|loginfo',
+        }
+        if self.namespaces:
+            params['rcnamespace'] = self.namespaces
+        titles = set()
+        pywikibot.output(u'Retrieving changes since %s...' % graph.timestamp)
+        for change in query.ListIterator(self.site, 'recentchanges', 'rc',
+                                         params):
+            titles.add(change['title'])
+            # moved pages leave a redirect at the old title
+            if 'move' in change:
+                titles.add(change['move']['new_title'])
+            elif 'target_title' in change.get('logparams', {}):
+                titles.add(change['logparams']['target_title'])
+        titles = sorted(titles)
+        pywikibot.output(u'Updating %i changed pages...' % len(titles))
+        for i in range(0, len(titles), 50):
+            self._load_into_graph(graph, {'titles': titles[i:i + 50]})
+        graph.timestamp = now
+        return True
+
+    def get_redirect_graph(self):
+        """Return the RedirectGraph to work on.
+
+        If a graph file is used and was saved by an earlier run, the graph
+        is updated with the changes since then. Otherwise it is built from
+        the XML dump or the API, and saved in the graph file.
+
+        """
+        if self.graph is not None:
+            return self.graph
+        graph = None
+        if self.graphFilename and os.path.exists(self.graphFilename):
+            graph = redirectgraph.RedirectGraph.load(self.graphFilename)
+            if (graph.site != repr(self.site)
+                    or not self.update_redirect_graph(graph)):
+                pywikibot.output(u'The saved redirect graph is outdated, '
+                                 u'rebuilding it.')
+                graph = None
+        if graph is None:
+            if self.xmlFilename:
+                graph = self.get_redirect_graph_from_dump()
+            else:
+                graph = self.get_redirect_graph_via_api()
+        if self.graphFilename:
+            graph.save(self.graphFilename)
+        self.graph = graph
+        return graph
+
     def get_redirects_via_api(self, maxlen=8):
         """
         Return a generator that yields tuples of data about redirect Pages:
@@ -220,60 +353,42 @@ class RedirectGenerator:
                          1 - normal redirect, target page exists and is not a
                              redirect
                  2..maxlen - start of a redirect chain of that many redirects
-                             (currently, the API seems not to return sufficient
-                             data to make these return values possible, but
-                             that may change)
                   maxlen+1 - start of an even longer chain, or a loop
-                             (currently, the API seems not to return sufficient
-                             data to allow this return values, but that may
-                             change)
-                      None - start of a redirect chain of unknown length, or
-                             loop
             2 - target page title of the redirect, or chain (may not exist)
-            3 - target page of the redirect, or end of chain, or page title
-                where chain or loop detecton was halted, or None if unknown
+            3 - target page of the redirect, or end of chain, or None for
+                loops and chains leading to pages not loaded
+
+        With a graph file, the whole redirect graph is loaded first.
+        Otherwise the redirects are retrieved and yielded 500 at a time.
         """
-        params = {
-            'action': 'query',
-            'redirects': 1,
-            # '': '',
-        }
+        if self.graphFilename or self.graph is not None:
+            graph = self.get_redirect_graph()
+            redirects = (redirect for redirect, target in graph.redirects())
+            for result in self._redirect_info(graph, redirects, maxlen):
+                yield result
+            return
+        graph = redirectgraph.RedirectGraph(repr(self.site), self._now())
+        done = set()
         for apiQ in self._next_redirect_group():
-            params['pageids'] = apiQ
             pywikibot.output(u'.', newline=False)
-            data = query.GetData(params, self.site)
-            if 'error' in data:
-                raise RuntimeError("API query error: %s" % data)
-            if data == [] or 'query' not in data:
-                raise RuntimeError("No results given.")
-            redirects = {}
-            pages = {}
-            redirects = dict((x['from'], x['to'])
-                             for x in data['query']['redirects'])
-
-            for pagetitle in data['query']['pages'].values():
-                if 'missing' in pagetitle and 'pageid' not in pagetitle:
-                    pages[pagetitle['title']] = False
-                else:
-                    pages[pagetitle['title']] = True
-            for redirect in redirects:
-                target = redirects[redirect]
-                result = 0
-                final = None
-                try:
-                    if pages[target]:
-                        final = target
-                        try:
-                            while result <= maxlen:
-                                result += 1
-                                final = redirects[final]
-                            # result = None
-                        except KeyError:
-                            pass
-                except KeyError:
-                    result = None
-                    pass
-                yield (redirect, result, target, final)
+            redirects = [redirect for redirect in
+                         self._load_into_graph(graph, {'pageids': apiQ})
+                         if redirect not in done]
+            done.update(redirects)
+            for result in self._redirect_info(graph, redirects, maxlen):
+                yield result
+
+    def _redirect_info(self, graph, redirects, maxlen):
+        """Yield the tuples of get_redirects_via_api() for redirects."""
+        for redirect in redirects:
+            target = graph.target(redirect)
+            if target is None:
+                # a target of a redirect which was not loaded itself
+                continue
+            length, final = graph.follow(redirect, maxlen)
+            if graph.isBroken(redirect):
+                length = 0
+            yield (redirect, length, target, final)
 
     def retrieve_broken_redirects(self):
         if self.use_api:
@@ -307,11 +422,8 @@ class RedirectGenerator:
             # retrieve information from XML dump
             pywikibot.output(
                 u'Getting a list of all redirects and of all page titles...')
-            redirs, pageTitles = self.get_redirects_from_dump(
-                alsoGetPageTitles=True)
-            for (key, value) in redirs.iteritems():
-                if value not in pageTitles:
-                    yield key
+            for redirect in self.get_redirect_graph().brokenRedirects():
+                yield redirect
 
     def retrieve_double_redirects(self):
         if self.use_move_log:
@@ -332,16 +444,12 @@ class RedirectGenerator:
                         if count >= self.api_number:
                             break
         elif self.xmlFilename:
-            redict = self.get_redirects_from_dump()
-            num = 0
-            for (key, value) in redict.iteritems():
-                num += 1
-                # check if the value - that is, the redirect target - is a
-                # redirect as well
-                if num > self.offset and value in redict:
-                    yield key
+            doubles = list(self.get_redirect_graph().doubleRedirects())
+            for num, redirect in enumerate(doubles):
+                if num > self.offset:
+                    yield redirect
                     pywikibot.output(u'\nChecking redirect %i of %i...'
-                                     % (num + 1, len(redict)))
+                                     % (num + 1, len(doubles)))
         else:
             # retrieve information from the live wiki's maintenance page
             # double redirect maintenance page's URL
@@ -744,6 +852,7 @@ def main(*args):
     until = ''
     number = None
     always = False
+    graphFilename = None
     for arg in pywikibot.handleArgs(*args):
         if arg == 'double' or arg == 'do':
             action = 'double'
@@ -790,9 +899,18 @@ def main(*args):
             number = int(arg[7:])
         elif arg == '-always':
             always = True
+        elif arg.startswith('-graph'):
+            if len(arg) == 6:
+                site = pywikibot.getSite()
+                graphFilename = config.datafilepath(
+                    'redirects-%s-%s.graph' % (site.family.name, site.lang))
+            else:
+                graphFilename = arg[7:]
         else:
             pywikibot.output(u'Unknown argument: %s' % arg)
 
+    if graphFilename and not xmlFilename:
+        fullscan = True
     if (
         not action or
         xmlFilename and moved_pages or
@@ -801,7 +919,7 @@ def main(*args):
         pywikibot.showHelp()
     else:
         gen = RedirectGenerator(xmlFilename, namespaces, offset, moved_pages,
-                                fullscan, start, until, number)
+                                fullscan, start, until, number, graphFilename)
         bot = RedirectRobot(action, gen, always, number)
         bot.run()
 
@@ -30,7 +30,13 @@ Furthermore, the following command line parameters are supported:
 
 -xmlstart         (Only works with -xml) Skip all articles in the XML dump
                   before the one specified (may also be given as
-                  -xmlstart:Article).
+                  -xmlstart:Article). For multistream dumps whose index
+                  file lies next to the dump, the skipped part of the dump
+                  is not read at all.
+
+-xmlprocesses:n   (Only works with -xml) Scan the XML dump with n processes
+                  in parallel. Use -xmlprocesses without a number to use one
+                  process per CPU.
 
 -save             Saves the titles of the articles to a file instead of
                   modifying the articles. This way you may collect titles to
@@ -188,6 +194,27 @@ docuReplacements = {
 }
 
 
+# generator used by _checkXmlEntry() for the current chunk of the dump
+_xmlChecker = (None, None, None)
+
+
+def _checkXmlEntry(entry, code, fam, replacements, exceptions):
+    """Return the title of entry and whether it needs a replacement.
+
+    Used by the worker processes of XmlDumpReplacePageGenerator.
+
+    """
+    global _xmlChecker
+    # the arguments are the same objects for all pages of a chunk
+    if _xmlChecker[0] is not replacements \
+            or _xmlChecker[1] is not exceptions:
+        gen = XmlDumpReplacePageGenerator(None, None, replacements,
+                                          exceptions,
+                                          site=pywikibot.getSite(code, fam))
+        _xmlChecker = (replacements, exceptions, gen)
+    return entry.title, _xmlChecker[2].needsReplacement(entry)
+
+
 class XmlDumpReplacePageGenerator:
     """
     Iterator that will yield Pages that might contain text to replace.
@@ -202,14 +229,18 @@ class XmlDumpReplacePageGenerator:
         * exceptions   - A dictionary which defines when to ignore an
                          occurence. See docu of the ReplaceRobot
                          constructor below.
+        * processes    - Number of processes scanning the dump in parallel
+                         (None means one per CPU).
 
     """
-    def __init__(self, xmlFilename, xmlStart, replacements, exceptions):
+    def __init__(self, xmlFilename, xmlStart, replacements, exceptions,
+                 processes=1, site=None):
         self.xmlFilename = xmlFilename
         self.replacements = replacements
         self.exceptions = exceptions
         self.xmlStart = xmlStart
         self.skipping = bool(xmlStart)
+        self.processes = processes
 
         self.excsInside = []
         if "inside-tags" in self.exceptions:
@@ -217,34 +248,72 @@ class XmlDumpReplacePageGenerator:
         if "inside" in self.exceptions:
             self.excsInside += self.exceptions['inside']
         import xmlreader
-        self.site = pywikibot.getSite()
-        dump = xmlreader.XmlDump(self.xmlFilename)
-        self.parser = dump.parse()
+        self.site = site or pywikibot.getSite()
+        self.replacer = pywikibot.MultipleReplacer(
+            self.replacements, self.excsInside, site=self.site)
+        if xmlFilename:
+            self.dump = xmlreader.XmlDump(self.xmlFilename)
+            self.parser = None
+            # parallel_parse() in __iter__ seeks to the start page itself
+            if processes == 1:
+                if xmlStart and self.dump.index is not None:
+                    # multistream dump: seek to the stream of the start page
+                    try:
+                        self.parser = self.dump.parse_from(xmlStart)
+                    except KeyError:
+                        pywikibot.output(u'%s not found in the dump index.'
+                                         % xmlStart)
+                if self.parser is None:
+                    self.parser = self.dump.parse()
 
     def __iter__(self):
+        if self.processes != 1:
+            results = self.dump.parallel_parse(
+                _checkXmlEntry,
+                args=(self.site.lang, self.site.family.name,
+                      self.replacements, self.exceptions),
+                processes=self.processes, start=self.xmlStart)
+        else:
+            results = None
         try:
+            if results is not None:
+                for title, changed in results:
+                    if self.skipping:
+                        if title != self.xmlStart:
+                            continue
+                        self.skipping = False
+                    if changed:
+                        yield pywikibot.Page(self.site, title)
+                return
             for entry in self.parser:
+                title = entry.title
                 if self.skipping:
                     if entry.title != self.xmlStart:
                         continue
                     self.skipping = False
-                if not self.isTitleExcepted(entry.title) \
-                        and not self.isTextExcepted(entry.text):
-                    new_text = entry.text
-                    for old, new in self.replacements:
-                        new_text = pywikibot.replaceExcept(
-                            new_text, old, new, self.excsInside, self.site)
-                    if new_text != entry.text:
-                        yield pywikibot.Page(self.site, entry.title)
+                if self.needsReplacement(entry):
+                    yield pywikibot.Page(self.site, entry.title)
         except KeyboardInterrupt:
             try:
                 if not self.skipping:
                     pywikibot.output(
                         u'To resume, use "-xmlstart:%s" on the command line.'
-                        % entry.title)
+                        % title)
             except NameError:
                 pass
 
+    def needsReplacement(self, entry):
+        """Return True if any replacement changes the text of entry."""
+        # most pages don't contain any text to replace
+        if not self.replacer.candidates(entry.text):
+            return False
+        if not self.isTitleExcepted(entry.title) \
+                and not self.isTextExcepted(entry.text):
+            new_text = self.replacer.replace(entry.text)
+            if new_text != entry.text:
+                return True
+        return False
+
     def isTitleExcepted(self, title):
         if "title" in self.exceptions:
             for exc in self.exceptions['title']:
@@ -341,6 +410,8 @@ class ReplaceRobot:
         self.editSummary = editSummary
         self.articles = articles
         self.exctitles = exctitles
+        # MultipleReplacer doing the replacements, created on first use
+        self.replacer = None
 
         # An edit counter to split the file by 100 titles if -save or -savenew
         # is on, and to display the number of edited articles otherwise.
@@ -384,9 +455,15 @@ class ReplaceRobot:
             exceptions += self.exceptions['inside-tags']
         if "inside" in self.exceptions:
             exceptions += self.exceptions['inside']
+        if self.sleep is None:
+            # apply all replacements together
+            if self.replacer is None:
+                self.replacer = pywikibot.MultipleReplacer(
+                    self.replacements, exceptions,
+                    allowoverlap=self.allowoverlap)
+            return self.replacer.replace(new_text)
         for old, new in self.replacements:
-            if self.sleep is not None:
-                time.sleep(self.sleep)
+            time.sleep(self.sleep)
             new_text = pywikibot.replaceExcept(new_text, old, new, exceptions,
                                                allowoverlap=self.allowoverlap)
         return new_text
@@ -608,6 +685,8 @@ def main(*args):
     # the dump's path, either absolute or relative, which will be used
     # if -xml flag is present
     xmlFilename = None
+    # number of processes scanning the dump; None means one per CPU
+    xmlProcesses = 1
     useSql = False
     PageTitles = []
     # will become True when the user presses a ('yes to all') or uses the
@@ -652,6 +731,11 @@ def main(*args):
     for arg in pywikibot.handleArgs(*args):
         if arg == '-regex':
             regex = True
+        elif arg.startswith('-xmlprocesses'):
+            if len(arg) == 13:
+                xmlProcesses = None
+            else:
+                xmlProcesses = int(arg[14:])
         elif arg.startswith('-xmlstart'):
             if len(arg) == 9:
                 xmlStart = pywikibot.input(
@@ -896,7 +980,8 @@ def main(*args):
         except NameError:
             xmlStart = None
         gen = XmlDumpReplacePageGenerator(xmlFilename, xmlStart,
-                                          replacements, exceptions)
+                                          replacements, exceptions,
+                                          processes=xmlProcesses)
     elif useSql:
         whereClause = 'WHERE (%s)' % ' OR '.join(
             ["old_text RLIKE '%s'" % prepareRegexForMySQL(old.pattern)
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for pywikibot/apicache.py"""
+__version__ = '$Id$'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import test_utils
+
+from pywikibot import apicache
+
+
+class APICacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'apicache.db')
+        self.cache = apicache.APICache(self.filename)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_key(self):
+        key = self.cache.key('wikipedia:de', u'Bot',
+                             {'action': 'query', 'titles': 'K\xc3\xb6ln',
+                              'format': 'json'})
+        self.assertEqual(key, self.cache.key(
+            'wikipedia:de', u'Bot',
+            {u'titles': u'K\xf6ln', u'action': u'query', 'maxlag': '5'}))
+        self.assertNotEqual(key, self.cache.key(
+            'wikipedia:de', None, {'action': 'query', 'titles': u'K\xf6ln'}))
+        self.assertNotEqual(key, self.cache.key(
+            'wikipedia:en', u'Bot', {'action': 'query', 'titles': u'K\xf6ln'}))
+
+    def test_get_put(self):
+        self.assertEqual(None, self.cache.get('a', 60))
+        self.cache.put('a', u'{"query": "\xe4"}', u'1')
+        self.assertEqual(u'{"query": "\xe4"}', self.cache.get('a', 60, u'1'))
+        self.assertEqual(None, self.cache.get('a', 60, u'2'))
+        self.assertEqual(None, self.cache.get('a', -1, u'1'))
+        self.assertEqual({'hits': 1, 'misses': 3, 'invalidated': 1,
+                          'hit_rate': 0.25}, self.cache.stats())
+        # the responses are kept for the next run
+        other = apicache.APICache(self.filename)
+        self.assertEqual(u'{"query": "\xe4"}', other.get('a', 60, u'1'))
+        self.cache.expire(-1)
+        self.assertEqual(None, other.get('a', 60, u'1'))
+        other.close()
+
+    def test_policy(self):
+        ttl = apicache.config.api_cache_ttl
+        self.assertEqual(None, apicache.policy({'action': 'edit'}))
+        self.assertEqual(None, apicache.policy(
+            {'action': 'query', 'meta': 'tokens'}))
+        self.assertEqual(None, apicache.policy(
+            {'action': 'query', 'prop': 'info', 'intoken': 'edit',
+             'titles': 'A'}))
+        self.assertEqual(None, apicache.policy(
+            {'action': 'query', 'prop': 'info', 'inprop': 'url|watchtoken',
+             'titles': 'A'}))
+        apicache.config.api_cache_ttl = dict(ttl, userinfo=3600)
+        try:
+            self.assertEqual(None, apicache.policy(
+                {'action': 'query', 'meta': 'userinfo',
+                 'uiprop': 'blockinfo|hasmsg'}))
+        finally:
+            apicache.config.api_cache_ttl = ttl
+        self.assertEqual(None, apicache.policy(
+            {'action': 'query', 'list': 'recentchanges'}))
+        self.assertEqual((ttl['siteinfo'], None), apicache.policy(
+            {'action': 'query', 'meta': 'siteinfo'}))
+        self.assertEqual((ttl['revids'], None), apicache.policy(
+            {'action': 'query', 'prop': 'revisions', 'revids': '1|2'}))
+        self.assertEqual((ttl['pages'], ('titles', 'A|B')), apicache.policy(
+            {'action': 'query', 'prop': 'revisions', 'titles': 'A|B'}))
+        self.assertEqual((ttl['pages'], ('pageids', '5')), apicache.policy(
+            {'action': 'query', 'prop': 'links', 'pageids': '5'}))
+        self.assertEqual(None, apicache.policy(
+            {'action': 'query', 'generator': 'links', 'titles': 'X',
+             'prop': 'revisions'}))
+        self.assertEqual((ttl['categorymembers'], ('titles', 'Category:A')),
+                         apicache.policy({'action': 'query',
+                                          'generator': 'categorymembers',
+                                          'gcmtitle': 'Category:A'}))
+        self.assertEqual(None, apicache.policy(
+            {'action': 'query', 'generator': 'categorymembers',
+             'gcmtitle': 'Category:A', 'prop': 'revisions'}))
+        self.assertEqual(None, apicache.policy(
+            {'action': 'query', 'list': 'categorymembers',
+             'cmtitle': 'Category:A', 'titles': 'B'}))
+        self.assertEqual((ttl['backlinks'], None), apicache.policy(
+            {'action': 'query', 'list': 'backlinks', 'bltitle': 'A'}))
+
+    def test_validator(self):
+        data = {'query': {'pages': {
+            '2': {'title': u'B', 'lastrevid': 20,
+                  'touched': u'2014-01-01T00:00:00Z'},
+            '-1': {'title': u'C', 'missing': ''},
+            '1': {'title': u'A', 'lastrevid': 10,
+                  'touched': u'2014-01-02T00:00:00Z'}}}}
+        self.assertEqual(u'A 10 2014-01-02T00:00:00Z\n'
+                         u'B 20 2014-01-01T00:00:00Z\n'
+                         u'C missing ', apicache.validator(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
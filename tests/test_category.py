@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for category.py"""
+__version__ = '$Id$'
+
+import bz2
+import os
+import cPickle as pickle
+import shutil
+import tempfile
+import unittest
+
+import test_utils
+
+import wikipedia as pywikibot
+import catlib
+import category
+
+
+class CategoryDatabaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'category.db')
+        self.site = pywikibot.getSite('en', 'wikipedia')
+        self.loaded = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def category(self, title):
+        # a category which records when its contents are loaded
+        cat = catlib.Category(self.site, title)
+        cat.subcategoriesList = lambda: self.loaded.append(title) or [
+            catlib.Category(self.site, u'Category:Sub \xe4')]
+        cat.articlesList = lambda: [pywikibot.Page(self.site, u'Article')]
+        cat.supercategoriesList = lambda: self.loaded.append(title) or [
+            catlib.Category(self.site, u'Category:Super')]
+        return cat
+
+    def test_persistent(self):
+        db = category.CategoryDatabase(filename=self.filename)
+        cat = self.category(u'Category:Test')
+        self.assertEqual([u'Category:Sub \xe4'],
+                         [c.title() for c in db.getSubcats(cat)])
+        self.assertEqual([u'Article'],
+                         [p.title() for p in db.getArticles(cat)])
+        self.assertEqual([u'Category:Super'],
+                         [c.title() for c in db.getSupercats(cat)])
+        self.assertEqual([u'Category:Test'] * 2, self.loaded)
+        db.dump()
+        # another run reads the categories from the database
+        db = category.CategoryDatabase(filename=self.filename)
+        cat = self.category(u'Category:Test')
+        subcats = db.getSubcats(cat)
+        self.assertEqual([u'Category:Sub \xe4'], [c.title() for c in subcats])
+        self.assertTrue(isinstance(subcats[0], catlib.Category))
+        self.assertEqual([u'Article'],
+                         [p.title() for p in db.getArticles(cat)])
+        db.getSupercats(cat)
+        self.assertEqual([u'Category:Test'] * 2, self.loaded)
+        db.dump()
+
+    def test_maxage(self):
+        db = category.CategoryDatabase(filename=self.filename)
+        db.getSubcats(self.category(u'Category:Test'))
+        db.dump()
+        db = category.CategoryDatabase(filename=self.filename, maxage=-1)
+        db.getSubcats(self.category(u'Category:Test'))
+        self.assertEqual([u'Category:Test'] * 2, self.loaded)
+        db.dump()
+
+    def test_rebuild(self):
+        db = category.CategoryDatabase(filename=self.filename)
+        db.getSubcats(self.category(u'Category:Test'))
+        db.dump()
+        db = category.CategoryDatabase(rebuild=True, filename=self.filename)
+        db.getSubcats(self.category(u'Category:Test'))
+        self.assertEqual([u'Category:Test'] * 2, self.loaded)
+        db.dump()
+
+    def test_import(self):
+        dumpfile = os.path.join(self.tempdir, 'category.dump.bz2')
+        f = bz2.BZ2File(dumpfile, 'w')
+        pickle.dump({'catContentDB': {}, 'superclassDB': {}}, f)
+        f.close()
+        imported = []
+        importDump = category.CategoryDatabase._importDump
+        category.CategoryDatabase._importDump = \
+            lambda db, filename: imported.append(filename)
+        try:
+            category.CategoryDatabase(filename=self.filename).dump()
+            self.assertEqual([dumpfile], imported)
+            # the contents table is still empty, but the dump was imported
+            category.CategoryDatabase(filename=self.filename).dump()
+            category.CategoryDatabase(rebuild=True,
+                                      filename=self.filename).dump()
+            category.CategoryDatabase(filename=self.filename).dump()
+            self.assertEqual([dumpfile], imported)
+        finally:
+            category.CategoryDatabase._importDump = importDump
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for catlib.py"""
+__version__ = '$Id$'
+
+import threading
+import unittest
+
+import test_utils
+
+import catlib
+from catlib import ARTICLE, SUBCATEGORY
+
+# category: list of members; members starting with 'C' are subcategories
+TREE = {
+    'C0': ['A1', 'C1', 'C2'],
+    'C1': ['A1', 'A2', 'C3'],
+    'C2': ['A3', 'C1', 'C0'],
+    'C3': ['A4', 'C4'],
+    'C4': ['A5'],
+}
+
+
+def members(category):
+    for name in TREE[category]:
+        if name.startswith('C'):
+            yield SUBCATEGORY, name
+        else:
+            yield ARTICLE, name
+
+
+class WalkTestCase(unittest.TestCase):
+
+    def test_walk(self):
+        items = list(catlib._walk(['C0'], members, workers=3))
+        self.assertEqual(len(items), len(set(items)))
+        self.assertEqual(set([(ARTICLE, 'A%i' % i) for i in range(1, 6)] +
+                             [(SUBCATEGORY, 'C%i' % i) for i in range(1, 5)]),
+                         set(items))
+
+    def test_maxdepth(self):
+        items = list(catlib._walk(['C0'], members, maxdepth=0))
+        self.assertEqual(set([(ARTICLE, 'A1'), (SUBCATEGORY, 'C1'),
+                              (SUBCATEGORY, 'C2')]), set(items))
+        items = set(catlib._walk(['C0'], members, maxdepth=1))
+        self.assertTrue((SUBCATEGORY, 'C3') in items)
+        self.assertFalse((ARTICLE, 'A4') in items)
+
+    def test_breadth_first(self):
+        # with a single worker the levels are loaded one after the other
+        items = [item for tag, item in catlib._walk(['C0'], members,
+                                                    workers=1)]
+        self.assertTrue(items.index('A3') < items.index('A4') <
+                        items.index('A5'))
+
+    def test_seen(self):
+        items = set(catlib._walk(['C0'], members, seen=set(['C1'])))
+        self.assertFalse((SUBCATEGORY, 'C1') in items)
+        self.assertFalse((ARTICLE, 'A2') in items)
+
+    def test_error(self):
+        def broken(category):
+            if category == 'C1':
+                raise ValueError(category)
+            return members(category)
+        self.assertRaises(ValueError, list, catlib._walk(['C0'], broken))
+
+    def test_stop(self):
+        def endless(category):
+            i = 0
+            while True:
+                i += 1
+                yield ARTICLE, (category, i)
+        gen = catlib._walk(['C0', 'C1'], endless, workers=2)
+        self.assertEqual(ARTICLE, gen.next()[0])
+        gen.close()
+        for thread in threading.enumerate():
+            if thread.getName().startswith('Category-Thread'):
+                thread.join(5)
+                self.assertFalse(thread.isAlive())
+
+
+if __name__ == '__main__':
+    unittest.main()
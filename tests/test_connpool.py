@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for pywikibot/comms/connpool.py"""
+__version__ = '$Id$'
+
+import BaseHTTPServer
+import threading
+import unittest
+import urllib2
+
+import test_utils
+
+from pywikibot.comms import connpool
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = 'path=%s' % self.path
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path == '/drop':
+            # drop the connection without telling the client
+            self.close_connection = 1
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Conn(object):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class PruneTestCase(unittest.TestCase):
+
+    def test_prune_other_keys(self):
+        pool = connpool.ConnectionPool(idletimeout=30)
+        old = _Conn()
+        pool.put('a', old)
+        pool._idle['a'][0] = (old, 0)
+        pool.put('b', _Conn())
+        self.assertTrue(old.closed)
+        self.assertEqual(['b'], pool._idle.keys())
+        pool._idle['b'][0] = (pool._idle['b'][0][0], 0)
+        self.assertEqual(None, pool.get('c'))
+        self.assertEqual({}, pool._idle)
+        self.assertEqual(2, pool.stats()['evicted'])
+
+    def test_total_limit(self):
+        pool = connpool.ConnectionPool(maxsize=2, maxtotal=3)
+        conns = [_Conn() for i in range(4)]
+        now = connpool.time.time()
+        clock = iter([now, now + 1, now + 2, now + 3]).next
+        connpool.time.time, orig = clock, connpool.time.time
+        try:
+            for i, conn in enumerate(conns):
+                pool.put('host%i' % (i % 2), conn)
+        finally:
+            connpool.time.time = orig
+        self.assertEqual(3, pool.stats()['idle'])
+        self.assertEqual([True, False, False, False],
+                         [conn.closed for conn in conns])
+        self.assertEqual(conns[3], pool.get('host1'))
+        self.assertEqual(conns[2], pool.get('host0'))
+        self.assertEqual(conns[1], pool.get('host1'))
+        self.assertEqual(None, pool.get('host0'))
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%i' % self.server.server_port
+        self.pool = connpool.ConnectionPool(maxsize=2)
+        self.opener = urllib2.build_opener(connpool.HTTPHandler(self.pool))
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuse(self):
+        for i in range(5):
+            f = self.opener.open(self.url + '/%i' % i)
+            self.assertEqual('path=/%i' % i, f.read())
+        self.opener.open(self.url + '/post', 'foo=bar').read()
+        stats = self.pool.stats()
+        self.assertEqual(6, stats['requests'])
+        self.assertEqual(1, stats['handshakes'])
+        self.assertEqual(5, stats['handshakes_avoided'])
+        self.assertEqual(1, stats['idle'])
+
+    def test_unread_response_is_discarded(self):
+        f = self.opener.open(self.url + '/a')
+        f.read(2)
+        f.close()
+        self.assertEqual(0, self.pool.stats()['idle'])
+        self.assertEqual('path=/b', self.opener.open(self.url + '/b').read())
+        self.assertEqual(2, self.pool.stats()['handshakes'])
+
+    def test_idle_timeout(self):
+        self.opener.open(self.url + '/a').read()
+        self.pool.idletimeout = -1
+        self.opener.open(self.url + '/b').read()
+        stats = self.pool.stats()
+        self.assertEqual(1, stats['evicted'])
+        self.assertEqual(2, stats['handshakes'])
+
+    def test_reconnect_on_reset(self):
+        self.opener.open(self.url + '/drop').read()
+        self.assertEqual('path=/b', self.opener.open(self.url + '/b').read())
+        self.assertEqual(1, self.pool.stats()['resets'])
+
+
+if __name__ == '__main__':
+    unittest.main()
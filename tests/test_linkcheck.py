@@ -0,0 +1,140 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for pywikibot/linkcheck.py"""
+__version__ = '$Id$'
+
+import BaseHTTPServer
+import SocketServer
+import socket
+import threading
+import unittest
+
+import test_utils
+
+from pywikibot import linkcheck
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def answer(self):
+        self.server.requests.append((self.command, self.path))
+        self.server.clients.add(self.client_address)
+        if self.path == '/ok':
+            self.respond(200, 'OK')
+        elif self.path == '/redirect':
+            self.respond(302, 'Found', '/sub/dir/relative')
+        elif self.path == '/sub/dir/relative':
+            self.respond(301, 'Moved', '../../ok')
+        elif self.path == '/loop':
+            self.respond(302, 'Found', '/loop')
+        elif self.path == '/nohead' and self.command == 'HEAD':
+            self.respond(405, 'Method Not Allowed')
+        elif self.path == '/nohead':
+            self.respond(200, 'OK')
+        else:
+            self.respond(404, 'Not Found')
+
+    def respond(self, status, reason, location=None):
+        self.send_response(status, reason)
+        if location:
+            self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.answer()
+
+    def do_GET(self):
+        self.answer()
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class LinkCheckEngineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.requests = []
+        self.server.clients = set()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.base = 'http://127.0.0.1:%i' % self.server.server_address[1]
+        self.engine = linkcheck.LinkCheckEngine(hostDelay=0, timeout=5)
+        self.results = {}
+
+    def tearDown(self):
+        self.engine.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def check(self, *paths):
+        for path in paths:
+            self.engine.check(self.base + path,
+                              lambda ok, msg, path=path:
+                              self.results.setdefault(path, []).append(
+                                  (ok, msg)))
+        self.assertTrue(self.engine.run(timeout=10))
+
+    def test_status(self):
+        self.check('/ok', '/missing', '/nohead')
+        self.assertEqual({'/ok': [(True, '200 OK')],
+                          '/missing': [(False, '404 Not Found')],
+                          '/nohead': [(True, '200 OK')]},
+                         self.results)
+        # dead links are checked again with GET
+        self.assertTrue(('GET', '/missing') in self.server.requests)
+        self.assertFalse(('GET', '/ok') in self.server.requests)
+
+    def test_redirect(self):
+        self.check('/redirect', '/loop')
+        self.assertEqual([(True, '200 OK')], self.results['/redirect'])
+        self.assertEqual(['/redirect', '/sub/dir/relative', '/ok'],
+                         [path for method, path in self.server.requests
+                          if path != '/loop'])
+        ok, message = self.results['/loop'][0]
+        self.assertFalse(ok)
+        self.assertTrue(message.startswith(u'HTTP Redirect Loop: '))
+
+    def test_dedup(self):
+        self.check('/ok', '/ok')
+        self.check('/ok')
+        self.assertEqual([(True, '200 OK')] * 3, self.results['/ok'])
+        self.assertEqual([('HEAD', '/ok')], self.server.requests)
+
+    def test_reuse(self):
+        self.engine.hostConnections = 1
+        self.check('/ok', '/redirect')
+        # all HEAD requests used the same connection
+        self.assertEqual(4, len(self.server.requests))
+        self.assertEqual(1, len(self.server.clients))
+        self.assertEqual(1, self.engine.idle)
+
+    def test_timeout(self):
+        # a server which never answers
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(5)
+        try:
+            self.engine.timeout = 0.5
+            self.engine.check('http://127.0.0.1:%i/' % sock.getsockname()[1],
+                              lambda ok, msg: self.results.update(x=msg))
+            self.assertTrue(self.engine.run(timeout=10))
+            self.assertEqual(u"Socket Error: 'timed out'", self.results['x'])
+        finally:
+            sock.close()
+
+    def test_not_an_url(self):
+        self.assertRaises(linkcheck.NotAnURLError, self.engine.check,
+                          'ftp://example.org/', None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for query.ListIterator"""
+__version__ = '$Id$'
+
+import threading
+import unittest
+
+import test_utils
+
+import wikipedia as pywikibot
+import query
+
+TITLES = [u'Page %02i' % i for i in range(25)]
+
+
+class ListIteratorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.site = pywikibot.getSite('en', 'wikipedia')
+        self.requests = []
+        self.error = None
+        self.saved = query.GetData, self.site.versionnumber
+        query.GetData = self.getData
+        self.site.versionnumber = lambda: 24
+        query._maxLimits.clear()
+
+    def tearDown(self):
+        query.GetData = self.saved[0]
+        del self.site.versionnumber
+        query._maxLimits.clear()
+
+    def getData(self, params, site, sysop=False):
+        """Answer list=allpages, at most 10 pages at a time."""
+        self.requests.append((params['aplimit'],
+                              threading.currentThread().getName()))
+        if self.error and len(self.requests) > 1:
+            return {'error': self.error}
+        start = int(params.get('apcontinue', 0))
+        limit = params['aplimit']
+        result = {}
+        if limit == 'max':
+            limit = 10
+            result['limits'] = {'allpages': 10}
+        pages = [{'title': title, 'ns': 0, 'pageid': start + i}
+                 for i, title in enumerate(TITLES[start:start + limit])]
+        result['query'] = {'allpages': pages}
+        if start + limit < len(TITLES):
+            if 'continue' in params:
+                result['continue'] = {'apcontinue': start + limit,
+                                      'continue': '-||'}
+            else:
+                result['query-continue'] = {
+                    'allpages': {'apcontinue': start + limit}}
+        return result
+
+    def test_all(self):
+        main = threading.currentThread().getName()
+        for prefetch in (True, False):
+            self.requests = []
+            pages = list(query.ListIterator(self.site, 'allpages', 'ap',
+                                            pages=True, prefetch=prefetch))
+            self.assertEqual(TITLES, [page.title() for page in pages])
+            # the limit is negotiated once
+            self.assertEqual(['max', 10, 10],
+                             [limit for limit, thread in self.requests])
+            # the requests are made in the background if prefetching
+            self.assertEqual(not prefetch, self.requests[0][1] == main)
+            query._maxLimits.clear()
+
+    def test_new_continue(self):
+        results = list(query.ListIterator(self.site, 'allpages', 'ap',
+                                          {'continue': ''}))
+        self.assertEqual(range(25), [page['pageid'] for page in results])
+
+    def test_total(self):
+        results = list(query.ListIterator(self.site, 'allpages', 'ap',
+                                          total=5))
+        self.assertEqual(range(5), [page['pageid'] for page in results])
+        self.assertEqual([5], [limit for limit, thread in self.requests])
+        results = list(query.ListIterator(self.site, 'allpages', 'ap',
+                                          total=100))
+        self.assertEqual(25, len(results))
+        query._maxLimits[repr(self.site), 'allpages', False] = 10
+        results = list(query.ListIterator(self.site, 'allpages', 'ap',
+                                          total=12))
+        self.assertEqual(12, len(results))
+        self.assertEqual([10, 2],
+                         [limit for limit, thread in self.requests[-2:]])
+
+    def test_error(self):
+        self.error = {'code': 'internal_api_error', 'info': 'Failure'}
+        results = []
+        iterator = query.ListIterator(self.site, 'allpages', 'ap')
+        try:
+            for page in iterator:
+                results.append(page)
+        except RuntimeError:
+            pass
+        else:
+            self.fail('RuntimeError not raised')
+        # the results retrieved before are yielded
+        self.assertEqual(10, len(results))
+
+
+if __name__ == '__main__':
+    unittest.main()
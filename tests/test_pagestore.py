@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for pywikibot/pagestore.py"""
+__version__ = '$Id$'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import test_utils
+
+from pywikibot import pagestore
+
+
+class PageStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'pagestore1')
+        self.store = pagestore.PageStore(self.filename, mingarbage=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_store(self):
+        self.store[1] = u'K\xf6ln ' * 100
+        self.store[2] = u''
+        self.assertEqual(u'K\xf6ln ' * 100, self.store[1])
+        self.assertEqual(u'', self.store[2])
+        # replaced texts are appended
+        self.store[1] = u'Bonn'
+        self.assertEqual(u'Bonn', self.store[1])
+        stats = self.store.stats()
+        self.assertEqual(2, stats['texts'])
+        self.assertEqual(4, stats['size'])
+        self.assertTrue(stats['garbage'] > 0)
+        self.assertEqual(os.path.getsize(self.filename), stats['file'])
+        self.assertRaises(KeyError, self.store.__getitem__, 3)
+
+    def test_compact(self):
+        for i in range(10):
+            self.store[i] = u'text %i' % i * 50
+        for i in range(6):
+            del self.store[i]
+        # the deleted texts have been removed from the file
+        stats = self.store.stats()
+        self.assertTrue(stats['garbage'] <= stats['file'] - stats['garbage'])
+        self.assertEqual(os.path.getsize(self.filename), stats['file'])
+        for i in range(6, 10):
+            self.assertEqual(u'text %i' % i * 50, self.store[i])
+        self.assertRaises(KeyError, self.store.__delitem__, 0)
+
+    def test_close(self):
+        self.store[1] = u'text'
+        self.store.close()
+        self.assertFalse(os.path.exists(self.filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for pagegenerators.PreloadingGenerator"""
+__version__ = '$Id$'
+
+import threading
+import time
+import unittest
+
+import test_utils
+
+import wikipedia as pywikibot
+import pagegenerators
+
+TITLES = [u'Page %02i' % i for i in range(10)]
+
+
+class PreloadingGeneratorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.site = pywikibot.getSite('en', 'wikipedia')
+        self.pages = [pywikibot.Page(self.site, title) for title in TITLES]
+        self.calls = []
+        self.error = None
+        self.delay = None
+        self.saved = pywikibot.getall
+        pywikibot.getall = self.getall
+
+    def tearDown(self):
+        pywikibot.getall = self.saved
+
+    def getall(self, site, pages, throttle=True, force=False):
+        """Load the texts of pages, the first batch being the slowest."""
+        number = len(self.calls)
+        self.calls.append(([page.title() for page in pages],
+                           threading.currentThread().getName()))
+        if self.delay:
+            time.sleep(self.delay / (number + 1))
+        if self.error and number > 0:
+            raise self.error
+        for page in pages:
+            page._contents = page.title()
+
+    def workers(self):
+        return [thread for thread in threading.enumerate()
+                if thread.getName().startswith('Preload-Thread')]
+
+    def test_order(self):
+        self.delay = 0.3
+        gen = pagegenerators.PreloadingGenerator(iter(self.pages), 2,
+                                                 lookahead=3, workers=3)
+        pages = list(gen)
+        self.assertEqual(TITLES, [page.title() for page in pages])
+        self.assertEqual(TITLES, [page._contents for page in pages])
+        self.assertEqual([TITLES[i:i + 2] for i in range(0, 10, 2)],
+                         sorted(titles for titles, thread in self.calls))
+        self.assertTrue(all(thread.startswith('Preload-Thread')
+                            for titles, thread in self.calls))
+
+    def test_no_lookahead(self):
+        main = threading.currentThread().getName()
+        workers = self.workers()
+        gen = pagegenerators.PreloadingGenerator(iter(self.pages), 4,
+                                                 lookahead=0)
+        seen = []
+        for page in gen:
+            # a batch is only loaded when its first page is needed
+            seen.append(page.title())
+            self.assertEqual((len(seen) - 1) // 4 + 1, len(self.calls))
+        self.assertEqual(TITLES, seen)
+        self.assertEqual([(TITLES[0:4], main), (TITLES[4:8], main),
+                          (TITLES[8:], main)], self.calls)
+        self.assertEqual(workers, self.workers())
+
+    def test_worker_error(self):
+        self.error = ValueError('broken')
+        gen = pagegenerators.PreloadingGenerator(iter(self.pages), 2,
+                                                 lookahead=1)
+        prefetched = gen._prefetch()
+        self.assertEqual(TITLES[:2],
+                         [prefetched.next().title() for i in range(2)])
+        self.assertRaises(ValueError, prefetched.next)
+        prefetched.close()
+
+    def test_stop_early(self):
+        gen = iter(pagegenerators.PreloadingGenerator(
+            iter(self.pages), 2, lookahead=1, workers=2))
+        self.assertEqual(TITLES[0], gen.next().title())
+        gen.close()
+        for thread in self.workers():
+            thread.join(5)
+        self.assertEqual([], self.workers())
+        # no batch is loaded after the consumer has stopped
+        self.assertTrue(len(self.calls) <= 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
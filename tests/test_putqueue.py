@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for pywikibot/putqueue.py"""
+__version__ = '$Id$'
+
+import threading
+import time
+import unittest
+
+import test_utils
+
+import wikipedia as pywikibot
+from pywikibot import putqueue
+
+
+class FakePage(object):
+    """A page which records when it is saved."""
+
+    def __init__(self, site, title, saved, gate=None, error=None):
+        self._site = site
+        self.title = title
+        self.saved = saved
+        self.gate = gate
+        self.error = error
+        self.started = threading.Event()
+
+    def site(self):
+        return self._site
+
+    def put(self, newtext, comment, watchArticle, minorEdit, force):
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.saved.append((self._site, self.title, time.time()))
+        if self.error is not None:
+            raise self.error
+
+
+class PutSchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = []
+        self.scheduler = putqueue.PutScheduler()
+
+    def put(self, page, text=u'text', **kwargs):
+        request = putqueue.PutRequest(page, text, **kwargs)
+        self.scheduler.put(request)
+        return request
+
+    def test_lanes(self):
+        gate = threading.Event()
+        # the first site is blocked, the second one is not
+        blocked = self.put(FakePage('a', 1, self.saved, gate))
+        done = self.put(FakePage('b', 2, self.saved))
+        self.assertTrue(done.wait(5))
+        self.assertFalse(blocked.done())
+        self.assertEqual({'a': 1}, self.scheduler.pending())
+        gate.set()
+        self.assertTrue(self.scheduler.join(5))
+        self.assertEqual([2, 1], [title for site, title, t in self.saved])
+        self.assertEqual({}, self.scheduler.pending())
+
+    def test_priority(self):
+        gate = threading.Event()
+        first = FakePage('a', 0, self.saved, gate)
+        self.put(first)
+        # the other pages are queued while the first one is saved
+        first.started.wait(5)
+        for i in range(1, 4):
+            self.put(FakePage('a', i, self.saved), priority=i % 2)
+        gate.set()
+        self.assertTrue(self.scheduler.join(5))
+        self.assertEqual([0, 1, 3, 2], [title for site, title, t in self.saved])
+
+    def test_callback(self):
+        errors = []
+        error = pywikibot.LockedPage()
+        request = self.put(FakePage('a', 1, self.saved, error=error),
+                           callback=lambda page, e: errors.append(e))
+        self.assertTrue(request.wait(5))
+        self.assertTrue(self.scheduler.join(5))
+        self.assertTrue(request.error is error)
+        self.assertEqual([error], errors)
+
+    def test_maxbytes(self):
+        self.scheduler.maxbytes = 10
+        gate = threading.Event()
+        self.put(FakePage('a', 1, self.saved, gate), u'\xe4' * 4)
+        # the second text doesn't fit until the first one is saved
+        thread = threading.Thread(
+            target=self.put, args=(FakePage('a', 2, self.saved), u'x' * 4))
+        thread.start()
+        thread.join(0.5)
+        self.assertTrue(thread.isAlive())
+        self.assertEqual(8, self.scheduler.bytes)
+        gate.set()
+        thread.join(5)
+        self.assertTrue(self.scheduler.join(5))
+        self.assertEqual(0, self.scheduler.bytes)
+        self.assertEqual(2, len(self.saved))
+
+
+if __name__ == '__main__':
+    unittest.main()
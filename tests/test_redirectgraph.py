@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for pywikibot/redirectgraph.py"""
+__version__ = '$Id$'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import test_utils
+
+import wikipedia as pywikibot
+import query
+import redirect
+from pywikibot.redirectgraph import RedirectGraph
+
+
+class RedirectGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = graph = RedirectGraph('wikipedia:en',
+                                           '2014-01-01T00:00:00Z')
+        # chain A -> B -> C -> D
+        graph.addRedirect(u'A', u'B')
+        graph.addRedirect(u'B', u'C')
+        graph.addRedirect(u'C', u'D')
+        graph.addPage(u'D')
+        # loop E -> F -> G -> E, and H leading into it
+        graph.addRedirect(u'E', u'F')
+        graph.addRedirect(u'F', u'G')
+        graph.addRedirect(u'G', u'E')
+        graph.addRedirect(u'H', u'E')
+        # broken
+        graph.addRedirect(u'K\xf6ln', u'Missing')
+        # redirect to a redirect whose target is not known
+        graph.addRedirect(u'I', u'J')
+        graph.addRedirect(u'J')
+
+    def test_analyze(self):
+        graph = self.graph
+        self.assertEqual([3, 2, 1], [graph.chainLength(title)
+                                     for title in u'ABC'])
+        self.assertEqual(u'D', graph.finalTarget(u'A'))
+        self.assertEqual([None] * 4, [graph.chainLength(title)
+                                      for title in u'EFGH'])
+        self.assertEqual(set(u'EFGH'), set(graph.loops()))
+        self.assertEqual([u'K\xf6ln'], list(graph.brokenRedirects()))
+        self.assertEqual(set(u'ABEFGHI'), set(graph.doubleRedirects()))
+        self.assertEqual(2, graph.chainLength(u'I'))
+        self.assertEqual(None, graph.finalTarget(u'I'))
+
+    def test_follow(self):
+        graph = self.graph
+        self.assertEqual((3, u'D'), graph.follow(u'A', 8))
+        self.assertEqual((3, None), graph.follow(u'A', 2))
+        self.assertEqual((9, None), graph.follow(u'H', 8))
+        self.assertEqual((2, None), graph.follow(u'I', 8))
+        self.assertEqual((1, u'Missing'), graph.follow(u'K\xf6ln', 8))
+        self.assertTrue(graph.isBroken(u'K\xf6ln'))
+        self.assertFalse(graph.isBroken(u'C'))
+        self.assertFalse(graph.isBroken(u'J'))
+
+    def test_changes(self):
+        graph = self.graph
+        list(graph.doubleRedirects())
+        # the double redirect is fixed, the loop broken up
+        graph.addRedirect(u'A', u'D')
+        graph.addPage(u'G')
+        graph.removePage(u'Missing')
+        self.assertEqual(set(u'BEHI'), set(graph.doubleRedirects()))
+        self.assertEqual(3, graph.chainLength(u'H'))
+        self.assertEqual([u'K\xf6ln'], list(graph.brokenRedirects()))
+        graph.addPage(u'Missing')
+        self.assertEqual([], list(graph.brokenRedirects()))
+        # the target of a known redirect is kept
+        graph.addRedirect(u'A')
+        self.assertEqual(u'D', graph.target(u'A'))
+
+    def test_save(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, 'redirects.graph')
+            self.graph.save(filename)
+            graph = RedirectGraph.load(filename)
+        finally:
+            shutil.rmtree(tempdir)
+        self.assertEqual('wikipedia:en', graph.site)
+        self.assertEqual('2014-01-01T00:00:00Z', graph.timestamp)
+        self.assertEqual(sorted(self.graph.redirects()),
+                         sorted(graph.redirects()))
+        self.assertEqual(list(self.graph.brokenRedirects()),
+                         list(graph.brokenRedirects()))
+        graph.addRedirect(u'New', u'A')
+        self.assertEqual(4, graph.chainLength(u'New'))
+
+
+class LoadIntoGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = query.GetData
+        query.GetData = lambda params, site: self.data
+
+        class Generator(redirect.RedirectGenerator):
+            def __init__(self):
+                self.site = pywikibot.getSite('en', 'wikipedia')
+        self.generator = Generator()
+
+    def tearDown(self):
+        query.GetData = self.saved
+
+    def test_targets(self):
+        self.data = {'query': {
+            'redirects': [
+                {'from': u'Soft', 'to': u'Foo', 'tointerwiki': u'wikt'},
+                {'from': u'Bad', 'to': u'Foo[bar]'},
+                {'from': u'Broken', 'to': u'Missing'},
+                {'from': u'Fine', 'to': u'Page'}],
+            'pages': {
+                '-1': {'title': u'Foo[bar]', 'invalid': '',
+                       'invalidreason': u'...'},
+                '-2': {'ns': 0, 'title': u'Missing', 'missing': ''},
+                '1': {'ns': 0, 'title': u'Page', 'pageid': 1}}}}
+        graph = RedirectGraph()
+        # Soft was a local redirect before
+        graph.addRedirect(u'Soft', u'Page')
+        self.generator._load_into_graph(graph, {'pageids': [1, 2, 3, 4]})
+        self.assertEqual([u'Broken'], list(graph.brokenRedirects()))
+        self.assertEqual(None, graph.target(u'Soft'))
+        self.assertEqual(None, graph.target(u'Bad'))
+        self.assertTrue(graph.isRedirect(u'Soft'))
+        self.assertEqual(u'Page', graph.finalTarget(u'Fine'))
+
+    def test_stream(self):
+        groups = [[1, 2], [3]]
+        answers = {
+            '1|2': {'query': {
+                'redirects': [{'from': u'A', 'to': u'B'},
+                              {'from': u'B', 'to': u'C'},
+                              {'from': u'D', 'to': u'Missing'}],
+                'pages': {'-1': {'ns': 0, 'title': u'Missing', 'missing': ''},
+                          '5': {'ns': 0, 'title': u'C', 'pageid': 5}}}},
+            '3': {'query': {
+                'redirects': [{'from': u'B', 'to': u'C'}],
+                'pages': {'5': {'ns': 0, 'title': u'C', 'pageid': 5}}}},
+        }
+        requests = []
+
+        def getData(params, site):
+            requests.append(params['pageids'])
+            return answers['|'.join(map(str, params['pageids']))]
+        query.GetData = getData
+        self.generator.graphFilename = None
+        self.generator.graph = None
+        self.generator._next_redirect_group = lambda: iter(groups)
+        results = self.generator.get_redirects_via_api(maxlen=8)
+        self.assertEqual((u'A', 2, u'B', u'C'), results.next())
+        # the redirects are yielded before the next group is retrieved
+        self.assertEqual([[1, 2]], requests)
+        self.assertEqual([(u'B', 1, u'C', u'C'),
+                          (u'D', 0, u'Missing', u'Missing')], list(results))
+        self.assertEqual([[1, 2], [3]], requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for wikipedia.getallReferences()"""
+__version__ = '$Id$'
+
+import cgi
+import json
+import unittest
+import urlparse
+
+import test_utils
+
+import wikipedia as pywikibot
+import config
+
+# title: [(referrer, is a redirect, is a transclusion)]
+REFERENCES = {
+    u'A': [(u'P1', False, False), (u'R1', True, False),
+           (u'T1', False, True), (u'P2', False, False)],
+    u'B': [(u'P1', False, False), (u'R2', True, False)],
+    # a redirect to A
+    u'R1': [(u'P3', False, False), (u'R3', True, False),
+            (u'P1', False, False)],
+    # a redirect to B
+    u'R2': [(u'R1', True, False)],
+    # a double redirect to A, and a loop
+    u'R3': [(u'P4', False, True), (u'R1', True, False)],
+}
+
+
+class GetAllReferencesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.site = pywikibot.getSite('en', 'wikipedia')
+        self.requests = []
+        self.saved = (pywikibot.query.GetData, self.site.versionnumber,
+                      self.site.isAllowed)
+        pywikibot.query.GetData = self.getData
+        self.site.versionnumber = lambda: 24
+        self.site.isAllowed = lambda right, sysop=False: False
+
+    def tearDown(self):
+        (pywikibot.query.GetData, self.site.versionnumber,
+         self.site.isAllowed) = self.saved
+        del self.site.versionnumber
+        del self.site.isAllowed
+
+    def getData(self, params, site):
+        """Answer prop=linkshere|transcludedin, two references at a time."""
+        self.requests.append(list(params['titles']))
+        result = {'query': {'pages': {}}}
+        for i, title in enumerate(params['titles']):
+            page = {'title': title, 'ns': 0}
+            for prop, prefix, transclusion in [('linkshere', 'lh', False),
+                                               ('transcludedin', 'ti', True)]:
+                if prop not in params['prop']:
+                    continue
+                refs = [{'title': ref, 'ns': 0, 'redirect': ''}
+                        if isRedirect else {'title': ref, 'ns': 0}
+                        for ref, isRedirect, isTransclusion
+                        in REFERENCES.get(title, [])
+                        if isTransclusion == transclusion]
+                start = params.get(prefix + 'continue', 0)
+                if refs[start:start + 2]:
+                    page[prop] = refs[start:start + 2]
+                if len(refs) > start + 2:
+                    result.setdefault('query-continue', {})[prop] = {
+                        prefix + 'continue': start + 2}
+            result['query']['pages'][str(-1 - i)] = page
+        return result
+
+    def batches(self):
+        """Return the titles requested, without the continuations."""
+        batches = []
+        for titles in self.requests:
+            if sorted(titles) not in batches:
+                batches.append(sorted(titles))
+        return batches
+
+    def references(self, titles, **kwargs):
+        pages = [pywikibot.Page(self.site, title) for title in titles]
+        return [(page.title(), ref.title()) for page, ref in
+                pywikibot.getallReferences(self.site, pages, **kwargs)]
+
+    def test_follow_redirects(self):
+        refs = self.references([u'A', u'B'])
+        self.assertEqual(len(refs), len(set(refs)))
+        self.assertEqual(
+            set([u'P1', u'R1', u'T1', u'P2', u'P3', u'R3', u'P4']),
+            set(ref for page, ref in refs if page == u'A'))
+        self.assertEqual(set([u'P1', u'R2', u'R1', u'P3', u'R3', u'P4']),
+                         set(ref for page, ref in refs if page == u'B'))
+        # the referrers of every redirect are retrieved only once
+        self.assertEqual([[u'A', u'B'], [u'R1', u'R2'], [u'R3']],
+                         self.batches())
+
+    def test_options(self):
+        refs = self.references([u'A'], follow_redirects=False,
+                               withTemplateInclusion=False)
+        self.assertEqual([(u'A', u'P1'), (u'A', u'R1'), (u'A', u'P2')], refs)
+        refs = self.references([u'A', u'R3'], onlyTemplateInclusion=True)
+        self.assertEqual([(u'A', u'T1'), (u'R3', u'P4')], refs)
+
+    def test_batches(self):
+        self.references([u'A', u'B', u'R1'], step=2,
+                        follow_redirects=False)
+        self.assertEqual([[u'A', u'B'], [u'R1']], self.batches())
+
+
+class ContinuationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.site = pywikibot.getSite('en', 'wikipedia')
+        self.requests = []
+        self.saved = (self.site.getUrl, self.site.versionnumber,
+                      self.site.isAllowed, config.api_cache)
+        self.site.getUrl = self.getUrl
+        self.site.versionnumber = lambda: 24
+        self.site.isAllowed = lambda right, sysop=False: False
+        config.api_cache = False
+
+    def tearDown(self):
+        config.api_cache = self.saved[3]
+        del self.site.getUrl
+        del self.site.versionnumber
+        del self.site.isAllowed
+
+    def getUrl(self, path, retry=True, sysop=False, data={}):
+        """Answer prop=linkshere with one referrer per request."""
+        params = dict((k, v[0]) for k, v in cgi.parse_qs(
+            urlparse.urlparse(path).query).iteritems())
+        params.update(data)
+        self.requests.append(params)
+        titles = params['titles'].split('|')
+        start = int(params.get('lhcontinue', 0))
+        result = {'query': {'pages': dict(
+            (str(-1 - i), {'title': title, 'ns': 0,
+                           'linkshere': [{'title': u'Ref %i' % start,
+                                          'ns': 0}]})
+            for i, title in enumerate(titles))}}
+        if start < 2:
+            result['query-continue'] = {
+                'linkshere': {'lhcontinue': start + 1}}
+        return json.dumps(result)
+
+    def test_many_titles(self):
+        titles = [u'Page %02i' % i for i in range(20)]
+        pages = [pywikibot.Page(self.site, title) for title in titles]
+        refs = list(pywikibot.getallReferences(self.site, pages,
+                                               follow_redirects=False))
+        self.assertEqual(3, len(self.requests))
+        # the titles are posted with every continuation request
+        for params in self.requests:
+            self.assertEqual(titles, sorted(params['titles'].split('|')))
+        self.assertEqual(60, len(refs))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for pywikibot/sitecache.py"""
+__version__ = '$Id$'
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import test_utils
+
+from pywikibot import sitecache
+
+
+class SiteDataStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        filename = os.path.join(self.tempdir, 'sitedata.db')
+        # two processes using the same database
+        self.first = sitecache.SiteDataStore(filename)
+        self.second = sitecache.SiteDataStore(filename)
+
+    def tearDown(self):
+        self.first.close()
+        self.second.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_save_load(self):
+        self.assertEqual(None, self.first.load('wikipedia:de', 'siteinfo',
+                                               u'1:1.23'))
+        info = {u'general': {u'sitename': u'Wikip\xe9dia'}}
+        self.first.save('wikipedia:de', 'siteinfo', u'1:1.23', info)
+        data, age = self.second.load('wikipedia:de', 'siteinfo', u'1:1.23')
+        self.assertEqual(info, data)
+        self.assertTrue(0 <= age < 60)
+        # other versions and sites are not used
+        self.assertEqual(None, self.second.load('wikipedia:de', 'siteinfo',
+                                                u'1:1.24'))
+        self.assertEqual(None, self.second.load('wikipedia:en', 'siteinfo',
+                                                u'1:1.23'))
+        self.second.delete('wikipedia:de')
+        self.assertEqual(None, self.first.load('wikipedia:de', 'siteinfo',
+                                               u'1:1.23'))
+
+    def test_update(self):
+        self.first.update('wikipedia:de', 'messages', u'1:1.23',
+                          {u'a': u'A'})
+        self.second.update('wikipedia:de', 'messages', u'1:1.23',
+                           {u'b': u'B'})
+        self.assertEqual({u'a': u'A', u'b': u'B'},
+                         self.first.load('wikipedia:de', 'messages',
+                                         u'1:1.23')[0])
+        # a new version starts a new snapshot
+        self.first.update('wikipedia:de', 'messages', u'1:1.24',
+                          {u'c': u'C'})
+        self.assertEqual({u'c': u'C'},
+                         self.second.load('wikipedia:de', 'messages',
+                                          u'1:1.24')[0])
+
+    def test_update_expired(self):
+        self.first.update('wikipedia:de', 'messages', u'1:1.23',
+                          {u'a': u'A'})
+        time.sleep(0.1)
+        # the messages are loaded again after the snapshot expired
+        self.second.update('wikipedia:de', 'messages', u'1:1.23',
+                           {u'b': u'B'}, maxAge=0.05)
+        data, age = self.first.load('wikipedia:de', 'messages', u'1:1.23')
+        self.assertEqual({u'b': u'B'}, data)
+        self.assertTrue(age < 0.05)
+        self.first.update('wikipedia:de', 'messages', u'1:1.23',
+                          {u'a': u'A'}, maxAge=60)
+        self.assertEqual({u'a': u'A', u'b': u'B'},
+                         self.second.load('wikipedia:de', 'messages',
+                                          u'1:1.23')[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
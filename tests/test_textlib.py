@@ -4,6 +4,7 @@
 """Unit tests for pywikibot/textlib.py"""
 __version__ = '$Id$'
 
+import re
 import unittest
 from tests.test_pywiki import PyWikiTestCase
 
@@ -102,5 +103,80 @@ class PyWikiTextLibTestCase(PyWikiTestCase):
         result = 'Blah\r\n\r\n[[Category:Cat1]]\r\n[[Category:Cat2]]\r\n\r\n[[fr:Test]]'
         self.assertRoundtripCategory(result,2)
 
+    def test_replaceExcept(self):
+        text = u'foo <!-- foo --> {{foo|foo}} <nowiki>foo</nowiki> foo'
+        exceptions = ['comment', 'template', 'nowiki']
+        self.assertEqual(u'bar <!-- foo --> {{foo|foo}} <nowiki>foo</nowiki> bar',
+                         textlib.replaceExcept(text, 'foo', 'bar', exceptions,
+                                               site=self.site))
+        self.assertEqual(u'b+r <!-- foo --> {{foo|foo}} <nowiki>foo</nowiki> b+r',
+                         textlib.replaceExcept(text, 'f(o)o', r'b+r',
+                                               exceptions, site=self.site))
+
+    def test_replaceExceptMulti(self):
+        text = (u'foo [[Category:foo]] [[de:foo]] x\r\n foo\r\n'
+                u'{{foo|{{{1|foo}}}}} foo') * 2
+        exceptions = ['category', 'interwiki', 'startspace', 'template']
+        replacements = [('foo', 'bar'), ('b(a)r', r'\1\1'), ('x', 'y'),
+                        # the new comment is protected from the next one
+                        ('y', '<!-- y -->'), ('y', 'z')]
+        exceptions.append('comment')
+        expected = text
+        for old, new in replacements:
+            expected = textlib.replaceExcept(expected, old, new, exceptions,
+                                             site=self.site)
+        self.assertEqual(expected,
+                         textlib.replaceExceptMulti(text, replacements,
+                                                    exceptions,
+                                                    site=self.site))
+        self.assertEqual(u'c b c!',
+                         textlib.replaceExceptMulti(u'a b a', [('a', 'c')],
+                                                    [], marker='!',
+                                                    site=self.site))
+
+    def test_MultipleReplacer(self):
+        text = (u'colour [[Category:colour]] favour x\r\n colour\r\n'
+                u'{{colour|{{{1|colour}}}}} honour') * 2
+        exceptions = ['category', 'startspace', 'template']
+        replacements = [(re.compile('colour'), 'color'),
+                        (re.compile('favour'), 'favor'),
+                        (re.compile(r'flav(o)r'), r'fl\1v\1r'),
+                        (re.compile('x'), ''),
+                        (re.compile(r'h(?=onour)'), '')]
+        expected = text
+        for old, new in replacements:
+            expected = textlib.replaceExcept(expected, old, new, exceptions,
+                                             site=self.site)
+        replacer = textlib.MultipleReplacer(replacements, exceptions,
+                                            site=self.site)
+        self.assertEqual(set([0, 1, 3, 4]), replacer.candidates(text))
+        self.assertEqual(expected, replacer.replace(text))
+        self.assertEqual(set(), replacer.candidates(u'foo'))
+        self.assertEqual(u'foo!', replacer.replace(u'foo', marker='!'))
+
+    def test_MultipleReplacer_new_exceptions(self):
+        # text created by a replacement is protected from the following ones
+        for replacements, exceptions, text in [
+                ([('colour', '[[colour]]'), ('colour', 'color')], ['link'],
+                 u'colour'),
+                ([('teh', '<!-- teh -->'), ('teh', 'the')], ['comment'],
+                 u'teh teh'),
+                ([('foo', '{{foo}}'), ('foo', 'bar'), ('x', 'y')],
+                 ['template'], u'a foo x')]:
+            expected = text
+            for old, new in replacements:
+                expected = textlib.replaceExcept(expected, old, new,
+                                                 exceptions, site=self.site)
+            replacer = textlib.MultipleReplacer(replacements, exceptions,
+                                                site=self.site)
+            self.assertEqual(expected, replacer.replace(text))
+        replacer = textlib.MultipleReplacer(
+            [('colour', '[[colour]]'), ('colour', 'color')], ['link'],
+            site=self.site)
+        self.assertEqual(u'[[colour]]', replacer.replace(u'colour'))
+        replacer = textlib.MultipleReplacer(replacements, exceptions,
+                                            site=self.site)
+        self.assertEqual(u'a {{foo}} y!', replacer.replace(text, marker='!'))
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for pywikibot/throttle.py"""
+__version__ = '$Id$'
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import test_utils
+
+from pywikibot import throttle
+
+
+class SharedThrottleStateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        filename = os.path.join(self.tempdir, 'throttle.db')
+        # two processes using the same database
+        self.first = throttle.SharedThrottleState(filename)
+        self.second = throttle.SharedThrottleState(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_register(self):
+        pid, count = self.first.register(0, 'wikipedia:en', 360, 1200)
+        self.assertEqual((1, 1), (pid, count))
+        self.assertEqual((2, 2),
+                         self.second.register(0, 'wikipedia:en', 360, 1200))
+        self.assertEqual((3, 1),
+                         self.second.register(0, 'wikipedia:de', 360, 1200))
+        self.first.unregister(1)
+        self.assertEqual((2, 1),
+                         self.second.register(2, 'wikipedia:en', 360, 1200))
+
+    def test_reserve(self):
+        now = time.time()
+        start = self.first.reserve('wikipedia:en', 10)
+        self.assertTrue(now <= start <= time.time())
+        # the other process has to wait for the budget
+        self.assertAlmostEqual(start + 10,
+                               self.second.reserve('wikipedia:en', 10))
+        self.assertAlmostEqual(start + 20,
+                               self.first.reserve('wikipedia:en', 10))
+        # reads, writes and other sites have their own budget
+        self.assertTrue(self.second.reserve('wikipedia:en', 10, write=True)
+                        <= time.time())
+        self.assertTrue(self.second.reserve('wikipedia:de', 10)
+                        <= time.time())
+
+    def test_postpone(self):
+        until = time.time() + 100
+        self.first.postpone('wikipedia:en', until)
+        self.assertAlmostEqual(until, self.second.reserve('wikipedia:en', 1))
+        self.assertAlmostEqual(until,
+                               self.second.reserve('wikipedia:en', 1,
+                                                   write=True))
+
+
+class RetryPolicyTestCase(unittest.TestCase):
+
+    def test_parseRetryAfter(self):
+        self.assertEqual(120.0, throttle.parseRetryAfter('120'))
+        self.assertEqual(0.0, throttle.parseRetryAfter(
+            'Wed, 21 Oct 2015 07:28:00 GMT'))
+        self.assertEqual(None, throttle.parseRetryAfter(None))
+        self.assertEqual(None, throttle.parseRetryAfter('soon'))
+
+    def test_parseLag(self):
+        self.assertEqual(7.0, throttle.parseLag(
+            u'Waiting for 10.64.16.27: 7 seconds lagged'))
+        self.assertEqual(1.5, throttle.parseLag(
+            u'Waiting for db1052: 1.5 seconds lagged'))
+        self.assertEqual(None, throttle.parseLag(u'Some other error'))
+
+    def test_delay(self):
+        policy = throttle.RetryPolicy(basewait=0.5, maxwait=60, maxretries=3,
+                                      slow=10, budget=10)
+        for attempt, limit in [(1, 0.5), (2, 2), (3, 8), (5, 60), (9, 60)]:
+            delay = policy.delay(attempt)
+            self.assertTrue(limit / 2 <= delay <= limit)
+        self.assertEqual(30, policy.delay(1, retryafter=30))
+        self.assertEqual(60, policy.delay(1, retryafter=3600))
+        self.assertFalse(policy.retry('wikipedia:en', 4))
+
+    def test_budget(self):
+        policy = throttle.RetryPolicy(basewait=0.5, maxwait=60, maxretries=3,
+                                      budget=120)
+        waits = []
+        throttle.time.sleep, sleep = waits.append, throttle.time.sleep
+        try:
+            # up to 0.5, 2, 8, 32, 60 and 60 seconds are waited before
+            self.assertTrue(policy.retry('wikipedia:en', 5))
+            self.assertTrue(policy.retry('wikipedia:en', 6))
+            self.assertFalse(policy.retry('wikipedia:en', 7))
+        finally:
+            throttle.time.sleep = sleep
+        self.assertEqual(2, len(waits))
+
+    def test_share(self):
+        policy = throttle.RetryPolicy(basewait=0.5, maxwait=60, maxretries=3,
+                                      slow=10)
+        self.assertEqual(1.0, policy.share('wikipedia:en'))
+        policy.failure('wikipedia:en')
+        policy.success('wikipedia:en', latency=20)
+        self.assertEqual(0.25, policy.share('wikipedia:en'))
+        self.assertEqual(1.0, policy.share('wikipedia:de'))
+        for i in range(20):
+            policy.success('wikipedia:en', latency=1)
+        self.assertEqual(1.0, policy.share('wikipedia:en'))
+        for i in range(20):
+            policy.failure('wikipedia:en')
+        self.assertEqual(policy.minshare, policy.share('wikipedia:en'))
+
+    def test_slow_size(self):
+        policy = throttle.RetryPolicy(slow=10, slowbytes=1000)
+        policy.success('wikipedia:en', latency=20, size=1000)
+        self.assertEqual(0.5, policy.share('wikipedia:en'))
+        policy.success('wikipedia:en', latency=20, size=5000)
+        self.assertEqual(0.5625, policy.share('wikipedia:en'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for the wait helpers of pywikibot/tools.py"""
+__version__ = '$Id$'
+
+import Queue
+import threading
+import time
+import unittest
+
+import test_utils
+
+from pywikibot import tools
+
+
+class WaitTestCase(unittest.TestCase):
+
+    def test_waitFor(self):
+        event = threading.Event()
+        calls = []
+
+        def wait(secs):
+            calls.append(secs)
+            if len(calls) == 3:
+                event.set()
+
+        self.assertTrue(tools.waitFor(event.isSet, wait))
+        self.assertEqual([tools.WAIT_INTERVAL] * 3, calls)
+
+    def test_waitFor_timeout(self):
+        event = threading.Event()
+        start = time.time()
+        self.assertFalse(tools.waitFor(event.isSet, event.wait, 0.3))
+        self.assertTrue(0.3 <= time.time() - start < 1)
+
+    def test_waitFor_condition(self):
+        cond = threading.Condition()
+        items = []
+
+        def produce():
+            time.sleep(0.3)
+            cond.acquire()
+            items.append(1)
+            cond.notifyAll()
+            cond.release()
+
+        threading.Thread(target=produce).start()
+        cond.acquire()
+        try:
+            self.assertEqual([1], tools.waitFor(lambda: items, cond.wait))
+        finally:
+            cond.release()
+
+    def test_queueGet(self):
+        queue = Queue.Queue()
+        timer = threading.Timer(0.3, queue.put, ('item',))
+        timer.start()
+        self.assertEqual('item', tools.queueGet(queue))
+
+    def test_queuePut(self):
+        queue = Queue.Queue(1)
+        self.assertTrue(tools.queuePut(queue, 1))
+        threading.Timer(0.3, queue.get).start()
+        self.assertTrue(tools.queuePut(queue, 2))
+        self.assertEqual(2, queue.get())
+
+    def test_queuePut_stop(self):
+        queue = Queue.Queue(1)
+        queue.put(1)
+        stop = threading.Event()
+        threading.Timer(0.3, stop.set).start()
+        self.assertFalse(tools.queuePut(queue, 2, stop))
+        self.assertEqual(1, queue.get())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+
+"""Unit tests for weblinkchecker.py"""
+__version__ = '$Id$'
+
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import unittest
+
+import test_utils
+
+import wikipedia as pywikibot
+from pywikibot import weblib
+import weblinkchecker
+
+DAY = 60 * 60 * 24
+
+
+class HistoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'deadlinks-test.db')
+        self.site = pywikibot.getSite('en', 'wikipedia')
+        self.logged = []
+        # don't ask the archives
+        self.archives = (weblib.getInternetArchiveURL,
+                         weblib.getWebCitationURL)
+        weblib.getInternetArchiveURL = lambda site, url: None
+        weblib.getWebCitationURL = lambda site, url: None
+
+    def tearDown(self):
+        (weblib.getInternetArchiveURL,
+         weblib.getWebCitationURL) = self.archives
+        shutil.rmtree(self.tempdir)
+
+    def history(self):
+        history = weblinkchecker.History(None, self.filename)
+        history.log = lambda url, *args: self.logged.append(url)
+        return history
+
+    def test_dead_and_alive(self):
+        history = self.history()
+        page = pywikibot.Page(self.site, u'K\xf6ln')
+        url = u'http://www.example.org/a'
+        history.setLinkDead(url, u'404 Not Found', page, 7)
+        # found again within an hour: no new report
+        history.setLinkDead(url, u'404 Not Found', page, 7)
+        self.assertTrue(url in history)
+        self.assertEqual([u'K\xf6ln'],
+                         [title for title, date, error in history.reports(url)])
+        history.save()
+        history = self.history()
+        self.assertEqual([url], list(history.deadLinks()))
+        self.assertEqual([], list(history.deadLinks(days=1)))
+        self.assertEqual([u'K\xf6ln'], list(history.pagesToRecheck()))
+        self.assertTrue(history.setLinkAlive(url))
+        self.assertFalse(history.setLinkAlive(url))
+        self.assertEqual([], list(history.pagesToRecheck()))
+        self.assertEqual([], self.logged)
+        history.save()
+
+    def test_import(self):
+        now = time.time()
+        datfile = open(os.path.join(self.tempdir, 'deadlinks-test.dat'), 'wb')
+        pickle.dump({
+            'http://old.example.org/': [(u'A', now - 10 * DAY, u'404'),
+                                        (u'B', now - 2 * DAY, u'404')],
+            'http://new.example.org/x': [(u'C', now - DAY / 2, u'500')],
+        }, datfile)
+        datfile.close()
+        history = self.history()
+        self.assertEqual(['http://old.example.org/'],
+                         list(history.deadLinks(days=7)))
+        self.assertEqual(['http://new.example.org/x'],
+                         list(history.deadLinks(host='new.example.org')))
+        self.assertEqual([u'A', u'B', u'C'], list(history.pagesToRecheck()))
+        self.assertEqual([u'A', u'B'], list(history.pagesToRecheck(days=1)))
+        # a link first found dead long ago is logged
+        history.setLinkDead('http://old.example.org/', u'404',
+                            pywikibot.Page(self.site, u'D'), 7)
+        self.assertEqual(['http://old.example.org/'], self.logged)
+        self.assertEqual(3, len(history.reports('http://old.example.org/')))
+        history.save()
+        # the pickle is imported only once
+        history = self.history()
+        history.setLinkAlive('http://old.example.org/')
+        history.save()
+        history = self.history()
+        self.assertEqual([u'C'], list(history.pagesToRecheck()))
+        history.save()
+
+    def test_chunks(self):
+        history = self.history()
+        history.chunkSize = 2
+        page = pywikibot.Page(self.site, u'Page')
+        urls = [u'http://example.org/%i' % i for i in range(5)]
+        for url in urls:
+            history.setLinkDead(url, u'404', page, 7)
+        self.assertEqual(urls, list(history.deadLinks()))
+        history.save()
+
+
+if __name__ == '__main__':
+    unittest.main()
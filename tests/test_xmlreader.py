@@ -6,8 +6,61 @@ import test_utils
 import xmlreader
 
 import os
+import re
+import shutil
+import tempfile
 path = os.path.dirname(os.path.abspath(__file__) )
 
+
+def _title_if_redirect(entry, suffix):
+    if entry.isredirect:
+        return entry.title + suffix
+
+
+def _make_dump(filename, count):
+    """Write a dump containing count copies of the pages of the test data"""
+    pages = []
+    for name in ('article-pear.xml', 'article-pyrus.xml'):
+        data = open(os.path.join(path, 'data', name)).read()
+        head = data[:data.index('<page>')]
+        pages += re.findall('<page>.*?</page>', data, re.DOTALL)
+    f = open(filename, 'w')
+    f.write(head)
+    for i in range(count):
+        page = pages[i % len(pages)]
+        f.write(re.sub('<title>(.*?)</title>', r'<title>\1 %d</title>' % i,
+                       page) + '\n')
+    f.write('</mediawiki>\n')
+    f.close()
+
+
+def _make_multistream(filename, count, pagesperstream):
+    """Turn a dump made by _make_dump into a multistream dump with index"""
+    import bz2
+    data = open(filename).read()
+    os.remove(filename)
+    head = data[:data.index('<page>')]
+    pages = re.findall('<page>.*?</page>\n', data, re.DOTALL)
+    # give each page its own id
+    pages = [re.sub('<id>.*?</id>', '<id>%d</id>' % (i + 1), page, 1)
+             for i, page in enumerate(pages)]
+    f = open(filename[:-4] + '-multistream.xml.bz2', 'wb')
+    index = []
+    f.write(bz2.compress(head))
+    for i in range(0, count, pagesperstream):
+        offset = f.tell()
+        for page in pages[i:i + pagesperstream]:
+            pageid = re.search('<id>(.*?)</id>', page).group(1)
+            title = re.search('<title>(.*?)</title>', page).group(1)
+            index.append('%d:%s:%s\n' % (offset, pageid, title))
+        f.write(bz2.compress(''.join(pages[i:i + pagesperstream])))
+    f.write(bz2.compress('</mediawiki>\n'))
+    f.close()
+    f = open(filename[:-4] + '-multistream-index.txt.bz2', 'wb')
+    f.write(bz2.compress(''.join(index)))
+    f.close()
+    return filename[:-4] + '-multistream.xml.bz2'
+
 class XmlReaderTestCase(unittest.TestCase):
     def test_XmlDumpAllRevs(self):
         pages = [r for r in xmlreader.XmlDump(path + "/data/article-pear.xml", allrevisions=True).parse()]
@@ -43,5 +96,66 @@ class XmlReaderTestCase(unittest.TestCase):
         self.assertEquals(4, len(pages))
         self.assertNotEquals("", pages[0].comment)
 
+    def test_XmlDumpParallel(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, 'dump.xml')
+            _make_dump(filename, 101)
+            dump = xmlreader.XmlDump(filename)
+            serial = [page.title for page in dump.parse()]
+            self.assertEquals(101, len(serial))
+            entries = list(dump.parallel_parse(_title_if_redirect,
+                                               args=(u'!',), processes=2,
+                                               chunksize=4096))
+            self.assertEquals([title + u'!' for title in serial[1::2]],
+                              entries)
+            entries = list(dump.parallel_parse(_title_if_redirect,
+                                               args=(u'!',), processes=2,
+                                               ordered=False,
+                                               chunksize=4096))
+            self.assertEquals(set(title + u'!' for title in serial[1::2]),
+                              set(entries))
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_XmlDumpMultistream(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, 'dump.xml')
+            _make_dump(filename, 25)
+            filename = _make_multistream(filename, 25, 4)
+            dump = xmlreader.XmlDump(filename)
+            serial = [page.title for page in dump.parse()]
+            self.assertEquals(25, len(serial))
+            self.assertEquals(serial[10:],
+                              [page.title
+                               for page in dump.parse_from(u'Pear 10')])
+            # the index is not kept in memory to find a page
+            self.assertEquals(None, dump.index._offsets)
+            found = dump.index.find([u'Pear 10', u'Missing'], [25])
+            self.assertEquals(set([u'Pear 10', '25']), set(found))
+            self.assertEquals(None, found['25'][1])
+            self.assertEquals(7, len(dump.index.offsets))
+            self.assertEquals(dump.index.end(found[u'Pear 10'][0]),
+                              found[u'Pear 10'][1])
+            self.assertEquals(serial[9:],
+                              [page.title
+                               for page in dump.parse_from(pageid=10)])
+            offsets = dump.index.offsets
+            self.assertEquals(serial[4:12],
+                              [page.title for page in
+                               dump.parse_range(offsets[1], offsets[3])])
+            self.assertEquals([u'Pyrus 3', u'Pear 20'],
+                              [page.title for page in
+                               dump.get_pages([u'Pear 20', u'Pyrus 3',
+                                               u'Missing'])])
+            entries = list(dump.parallel_parse(_title_if_redirect,
+                                               args=(u'!',), processes=2,
+                                               chunksize=1))
+            self.assertEquals([title + u'!' for title in serial[1::2]],
+                              entries)
+        finally:
+            shutil.rmtree(tempdir)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,14 +1,16 @@
 # -*- coding: utf-8  -*-
 """
 This bot is used for checking external links found at the wiki. It checks
-several pages at once, with a limit set by the config variable
-max_external_links, which defaults to 50.
+several links at once, with a limit set by the config variable
+max_external_links, which defaults to 50. Every link is checked only once
+per run, even if many pages link to it.
 
 The bot won't change any wiki pages, it will only report dead links such that
 people can fix or remove the links themselves.
 
-The bot will store all links found dead in a .dat file in the deadlinks
-subdirectory. To avoid the removing of links which are only temporarily
+The bot will store all links found dead in a .db file (an SQLite database) in
+the deadlinks subdirectory; the .dat file of older versions is imported once.
+To avoid the removing of links which are only temporarily
 unavailable, the bot ONLY reports links which were reported dead at least
 two times, with a time lag of at least one week. Such links will be logged to a
 .txt file in the deadlinks subdirectory.
@@ -22,7 +24,7 @@ feature, set report_dead_links_on_talk = True in your user-config.py, or
 specify "-talk" on the command line. Adding "-notalk" switches this off
 irrespective of the configuration variable.
 
-When a link is found alive, it will be removed from the .dat file.
+When a link is found alive, it will be removed from the .db file.
 
 These command line parameters can be used to specify which pages to work on:
 
@@ -68,6 +70,15 @@ max_external_links        - The maximum number of web pages that should be
                             is congested, and will then think that the page
                             is offline.
 
+weblink_host_connections  - The maximum number of connections to one web
+                            server (default: 2).
+
+weblink_host_delay        - Seconds to wait between two requests to the same
+                            web server (default: 1).
+
+weblink_timeout           - Seconds without an answer after which a link is
+                            considered dead (default: 30).
+
 report_dead_links_on_talk - If set to true, causes the script to report dead
                             links on the article's talk page if (and ONLY if)
                             the linked page has been unavailable at least two
@@ -103,6 +114,7 @@ Syntax examples:
 #
 __version__ = '$Id$'
 
+import os
 import re
 import codecs
 import pickle
@@ -112,6 +124,10 @@ import urlparse
 import urllib
 import threading
 import time
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
 
 import pywikibot
 from pywikibot import i18n
@@ -119,6 +135,8 @@ import config
 import pagegenerators
 import xmlreader
 import pywikibot.weblib
+from pywikibot import linkcheck
+from pywikibot.linkcheck import NotAnURLError
 
 docuReplacements = {
     '&params;': pagegenerators.parameterHelp
@@ -222,10 +240,6 @@ class XmlDumpPageGenerator:
                 pass
 
 
-class NotAnURLError(BaseException):
-    pass
-
-
 class LinkChecker(object):
     """
     Given a HTTP URL, tries to load the page from the Internet and checks if it
@@ -480,80 +494,151 @@ class LinkChecker(object):
             return alive, '%s %s' % (self.response.status, self.response.reason)
 
 
-class LinkCheckThread(threading.Thread):
-    """ A thread responsible for checking one URL. After checking the page, it
-    will die.
-
-    """
-    def __init__(self, page, url, history, HTTPignore):
-        threading.Thread.__init__(self)
-        self.page = page
-        self.url = url
-        self.history = history
-        # identification for debugging purposes
-        self.setName((u'%s - %s' % (page.title(), url)).encode('utf-8',
-                                                               'replace'))
-        self.HTTPignore = HTTPignore
-
-    def run(self):
-        linkChecker = LinkChecker(self.url, HTTPignore=self.HTTPignore)
-        try:
-            ok, message = linkChecker.check()
-        except NotAnURLError as e:
-            ok, message = False, i18n.twtranslate(pywikibot.getSite(),
-                                                  'weblinkchecker-badurl_msg',
-                                                  {'URL': self.url})
-
-        except:
-            pywikibot.output('Exception while processing URL %s in page %s'
-                             % (self.url, self.page.title()))
-            raise
-        if ok:
-            if self.history.setLinkAlive(self.url):
-                pywikibot.output('*Link to %s in [[%s]] is back alive.'
-                                 % (self.url, self.page.title()))
-        else:
-            pywikibot.output('*[[%s]] links to %s - %s.'
-                             % (self.page.title(), self.url, message))
-            self.history.setLinkDead(self.url, message, self.page, config.weblink_dead_days)
-
-
 class History:
-    """ Stores previously found dead links. The URLs are dictionary keys, and
-    values are lists of tuples where each tuple represents one time the URL was
-    found dead. Tuples have the form (title, date, error) where title is the
-    wiki page where the URL was found, date is an instance of time, and error is
-    a string with error code and message.
+    """ Stores previously found dead links in a SQLite database in the
+    deadlinks subdirectory. Every time a URL is found dead, a report
+    (title, date, error) is added, where title is the wiki page where the URL
+    was found, date is an instance of time, and error is a string with error
+    code and message. The URLs are indexed by their host and by the time
+    they were first and last found dead, the reports by their page.
 
-    We assume that the first element in the list represents the first time we
-    found this dead link, and the last element represents the last time.
+    The first report of a URL represents the first time we found this dead
+    link, and the last report the last time.
 
-    Example:
-
-    dict = {
-        'http://www.example.org/page': [
-            ('WikiPageTitle', DATE, '404: File not found'),
-            ('WikiPageName2', DATE, '404: File not found'),
-        ]
+    Everything is written as soon as it is found, so the history never has to
+    be loaded or saved as a whole. A pickled history of older versions is
+    imported once.
 
     """
 
-    def __init__(self, reportThread):
+    # number of rows fetched at once by the queries
+    chunkSize = 1000
+
+    def __init__(self, reportThread, filename=None):
         self.reportThread = reportThread
         self.site = pywikibot.getSite()
-        self.semaphore = threading.Semaphore()
-        self.datfilename = pywikibot.config.datafilepath(
-            'deadlinks', 'deadlinks-%s-%s.dat' % (self.site.family.name, self.site.lang))
+        self.lock = threading.Lock()
+        if filename is None:
+            filename = pywikibot.config.datafilepath(
+                'deadlinks', 'deadlinks-%s-%s.db' % (self.site.family.name,
+                                                     self.site.lang))
         # Count the number of logged links, so that we can insert captions
         # from time to time
         self.logCount = 0
+        if sqlite3 is None:
+            raise pywikibot.Error(u'The dead link history needs the sqlite3 '
+                                  u'module.')
+        self.db = sqlite3.connect(filename, timeout=30,
+                                  isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            if self.db.execute('PRAGMA user_version').fetchone()[0] == 0:
+                self._create()
+                self._importPickle(os.path.splitext(filename)[0] + '.dat')
+                self.db.execute('PRAGMA user_version = 1')
+        except:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    def _create(self):
+        self.db.execute('CREATE TABLE links (url TEXT PRIMARY KEY, '
+                        'host TEXT, first REAL, last REAL)')
+        self.db.execute('CREATE INDEX links_host ON links (host)')
+        self.db.execute('CREATE INDEX links_first ON links (first)')
+        self.db.execute('CREATE TABLE reports (url TEXT, page TEXT, '
+                        'date REAL, error TEXT)')
+        self.db.execute('CREATE INDEX reports_url ON reports (url, date)')
+        self.db.execute('CREATE INDEX reports_page ON reports (page)')
+
+    def _importPickle(self, filename):
+        """Import the pickled history of older versions."""
         try:
-            datfile = open(self.datfilename, 'r')
-            self.historyDict = pickle.load(datfile)
+            datfile = open(filename, 'rb')
+        except IOError:
+            return
+        try:
+            try:
+                historyDict = pickle.load(datfile)
+            except Exception:
+                # history dump broken, nothing to import then
+                return
+        finally:
             datfile.close()
-        except (IOError, EOFError):
-            # no saved history exists yet, or history dump broken
-            self.historyDict = {}
+        pywikibot.output(u'Importing dead links from %s'
+                         % config.shortpath(filename))
+        for url, reports in historyDict.iteritems():
+            if not reports:
+                continue
+            self.db.execute('INSERT OR REPLACE INTO links VALUES (?, ?, ?, ?)',
+                            (url, self._host(url), reports[0][1],
+                             reports[-1][1]))
+            self.db.executemany('INSERT INTO reports VALUES (?, ?, ?, ?)',
+                                [(url, title, date, error)
+                                 for title, date, error in reports])
+
+    def _host(self, url):
+        try:
+            return urlparse.urlsplit(url).hostname or u''
+        except ValueError:
+            return u''
+
+    def _query(self, sql, args=()):
+        self.lock.acquire()
+        try:
+            return self.db.execute(sql, args).fetchall()
+        finally:
+            self.lock.release()
+
+    def _chunks(self, sql, args=()):
+        """Yield the first column of the rows of sql, ordered by it.
+
+        sql must have a condition "column > ?" for the last value of the
+        previous chunk, and end with ORDER BY that column and LIMIT.
+
+        """
+        last = u''
+        while True:
+            rows = self._query(sql, args + (last, self.chunkSize))
+            for row in rows:
+                yield row[0]
+            if len(rows) < self.chunkSize:
+                return
+            last = rows[-1][0]
+
+    def __contains__(self, url):
+        return bool(self._query('SELECT 1 FROM links WHERE url = ?', (url, )))
+
+    def reports(self, url):
+        """Return the list of (title, date, error) reports for url."""
+        return [tuple(row) for row in self._query(
+            'SELECT page, date, error FROM reports WHERE url = ? '
+            'ORDER BY date', (url, ))]
+
+    def deadLinks(self, days=0, host=None):
+        """Yield the URLs first found dead more than days days ago.
+
+        If host is given, only the URLs on that host are yielded.
+
+        """
+        before = time.time() - 60 * 60 * 24 * days
+        if host is None:
+            return self._chunks('SELECT url FROM links WHERE first < ? '
+                                'AND url > ? ORDER BY url LIMIT ?',
+                                (before, ))
+        return self._chunks('SELECT url FROM links WHERE host = ? '
+                            'AND first < ? AND url > ? ORDER BY url LIMIT ?',
+                            (host, before))
+
+    def pagesToRecheck(self, days=0):
+        """Yield the titles of the pages with links found dead more than
+        days days ago, in alphabetical order."""
+        before = time.time() - 60 * 60 * 24 * days
+        return self._chunks('SELECT DISTINCT reports.page FROM reports '
+                            'JOIN links ON links.url = reports.url '
+                            'WHERE links.first < ? AND reports.page > ? '
+                            'ORDER BY reports.page LIMIT ?', (before, ))
 
     def log(self, url, error, containingPage, archiveURL):
         """
@@ -563,7 +648,7 @@ class History:
             errorReport = u'* %s ([%s archive])\n' % (url, archiveURL)
         else:
             errorReport = u'* %s\n' % url
-        for (pageTitle, date, error) in self.historyDict[url]:
+        for (pageTitle, date, error) in self.reports(url):
             # ISO 8601 formulation
             isoDate = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(date))
             errorReport += "** In [[%s]] on %s, %s\n" % (pageTitle, isoDate,
@@ -587,54 +672,75 @@ class History:
 
     def setLinkDead(self, url, error, page, weblink_dead_days):
         """
-        Adds the fact that the link was found dead to the .dat file.
+        Adds the fact that the link was found dead to the history.
         """
-        self.semaphore.acquire()
         now = time.time()
-        if url in self.historyDict:
-            timeSinceFirstFound = now - self.historyDict[url][0][1]
-            timeSinceLastFound = now - self.historyDict[url][-1][1]
-            # if the last time we found this dead link is less than an hour
-            # ago, we won't save it in the history this time.
-            if timeSinceLastFound > 60 * 60:
-                self.historyDict[url].append((page.title(), now, error))
-            # if the first time we found this link longer than x day ago
-            # (default is a week), it should probably be fixed or removed.
-            # We'll list it in a file so that it can be removed manually.
-            if timeSinceFirstFound > 60 * 60 * 24 * weblink_dead_days:
-                # search for archived page
-                archiveURL = pywikibot.weblib.getInternetArchiveURL(self.site, url)
-                if archiveURL is None:
-                    archiveURL = pywikibot.weblib.getWebCitationURL(self.site, url)
-                self.log(url, error, page, archiveURL)
-        else:
-            self.historyDict[url] = [(page.title(), now, error)]
-        self.semaphore.release()
+        report = (url, page.title(), now, error)
+        self.lock.acquire()
+        try:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.db.execute('SELECT first, last FROM links '
+                                      'WHERE url = ?', (url, )).fetchone()
+                if row is None:
+                    self.db.execute('INSERT INTO links VALUES (?, ?, ?, ?)',
+                                    (url, self._host(url), now, now))
+                    self.db.execute('INSERT INTO reports VALUES (?, ?, ?, ?)',
+                                    report)
+                # if the last time we found this dead link is less than an
+                # hour ago, we won't save it in the history this time.
+                elif now - row[1] > 60 * 60:
+                    self.db.execute('INSERT INTO reports VALUES (?, ?, ?, ?)',
+                                    report)
+                    self.db.execute('UPDATE links SET last = ? WHERE url = ?',
+                                    (now, url))
+            except:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+        finally:
+            self.lock.release()
+        # if the first time we found this link longer than x day ago
+        # (default is a week), it should probably be fixed or removed.
+        # We'll list it in a file so that it can be removed manually.
+        if row is not None and now - row[0] > 60 * 60 * 24 * weblink_dead_days:
+            # search for archived page
+            archiveURL = pywikibot.weblib.getInternetArchiveURL(self.site, url)
+            if archiveURL is None:
+                archiveURL = pywikibot.weblib.getWebCitationURL(self.site, url)
+            self.log(url, error, page, archiveURL)
 
     def setLinkAlive(self, url):
         """
-        If the link was previously found dead, removes it from the .dat file
+        If the link was previously found dead, removes it from the history
         and returns True, else returns False.
         """
-        if url in self.historyDict:
-            self.semaphore.acquire()
-            try:
-                del self.historyDict[url]
-            except KeyError:
-                # Not sure why this can happen, but I guess we can ignore this.
-                pass
-            self.semaphore.release()
-            return True
-        else:
+        if url not in self:
             return False
+        self.lock.acquire()
+        try:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                self.db.execute('DELETE FROM links WHERE url = ?', (url, ))
+                self.db.execute('DELETE FROM reports WHERE url = ?', (url, ))
+            except:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+        finally:
+            self.lock.release()
+        return True
 
     def save(self):
         """
-        Saves the .dat file to disk.
+        Closes the database. Everything is saved as soon as it is found, so
+        there is nothing left to write.
         """
-        datfile = open(self.datfilename, 'w')
-        pickle.dump(self.historyDict, datfile)
-        datfile.close()
+        self.lock.acquire()
+        try:
+            self.db.close()
+        finally:
+            self.lock.release()
 
 
 class DeadLinkReportThread(threading.Thread):
@@ -736,8 +842,8 @@ class DeadLinkReportThread(threading.Thread):
 
 class WeblinkCheckerRobot:
     """
-    Robot which will use several LinkCheckThreads at once to search for dead
-    weblinks on pages provided by the given generator.
+    Robot which will check many links at once to search for dead weblinks on
+    pages provided by the given generator.
 
     """
     def __init__(self, generator, HTTPignore=[]):
@@ -752,10 +858,21 @@ class WeblinkCheckerRobot:
             reportThread = None
         self.history = History(reportThread)
         self.HTTPignore = HTTPignore
+        self.engine = linkcheck.LinkCheckEngine(
+            connections=config.max_external_links,
+            hostConnections=config.weblink_host_connections,
+            hostDelay=config.weblink_host_delay,
+            timeout=config.weblink_timeout,
+            HTTPignore=HTTPignore)
+        # links of many pages may wait for their servers; limit them so that
+        # the bot doesn't run out of memory
+        self.maxPending = config.max_external_links * 100
 
     def run(self):
         for page in self.generator:
             self.checkLinksIn(page)
+        # check the remaining links
+        self.engine.run()
 
     def checkLinksIn(self, page):
         try:
@@ -769,38 +886,38 @@ class WeblinkCheckerRobot:
                 if ignoreR.match(url):
                     ignoreUrl = True
             if not ignoreUrl:
-                # Limit the number of threads started at the same time. Each
-                # thread will check one page, then die.
-                while threading.activeCount() >= config.max_external_links:
-                    # wait 100 ms
-                    time.sleep(0.1)
-                thread = LinkCheckThread(page, url, self.history,
-                                         self.HTTPignore)
-                # thread dies when program terminates
-                thread.setDaemon(True)
-                thread.start()
+                # check links until there is room for this one
+                self.engine.run(self.maxPending - 1)
+                try:
+                    self.engine.check(url,
+                                      lambda ok, message, url=url:
+                                      self.report(page, url, ok, message))
+                except NotAnURLError:
+                    self.report(page, url, False,
+                                i18n.twtranslate(pywikibot.getSite(),
+                                                 'weblinkchecker-badurl_msg',
+                                                 {'URL': url}))
+
+    def report(self, page, url, ok, message):
+        """Record the result of checking url, linked from page."""
+        if ok:
+            if self.history.setLinkAlive(url):
+                pywikibot.output('*Link to %s in [[%s]] is back alive.'
+                                 % (url, page.title()))
+        else:
+            pywikibot.output('*[[%s]] links to %s - %s.'
+                             % (page.title(), url, message))
+            self.history.setLinkDead(url, message, page,
+                                     config.weblink_dead_days)
 
 
 def RepeatPageGenerator():
     history = History(None)
-    pageTitles = set()
-    for (key, value) in history.historyDict.iteritems():
-        for entry in value:
-            pageTitle = entry[0]
-            pageTitles.add(pageTitle)
-    pageTitles = list(pageTitles)
-    pageTitles.sort()
-    for pageTitle in pageTitles:
-        page = pywikibot.Page(pywikibot.getSite(), pageTitle)
-        yield page
-
-
-def countLinkCheckThreads():
-    i = 0
-    for thread in threading.enumerate():
-        if isinstance(thread, LinkCheckThread):
-            i += 1
-    return i
+    try:
+        for pageTitle in history.pagesToRecheck():
+            yield pywikibot.Page(pywikibot.getSite(), pageTitle)
+    finally:
+        history.save()
 
 
 def check(url):
@@ -878,23 +995,19 @@ def main():
         try:
             bot.run()
         finally:
-            waitTime = 0
-            # Don't wait longer than 30 seconds for threads to finish.
-            while countLinkCheckThreads() > 0 and waitTime < 30:
+            if bot.engine.pending():
+                pywikibot.output(u"Waiting for remaining %i links to be "
+                                 u"checked, please wait..."
+                                 % bot.engine.pending())
+                # Don't wait longer than 30 seconds for the checks to finish.
                 try:
-                    pywikibot.output(u"Waiting for remaining %i threads to "
-                                     u"finish, please wait..."
-                                     % countLinkCheckThreads())
-                    # wait 1 second
-                    time.sleep(1)
-                    waitTime += 1
+                    bot.engine.run(timeout=30)
                 except KeyboardInterrupt:
                     pywikibot.output(u'Interrupted.')
-                    break
-            if countLinkCheckThreads() > 0:
-                pywikibot.output(u'Remaining %i threads will be killed.'
-                                 % countLinkCheckThreads())
-                # Threads will die automatically because they are daemonic.
+            if bot.engine.pending():
+                pywikibot.output(u'Remaining %i links will not be checked.'
+                                 % bot.engine.pending())
+            bot.engine.close()
             if bot.history.reportThread:
                 bot.history.reportThread.shutdown()
                 # wait until the report thread is shut down; the user can
@@ -905,7 +1018,6 @@ def main():
                 except KeyboardInterrupt:
                     pywikibot.output(u'Report thread interrupted.')
                     bot.history.reportThread.kill()
-            pywikibot.output(u'Saving history...')
             bot.history.save()
     else:
         pywikibot.showHelp()
@@ -73,6 +73,10 @@ of the text unless otherwise noted --
 
     replaceExcept: replace all instances of 'old' by 'new', skipping any
         instances of 'old' within comments and other special text blocks
+    replaceExceptMulti: like replaceExcept, but do a list of replacements
+        with a MultipleReplacer
+    MultipleReplacer: applies many replacements to texts, skipping the ones
+        which can't match
     removeDisabledParts: remove text portions exempt from wiki markup
     isDisabled(text,index): return boolean indicating whether text[index] is
         within a non-wiki-markup section of text
@@ -134,11 +138,9 @@ __version__ = '$Id$'
 
 import os
 import sys
-import cookielib
 import httplib
 import urllib
 import urllib2
-import pprint
 import socket
 import traceback
 import time
@@ -152,17 +154,12 @@ try:
     from hashlib import md5
 except ImportError:  # Python 2.4 compatibility
     from md5 import new as md5
-import xml.sax
-import xml.sax.handler
 import htmlentitydefs
 import warnings
 import unicodedata
-import xmlreader
 import externals  # noqa: allow imports from externals
-from BeautifulSoup import BeautifulSoup, BeautifulStoneSoup, SoupStrainer
 import weakref
 import logging
-import logging.handlers
 try:
     import json
 except ImportError:
@@ -173,7 +170,10 @@ from pywikibot.support import *
 import config
 import login
 import query
+from pywikibot import sitecache
+from pywikibot.tools import LRUCache
 from pywikibot import version
+from pywikibot import putqueue
 
 # Check Unicode support (is this a wide or narrow python build?)
 # See http://www.python.org/doc/peps/pep-0261/
@@ -192,7 +192,10 @@ INPUT = 25
 # Format string for the default user agent.
 USER_AGENT_FORMAT = '%(script)s/r%(versionrev)s Pywikipediabot/1.0'
 
-SaxError = xml.sax._exceptions.SAXParseException
+# cookielib, pprint, xml.sax, xmlreader, logging.handlers and BeautifulSoup
+# are imported where they are used, as most bots don't need them and they
+# slow down the start of every script.
+from xml.sax._exceptions import SAXParseException as SaxError
 
 # Pre-compile re expressions
 reNamespace = re.compile("^(.+?) *: *(.*)$")
@@ -203,6 +206,171 @@ Rwatchlist = re.compile(r"<input tabindex='[\d]+' type='checkbox' "
 Rlink = re.compile(r'\[\[(?P<title>[^\]\|\[]*)(\|[^\]]*)?\]\]')
 
 
+# Titles which may contain entities, url-encoded or non-ASCII characters
+_complexTitleR = re.compile(u'[^\x00-\x7f]|[&%]')
+
+
+def _parseTitle(site, title, insite, defaultNamespace):
+    """Split title into its parts like the Page constructor does.
+
+    Return a tuple (site, namespace, title, section), where site is None
+    if it is the given site. The returned title is the normalized title
+    including namespace and section.
+
+    """
+    origsite = site
+    if not _complexTitleR.search(title):
+        # plain ASCII titles don't need to be decoded or normalized
+        t = unicode(title).replace(u"_", u" ")
+        while u"  " in t:
+            t = t.replace(u"  ", u" ")
+        t = t.strip()
+    else:
+        # Clean up the name, it can come from anywhere.
+        # Convert HTML entities to unicode
+        t = html2unicode(title)
+
+        # Convert URL-encoded characters to unicode
+        # Sometimes users copy the link to a site from one to another.
+        # Try both the source site and the destination site to decode.
+        try:
+            t = url2unicode(t, site=insite, site2=site)
+        except UnicodeDecodeError:
+            raise InvalidTitle(u'Bad page title : %s' % t)
+
+        # Normalize unicode string to a NFC (composed) format to allow
+        # proper string comparisons. According to
+        # http://svn.wikimedia.org/viewvc/mediawiki/branches/REL1_6/phase3/includes/normal/UtfNormal.php?view=markup
+        # the mediawiki code normalizes everything to NFC, not NFKC
+        # (which might result in information loss).
+        t = unicodedata.normalize('NFC', t)
+
+        if u'\ufffd' in t:
+            raise InvalidTitle("Title contains illegal char (\\uFFFD)")
+
+        # Replace underscores by spaces
+        t = t.replace(u"_", u" ")
+        # replace multiple spaces a single space
+        while u"  " in t:
+            t = t.replace(u"  ", u" ")
+        # Strip spaces at both ends
+        t = t.strip()
+        # Remove left-to-right and right-to-left markers.
+        t = t.replace(u'\u200e', '').replace(u'\u200f', '')
+
+    if t.startswith(':'):
+        t = t[1:]
+        prefix = True
+    else:
+        prefix = False
+    namespace = defaultNamespace
+
+    #
+    # This code was adapted from Title.php : secureAndSplit()
+    #
+    # Namespace or interwiki prefix
+    while True:
+        m = reNamespace.match(t)
+        if not m:
+            # leading colon implies main namespace instead of default
+            if t.startswith(':'):
+                t = t[1:]
+                namespace = 0
+            elif prefix:
+                namespace = 0
+            else:
+                namespace = defaultNamespace
+            break
+        prefix = False
+        p = m.group(1)
+        lowerNs = p.lower()
+        ns = site.getNamespaceIndex(lowerNs)
+        if ns:
+            t = m.group(2)
+            namespace = ns
+            break
+
+        if lowerNs in site.family.langs.keys():
+            # Interwiki link
+            t = m.group(2)
+
+            # Redundant interwiki prefix to the local wiki
+            if lowerNs == site.lang:
+                if t == '':
+                    raise Error("Can't have an empty self-link")
+            else:
+                site = getSite(lowerNs, site.family.name)
+                if t == '':
+                    t = site.mediawiki_message('Mainpage')
+
+        elif lowerNs in site.family.get_known_families(
+                site=site):
+            if site.family.get_known_families(
+                    site=site)[lowerNs] == site.family.name:
+                t = m.group(2)
+            else:
+                # This page is from a different family
+                if verbose:
+                    output(u"Target link '%s' has different family '%s'"
+                           % (title, lowerNs))
+                if site.family.name in ['commons', 'meta']:
+                    #When the source wiki is commons or meta,
+                    #w:page redirects you to w:en:page
+                    otherlang = 'en'
+                else:
+                    otherlang = site.lang
+                familyName = site.family.get_known_families(
+                    site=site)[lowerNs]
+                if familyName in ['commons', 'meta']:
+                    otherlang = familyName
+                try:
+                    site = getSite(otherlang, familyName)
+                except ValueError:
+                    raise NoPage(u"%s is not a local page on %s, and "
+                                 u"the %s family is not supported by "
+                                 u"PyWikipediaBot!"
+                                 % (title, site, familyName))
+                t = m.group(2)
+        else:
+            # If there's no recognized interwiki or namespace,
+            # then let the colon expression be part of the title.
+            break
+
+    if not t:
+        raise InvalidTitle(u"Invalid title '%s'" % title)
+
+    sectionStart = t.find(u'#')
+    # But maybe there are magic words like {{#time|}}
+    # TODO: recognize magic word and templates inside links
+    # see http://la.wikipedia.org/w/index.php?title=997_Priska&diff=prev&oldid=1038880
+    if sectionStart > 0:
+        # Categories does not have sections.
+        if namespace == 14:
+            raise InvalidTitle(u"Invalid section in category '%s'" % t)
+        else:
+            t, sec = t.split(u'#', 1)
+            section = sec.lstrip() or None
+            t = t.rstrip()
+    elif sectionStart == 0:
+        raise InvalidTitle(u"Invalid title starting with a #: '%s'" % t)
+    else:
+        section = None
+
+    if t:
+        if not site.nocapitalize:
+            t = t[:1].upper() + t[1:]
+
+    # reassemble the title from its parts
+    if namespace != 0:
+        t = u'%s:%s' % (site.namespace(namespace), t)
+    if section:
+        t += u'#' + section
+
+    if site is origsite:
+        site = None
+    return site, namespace, t, section
+
+
 # Page objects (defined here) represent the page itself, including its contents.
 class Page(object):
     """Page: A MediaWiki page
@@ -306,164 +474,22 @@ class Page(object):
 
             if site is None or isinstance(site, basestring):
                 site = getSite(site)
-            self._site = site
 
             if not insite:
                 insite = site
 
-            # Clean up the name, it can come from anywhere.
-            # Convert HTML entities to unicode
-            t = html2unicode(title)
-
-            # Convert URL-encoded characters to unicode
-            # Sometimes users copy the link to a site from one to another.
-            # Try both the source site and the destination site to decode.
-            try:
-                t = url2unicode(t, site=insite, site2=site)
-            except UnicodeDecodeError:
-                raise InvalidTitle(u'Bad page title : %s' % t)
-
-            # Normalize unicode string to a NFC (composed) format to allow
-            # proper string comparisons. According to
-            # http://svn.wikimedia.org/viewvc/mediawiki/branches/REL1_6/phase3/includes/normal/UtfNormal.php?view=markup
-            # the mediawiki code normalizes everything to NFC, not NFKC
-            # (which might result in information loss).
-            t = unicodedata.normalize('NFC', t)
-
-            if u'\ufffd' in t:
-                raise InvalidTitle("Title contains illegal char (\\uFFFD)")
-
-            # Replace underscores by spaces
-            t = t.replace(u"_", u" ")
-            # replace multiple spaces a single space
-            while u"  " in t:
-                t = t.replace(u"  ", u" ")
-            # Strip spaces at both ends
-            t = t.strip()
-            # Remove left-to-right and right-to-left markers.
-            t = t.replace(u'\u200e', '').replace(u'\u200f', '')
-
-            if t.startswith(':'):
-                t = t[1:]
-                prefix = True
-            else:
-                prefix = False
-            self._namespace = defaultNamespace
-
-            #
-            # This code was adapted from Title.php : secureAndSplit()
-            #
-            # Namespace or interwiki prefix
-            while True:
-                m = reNamespace.match(t)
-                if not m:
-                    # leading colon implies main namespace instead of default
-                    if t.startswith(':'):
-                        t = t[1:]
-                        self._namespace = 0
-                    elif prefix:
-                        self._namespace = 0
-                    else:
-                        self._namespace = defaultNamespace
-                    break
-                prefix = False
-                p = m.group(1)
-                lowerNs = p.lower()
-                ns = self._site.getNamespaceIndex(lowerNs)
-                if ns:
-                    t = m.group(2)
-                    self._namespace = ns
-                    break
-
-                if lowerNs in self._site.family.langs.keys():
-                    # Interwiki link
-                    t = m.group(2)
-
-                    # Redundant interwiki prefix to the local wiki
-                    if lowerNs == self._site.lang:
-                        if t == '':
-                            raise Error("Can't have an empty self-link")
-                    else:
-                        self._site = getSite(lowerNs, self._site.family.name)
-                        if t == '':
-                            t = self._site.mediawiki_message('Mainpage')
-
-                elif lowerNs in self._site.family.get_known_families(
-                        site=self._site):
-                    if self._site.family.get_known_families(
-                            site=self._site)[lowerNs] == self._site.family.name:
-                        t = m.group(2)
-                    else:
-                        # This page is from a different family
-                        if verbose:
-                            output(u"Target link '%s' has different family '%s'"
-                                   % (title, lowerNs))
-                        if self._site.family.name in ['commons', 'meta']:
-                            #When the source wiki is commons or meta,
-                            #w:page redirects you to w:en:page
-                            otherlang = 'en'
-                        else:
-                            otherlang = self._site.lang
-                        familyName = self._site.family.get_known_families(
-                            site=self._site)[lowerNs]
-                        if familyName in ['commons', 'meta']:
-                            otherlang = familyName
-                        try:
-                            self._site = getSite(otherlang, familyName)
-                        except ValueError:
-                            raise NoPage(u"%s is not a local page on %s, and "
-                                         u"the %s family is not supported by "
-                                         u"PyWikipediaBot!"
-                                         % (title, self._site, familyName))
-                        t = m.group(2)
-                else:
-                    # If there's no recognized interwiki or namespace,
-                    # then let the colon expression be part of the title.
-                    break
-
-            if not t:
-                raise InvalidTitle(u"Invalid title '%s'" % title)
-
-            sectionStart = t.find(u'#')
-            # But maybe there are magic words like {{#time|}}
-            # TODO: recognize magic word and templates inside links
-            # see http://la.wikipedia.org/w/index.php?title=997_Priska&diff=prev&oldid=1038880
-            if sectionStart > 0:
-                # Categories does not have sections.
-                if self._namespace == 14:
-                    raise InvalidTitle(u"Invalid section in category '%s'" % t)
-                else:
-                    t, sec = t.split(u'#', 1)
-                    self._section = sec.lstrip() or None
-                    t = t.rstrip()
-            elif sectionStart == 0:
-                raise InvalidTitle(u"Invalid title starting with a #: '%s'" % t)
-            else:
-                self._section = None
-
-            if t:
-                if not self._site.nocapitalize:
-                    t = t[:1].upper() + t[1:]
-
-            # reassemble the title from its parts
-            if self._namespace != 0:
-                t = u'%s:%s' % (self._site.namespace(self._namespace), t)
-            if self._section:
-                t += u'#' + self._section
-
-            self._title = t
-            self.editRestriction = None
-            self.moveRestriction = None
-            self._permalink = None
-            self._userName = None
-            self._comment = None
-            self._ipedit = None
-            self._editTime = None
-            self._startTime = '0'
-            self._page_id = None
-            # For the Flagged Revisions MediaWiki extension
-            self._revisionId = None
-            self._deletedRevs = None
+            # parsing titles is expensive, so the results are cached
+            key = (site, insite is not site and insite or None, title,
+                   defaultNamespace)
+            parsed = _titleCache.get(key)
+            if parsed is None:
+                parsed = _parseTitle(site, title, insite, defaultNamespace)
+                _titleCache[key] = parsed
+            self._site = parsed[0] or site
+            self._namespace = parsed[1]
+            self._title = parsed[2]
+            self._section = parsed[3]
+            self._initAttributes()
         except NoSuchSite:
             raise
         except:
@@ -475,6 +501,20 @@ class Page(object):
                 )
             raise
 
+    def _initAttributes(self):
+        self.editRestriction = None
+        self.moveRestriction = None
+        self._permalink = None
+        self._userName = None
+        self._comment = None
+        self._ipedit = None
+        self._editTime = None
+        self._startTime = '0'
+        self._page_id = None
+        # For the Flagged Revisions MediaWiki extension
+        self._revisionId = None
+        self._deletedRevs = None
+
     @property
     def site(self):
         """Return the Site object for the wiki on which this Page resides."""
@@ -1816,6 +1856,18 @@ class Page(object):
                 yield s
             return
 
+        if self.site().versionnumber() >= 24:
+            if not internal:
+                output(u'Getting references to %s via API...'
+                       % self.title(asLink=True))
+            for page, ref in getallReferences(self.site(), [self],
+                                              follow_redirects,
+                                              withTemplateInclusion,
+                                              onlyTemplateInclusion,
+                                              redirectsOnly):
+                yield ref
+            return
+
         params = {
             'action': 'query',
             'list': [],
@@ -1847,6 +1899,7 @@ class Page(object):
                 params['eilimit'] = 500
 
         allDone = False
+        refPages = set()
 
         while not allDone:
             if not internal:
@@ -1860,7 +1913,6 @@ class Page(object):
             else:
                 data = data[0]
 
-            refPages = set()
             for blp in data:
                 pg = Page(self.site(), blp['title'], defaultNamespace=blp['ns'])
                 if pg in refPages:
@@ -1904,6 +1956,7 @@ class Page(object):
                          onlyTemplateInclusion=False, redirectsOnly=False):
         """Yield all pages that link to the page.
         """
+        from BeautifulSoup import BeautifulSoup, SoupStrainer
         # Temporary bug-fix while researching more robust solution:
         if config.special_page_limit > 999:
             config.special_page_limit = 999
@@ -2104,32 +2157,30 @@ class Page(object):
 
     def put_async(self, newtext,
                   comment=None, watchArticle=None, minorEdit=True, force=False,
-                  callback=None):
+                  callback=None, priority=0):
         """Put page on queue to be saved to wiki asynchronously.
 
         Asynchronous version of put (takes the same arguments), which places
-        pages on a queue to be saved by a daemon thread. All arguments  are
-        the same as for .put(), except --
+        pages on a queue to be saved by a daemon thread. Each site has a
+        thread of its own, so pages of different sites are saved at the same
+        time. All arguments are the same as for .put(), except --
 
         callback: a callable object that will be called after the page put
                   operation; this object must take two arguments:
                   (1) a Page object, and (2) an exception instance, which
                   will be None if the page was saved successfully.
+        priority: pages of the same site with a higher priority are saved
+                  first.
 
         The callback is intended to be used by bots that need to keep track
-        of which saves were successful.
+        of which saves were successful. The returned PutRequest may be used
+        to wait for the page to be saved.
 
         """
-        try:
-            page_put_queue.mutex.acquire()
-            try:
-                _putthread.start()
-            except (AssertionError, RuntimeError):
-                pass
-        finally:
-            page_put_queue.mutex.release()
-        page_put_queue.put((self, newtext, comment, watchArticle, minorEdit,
-                            force, callback))
+        request = putqueue.PutRequest(self, newtext, comment, watchArticle,
+                                      minorEdit, force, callback, priority)
+        put_scheduler.put(request)
+        return request
 
     def put(self, newtext, comment=None, watchArticle=None, minorEdit=True,
             force=False, sysop=False, botflag=True, maxTries=-1):
@@ -2281,7 +2332,6 @@ class Page(object):
                                     botflag, maxTries)
 
         retry_attempt = 0
-        retry_delay = 1
         dblagged = False
         params = {
             'action': 'edit',
@@ -2334,7 +2384,7 @@ class Page(object):
             # Check whether we are not too quickly after the previous
             # putPage, and wait a bit until the interval is acceptable
             if not dblagged:
-                put_throttle()
+                siteThrottle(self.site(), write=True)()
             # Which web-site host are we submitting to?
             if newPage:
                 output(u'Creating page %s via API' % self.title(asLink=True))
@@ -2353,23 +2403,16 @@ class Page(object):
             except ServerError:
                 exception(tb=True)
                 retry_attempt += 1
-                if retry_attempt > config.maxretries:
+                if not retry_policy.retry(
+                        self.site(), retry_attempt,
+                        u'Got a server error when putting %s.'
+                        % self.title(asLink=True)):
                     raise
-                output(u'Got a server error when putting %s; will retry in %i '
-                       u'minute%s.' % (self.title(asLink=True), retry_delay,
-                                       retry_delay != 1 and "s" or ""))
-                time.sleep(60 * retry_delay)
-                retry_delay *= 2
-                if retry_delay > 30:
-                    retry_delay = 30
                 continue
             except ValueError:  # API result cannot decode
-                output(u"Server error encountered; will retry in %i minute%s."
-                       % (retry_delay, retry_delay != 1 and "s" or ""))
-                time.sleep(60 * retry_delay)
-                retry_delay *= 2
-                if retry_delay > 30:
-                    retry_delay = 30
+                retry_attempt += 1
+                retry_policy.wait(self.site(), retry_attempt,
+                                  u"Server error encountered.")
                 continue
             # If it has gotten this far then we should reset dblagged
             dblagged = False
@@ -2377,12 +2420,9 @@ class Page(object):
             self.site().checkBlocks(sysop=sysop)
             # A second text area means that an edit conflict has occured.
             if response.code == 500:
-                output(u"Server error encountered; will retry in %i minute%s."
-                       % (retry_delay, retry_delay != 1 and "s" or ""))
-                time.sleep(60 * retry_delay)
-                retry_delay *= 2
-                if retry_delay > 30:
-                    retry_delay = 30
+                retry_attempt += 1
+                retry_policy.wait(self.site(), retry_attempt,
+                                  u"Server error encountered.")
                 continue
             if 'error' in data:
                 # All available error key in edit mode: (from ApiBase.php)
@@ -2415,15 +2455,20 @@ class Page(object):
                 errorCode = data['error']['code']
                 #cannot handle longpageerror and PageNoSave yet
                 if errorCode == 'maxlag' or response.code == 503:
-                    # server lag; wait for the lag time and retry
-                    lagpattern = re.compile(
-                        r'Waiting for [\w. ]+: (?P<lag>\d+)(?:\.\d+)? seconds? lagged')
-                    lag = lagpattern.search(data['error']['info'])
-                    timelag = int(lag.group("lag"))
-                    output(u"Pausing %d seconds due to database server lag."
-                           % min(timelag, 300))
+                    # server lag; wait as long as the server asks for, or
+                    # for the lag time, and retry
+                    retryafter = None
+                    if hasattr(response, 'info'):
+                        retryafter = parseRetryAfter(
+                            response.info().get('Retry-After'))
+                    if retryafter is None:
+                        retryafter = parseLag(data['error']['info'])
+                    if retryafter is not None:
+                        retryafter = min(retryafter, 300)
+                    retry_attempt += 1
                     dblagged = True
-                    time.sleep(min(timelag, 300))
+                    retry_policy.wait(self.site(), retry_attempt,
+                                      u"Database server lag.", retryafter)
                     continue
                 elif errorCode == 'editconflict':
                     # 'editconflict':"Edit conflict detected",
@@ -2456,13 +2501,10 @@ class Page(object):
                     continue
                 elif errorCode == 'readonly':
                     # 'readonly':"The wiki is currently in read-only mode"
-                    output(u"The database is currently locked for write access;"
-                           u"will retry in %i minute%s."
-                           % (retry_delay, retry_delay != 1 and "s" or ""))
-                    time.sleep(60 * retry_delay)
-                    retry_delay *= 2
-                    if retry_delay > 30:
-                        retry_delay = 30
+                    retry_attempt += 1
+                    retry_policy.wait(self.site(), retry_attempt,
+                                      u"The database is currently locked for "
+                                      u"write access.")
                     continue
                 elif errorCode == 'contenttoobig':
                     # 'contenttoobig':
@@ -2607,7 +2649,7 @@ class Page(object):
             # Check whether we are not too quickly after the previous
             # putPage, and wait a bit until the interval is acceptable
             if not dblagged:
-                put_throttle()
+                siteThrottle(self.site(), write=True)()
             # Which web-site host are we submitting to?
             if newPage:
                 output(u'Creating page %s' % self.title(asLink=True))
@@ -4555,7 +4597,7 @@ class DataPage(Page):
             # Check whether we are not too quickly after the previous
             # putPage, and wait a bit until the interval is acceptable
             if not dblagged:
-                put_throttle()
+                siteThrottle(self.site(), write=True)()
             # Which web-site host are we submitting to?
             if newPage:
                 output(u'Creating page %s via API' % self)
@@ -5195,6 +5237,30 @@ class DataPage(Page):
 wikidataPage = DataPage  # keep compatible
 
 
+def normalizedPages(site, pages):
+    """Return a list of Page objects for pages found in an API result.
+
+    pages is a list of dicts with the keys 'title' and 'ns', like the page
+    lists returned by the API. Their titles are already normalized by the
+    wiki, so they are not parsed again.
+
+    """
+    result = []
+    for data in pages:
+        if 'ns' not in data:
+            result.append(Page(site, data['title']))
+            continue
+        page = Page.__new__(Page)
+        page._editrestriction = False
+        page._site = site
+        page._namespace = data['ns']
+        page._title = data['title']
+        page._section = None
+        page._initAttributes()
+        result.append(page)
+    return result
+
+
 class ImagePage(Page):
     """A subclass of Page representing an image descriptor wiki page.
 
@@ -5575,6 +5641,40 @@ class _GetAll(object):
             elif verbose:
                 output(u"BUGWARNING: %s already done!"
                        % page.title(asLink=True))
+        # Index of the requested pages by their section-free titles. Every
+        # exported or queried title is looked up here instead of comparing
+        # it with each requested page.
+        self._index = {}
+        for page in self.pages:
+            self._index.setdefault(page.sectionFreeTitle(), []).append(page)
+
+    def _remapIndex(self, mapping, retitle=False):
+        """Re-key the index using API 'normalized' or 'redirects' entries.
+
+        If retitle is True, the title of the requested pages is replaced by
+        the target title (for normalized titles).
+
+        """
+        for item in mapping:
+            pages = self._index.pop(item['from'], None)
+            if not pages:
+                continue
+            if retitle:
+                for page in pages:
+                    page._title = item['to']
+                    if page.section():
+                        page._title += u'#' + page.section()
+            self._index.setdefault(item['to'], []).extend(pages)
+
+    def _findPages(self, title):
+        """Return the requested pages matching a returned title."""
+        pages = self._index.get(title)
+        if pages is None:
+            # The server might have returned a differently normalized
+            # title; normalize it in the same way as the requested pages.
+            pages = self._index.get(Page(self.site, title).sectionFreeTitle(),
+                                    [])
+        return pages
 
     def sleep(self):
         time.sleep(self.sleeptime)
@@ -5585,87 +5685,136 @@ class _GetAll(object):
 
     def run(self):
         if self.pages:
-            # Sometimes query does not contains revisions
-            # or some pages are missing. Deactivate api call and use the
-            # old API special:export
-            if self.site.has_api() and False:
-                while True:
-                    try:
-                        data = self.getDataApi()
-                    except (socket.error, httplib.BadStatusLine, ServerError):
-                        # Print the traceback of the caught exception
-                        exception(tb=True)
-                        debug(u'got network error in _GetAll.run. '
-                              u'Sleeping for %d seconds...' % self.sleeptime)
-                        self.sleep()
-                    else:
-                        if 'error' in data:
-                            raise RuntimeError(data['error'])
-                        else:
-                            break
-
-                self.headerDoneApi(data['query'])
-                if 'normalized' in data['query']:
-                    self._norm = dict([(x['from'], x['to'])
-                                       for x in data['query']['normalized']])
-                for vals in data['query']['pages'].values():
-                    self.oneDoneApi(vals)
-            else:  # read pages via Special:Export
-                while True:
-                    try:
-                        data = self.getData()
-                    except (socket.error, httplib.BadStatusLine, ServerError):
-                        # Print the traceback of the caught exception
-                        exception(tb=True)
-                        debug(u'got network error in _GetAll.run. '
-                              u'Sleeping for %d seconds...' % self.sleeptime)
-                        self.sleep()
-                    else:
-                        if "<title>Wiki does not exist</title>" in data:
-                            raise NoSuchSite(u'Wiki %s does not exist yet'
-                                             % self.site)
-                        elif "</mediawiki>" not in data[-20:]:
-                            # HTML error Page got thrown because of an internal
-                            # error when fetching a revision.
-                            output(u'Received incomplete XML data. '
-                                   u'Sleeping for %d seconds...'
-                                   % self.sleeptime)
-                            self.sleep()
-                        elif "<siteinfo>" not in data:
-                            # This probably means we got a 'temporary
-                            # unaivalable'
-                            output(u'Got incorrect export page. '
-                                   u'Sleeping for %d seconds...'
-                                   % self.sleeptime)
-                            self.sleep()
-                        else:
-                            break
-                R = re.compile(r"\s*<\?xml([^>]*)\?>(.*)", re.DOTALL)
-                m = R.match(data)
-                if m:
-                    data = m.group(2)
-                handler = xmlreader.MediaWikiXmlHandler()
-                handler.setCallback(self.oneDone)
-                handler.setHeaderCallback(self.headerDone)
-                #f = open("backup.txt", "w")
-                #f.write(data)
-                #f.close()
+            pages = self.pages
+            if self.site.has_api() and self.site.versionnumber() >= 12:
                 try:
-                    xml.sax.parseString(data, handler)
-                except (xml.sax._exceptions.SAXParseException,
-                        ValueError), err:
-                    debugDump('SaxParseBug', self.site, err, data)
-                    raise
-                except PageNotFound:
+                    self.runApi()
+                except (KeyError, ValueError, RuntimeError,
+                        PageNotFound), err:
+                    output(u'Loading pages via API from %s failed (%s); '
+                           u'falling back to Special:Export.'
+                           % (self.site, err))
+                # Pages which could not be loaded via API (e.g. because the
+                # revision text is hidden) are retried via Special:Export
+                pages = [pl for pl in self.pages if id(pl) not in self._done]
+            if pages:  # read pages via Special:Export
+                if not self.runExport(pages):
                     return
-                # All of the ones that have not been found apparently do not
-                # exist
-
+            # All of the ones that have not been found apparently do not
+            # exist
             for pl in self.pages:
                 if not hasattr(pl, '_contents') and \
                    not hasattr(pl, '_getexception'):
                     pl._getexception = NoPage
 
+    def runApi(self):
+        """Load the pages via API, using as many requests as needed.
+
+        If the result of a request gets too large, the server does not
+        return the text of all pages; those are requested again.
+
+        """
+        self._done = set()
+        self._unresolved = []
+        siteinfo = True
+        titles = None
+        while True:
+            # unique titles of the pages not done yet, in order
+            remaining = []
+            seen = set()
+            for pl in self.pages:
+                title = pl.sectionFreeTitle()
+                if id(pl) not in self._done and title not in seen:
+                    remaining.append(title)
+                    seen.add(title)
+            if not remaining or remaining == titles:
+                # done, or no progress at all
+                break
+            titles = remaining
+            while True:
+                try:
+                    data = self.getDataApi(titles, siteinfo)
+                except (socket.error, httplib.BadStatusLine, ServerError):
+                    # Print the traceback of the caught exception
+                    exception(tb=True)
+                    debug(u'got network error in _GetAll.runApi. '
+                          u'Sleeping for %d seconds...' % self.sleeptime)
+                    self.sleep()
+                else:
+                    if 'error' in data:
+                        raise RuntimeError(data['error'])
+                    else:
+                        break
+
+            if siteinfo:
+                self.headerDoneApi(data['query'])
+                siteinfo = False
+            if 'normalized' in data['query']:
+                self._remapIndex(data['query']['normalized'],
+                                 retitle=True)
+            if 'redirects' in data['query']:
+                self._remapIndex(data['query']['redirects'])
+            for vals in data['query'].get('pages', {}).values():
+                self.oneDoneApi(vals)
+        if self._unresolved:
+            self.resolveRedirectsApi()
+
+    def runExport(self, pages):
+        """Load the pages via Special:Export.
+
+        Return False if the export contained a page which was not requested.
+
+        """
+        import xml.sax
+        import xmlreader
+        while True:
+            try:
+                data = self.getData(pages=pages)
+            except (socket.error, httplib.BadStatusLine, ServerError):
+                # Print the traceback of the caught exception
+                exception(tb=True)
+                debug(u'got network error in _GetAll.runExport. '
+                      u'Sleeping for %d seconds...' % self.sleeptime)
+                self.sleep()
+            else:
+                if "<title>Wiki does not exist</title>" in data:
+                    raise NoSuchSite(u'Wiki %s does not exist yet'
+                                     % self.site)
+                elif "</mediawiki>" not in data[-20:]:
+                    # HTML error Page got thrown because of an internal
+                    # error when fetching a revision.
+                    output(u'Received incomplete XML data. '
+                           u'Sleeping for %d seconds...'
+                           % self.sleeptime)
+                    self.sleep()
+                elif "<siteinfo>" not in data:
+                    # This probably means we got a 'temporary
+                    # unaivalable'
+                    output(u'Got incorrect export page. '
+                           u'Sleeping for %d seconds...'
+                           % self.sleeptime)
+                    self.sleep()
+                else:
+                    break
+        R = re.compile(r"\s*<\?xml([^>]*)\?>(.*)", re.DOTALL)
+        m = R.match(data)
+        if m:
+            data = m.group(2)
+        handler = xmlreader.MediaWikiXmlHandler()
+        handler.setCallback(self.oneDone)
+        handler.setHeaderCallback(self.headerDone)
+        #f = open("backup.txt", "w")
+        #f.write(data)
+        #f.close()
+        try:
+            xml.sax.parseString(data, handler)
+        except (SaxError, ValueError), err:
+            debugDump('SaxParseBug', self.site, err, data)
+            raise
+        except PageNotFound:
+            return False
+        return True
+
     def oneDone(self, entry):
         title = entry.title
         username = entry.username
@@ -5676,54 +5825,51 @@ class _GetAll(object):
         moveRestriction = entry.moveRestriction
         revisionId = entry.revisionid
 
-        page = Page(self.site, title)
-        successful = False
-        for page2 in self.pages:
-            if page2.sectionFreeTitle() == page.sectionFreeTitle():
-                if not (hasattr(page2, '_contents') or
-                        hasattr(page2, '_getexception')) or self.force:
-                    page2.editRestriction = entry.editRestriction
-                    page2.moveRestriction = entry.moveRestriction
-                    if editRestriction == 'autoconfirmed':
-                        page2._editrestriction = True
-                    page2._permalink = entry.revisionid
-                    page2._userName = username
-                    page2._ipedit = ipedit
-                    page2._revisionId = revisionId
-                    page2._editTime = parsetime2stamp(timestamp)
-                    page2._versionhistory = [(revisionId, timestamp, username,
-                                              entry.comment)]
-                    section = page2.section()
-                    # Store the content
-                    page2._contents = text
-                    m = self.site.redirectRegex().match(text)
-                    if m:
-##                        output(u"%s is a redirect" % page2.title(asLink=True))
-                        redirectto = m.group(1)
-                        if section and "#" not in redirectto:
-                            redirectto += "#" + section
-                        page2._getexception = IsRedirectPage
-                        page2._redirarg = redirectto
-
-                    # This is used for checking deletion conflict.
-                    # Use the data loading time.
-                    page2._startTime = time.strftime('%Y%m%d%H%M%S',
-                                                     time.gmtime())
-                    if section:
-                        m = re.search("=+[ ']*%s[ ']*=+" % re.escape(section),
-                                      text)
-                        if not m:
-                            try:
-                                page2._getexception
-                                warning(u"Section not found: %s" % page2)
-                            except AttributeError:
-                                # There is no exception yet
-                                page2._getexception = SectionError
-                successful = True
-                # Note that there is no break here. The reason is that there
-                # might be duplicates in the pages list.
-        if not successful:
-            output(u"BUG>> title %s (%s) not found in list" % (title, page))
+        pages = self._findPages(title)
+        for page2 in pages:
+            if not (hasattr(page2, '_contents') or
+                    hasattr(page2, '_getexception')) or self.force:
+                page2.editRestriction = entry.editRestriction
+                page2.moveRestriction = entry.moveRestriction
+                if editRestriction == 'autoconfirmed':
+                    page2._editrestriction = True
+                page2._permalink = entry.revisionid
+                page2._userName = username
+                page2._ipedit = ipedit
+                page2._revisionId = revisionId
+                page2._editTime = parsetime2stamp(timestamp)
+                page2._versionhistory = [(revisionId, timestamp, username,
+                                          entry.comment)]
+                section = page2.section()
+                # Store the content
+                page2._contents = text
+                m = self.site.redirectRegex().match(text)
+                if m:
+##                    output(u"%s is a redirect" % page2.title(asLink=True))
+                    redirectto = m.group(1)
+                    if section and "#" not in redirectto:
+                        redirectto += "#" + section
+                    page2._getexception = IsRedirectPage
+                    page2._redirarg = redirectto
+
+                # This is used for checking deletion conflict.
+                # Use the data loading time.
+                page2._startTime = time.strftime('%Y%m%d%H%M%S',
+                                                 time.gmtime())
+                if section:
+                    m = re.search("=+[ ']*%s[ ']*=+" % re.escape(section),
+                                  text)
+                    if not m:
+                        try:
+                            page2._getexception
+                            warning(u"Section not found: %s" % page2)
+                        except AttributeError:
+                            # There is no exception yet
+                            page2._getexception = SectionError
+            # Note that there is no break here. The reason is that there
+            # might be duplicates in the pages list.
+        if not pages:
+            output(u"BUG>> title %s not found in list" % title)
             output(u'Expected one of: %s'
                    % u', '.join([unicode(page2) for page2 in self.pages]))
             raise PageNotFound
@@ -5790,9 +5936,11 @@ class _GetAll(object):
                         u"should be removed (namespace doesn't exist in the "
                         u"site)" % (self.site.family.name, lang, id))
 
-    def getData(self, curonly=True):
+    def getData(self, curonly=True, pages=None):
+        if pages is None:
+            pages = self.pages
         address = self.site.export_address()
-        pagenames = [page.sectionFreeTitle() for page in self.pages]
+        pagenames = [page.sectionFreeTitle() for page in pages]
         # We need to use X convention for requested page titles.
         if self.site.lang == 'eo':
             pagenames = [encodeEsperantoX(pagetitle) for pagetitle in pagenames]
@@ -5810,7 +5958,7 @@ class _GetAll(object):
         if curonly:
             predata['curonly'] = 'True'
         # Slow ourselves down
-        get_throttle(requestsize=len(self.pages))
+        siteThrottle(self.site)(requestsize=len(pages))
         # Now make the actual request to the server
         now = time.time()
         response, data = self.site.postForm(address, predata)
@@ -5822,96 +5970,112 @@ class _GetAll(object):
 
     def oneDoneApi(self, data):
         title = data['title']
-        if not ('missing' in data or 'invalid' in data):
-            revisionId = data['lastrevid']
+        if 'missing' in data or 'invalid' in data:
             rev = None
-            try:
-                rev = data['revisions']
-            except KeyError:
-                raise KeyError(
-                    u'NOTE: Last revision of [[%s]] not found' % title)
-            else:
-                username = rev[0]['user']
-                ipedit = 'anon' in rev[0]
-                timestamp = rev[0]['timestamp']
-                text = rev[0]['*']
+        elif 'revisions' in data and '*' in data['revisions'][0]:
+            rev = data['revisions'][0]
+            revisionId = rev.get('revid', data.get('lastrevid'))
+            # Note: user may be hidden and mw returns 'userhidden' flag
+            username = rev.get('user')
+            ipedit = 'anon' in rev
+            timestamp = rev['timestamp']
+            text = rev['*']
             editRestriction = ''
             moveRestriction = ''
-            for revs in data['protection']:
+            for revs in data.get('protection', []):
                 if revs['type'] == 'edit':
                     editRestriction = revs['level']
                 elif revs['type'] == 'move':
                     moveRestriction = revs['level']
+        else:
+            # The result was too large to contain this revision, or the text
+            # is hidden. Leave the page for the next request.
+            return
 
-        page = Page(self.site, title)
-        successful = False
-        for page2 in self.pages:
-            if hasattr(self, '_norm') and \
-               page2.sectionFreeTitle() in self._norm:
-                page2._title = self._norm[page2.sectionFreeTitle()]
-
-            if page2.sectionFreeTitle() == page.sectionFreeTitle():
-                if 'missing' in data:
-                    page2._getexception = NoPage
-                    successful = True
-                    break
+        pages = self._findPages(title)
+        for page2 in pages:
+            self._done.add(id(page2))
+            if 'missing' in data:
+                page2._getexception = NoPage
+                continue
 
-                if 'invalid' in data:
-                    page2._getexception = BadTitle
-                    successful = True
-                    break
+            if 'invalid' in data:
+                page2._getexception = BadTitle
+                continue
 
-                if not (hasattr(page2, '_contents') or
-                        hasattr(page2, '_getexception')) or self.force:
-                    page2.editRestriction = editRestriction
-                    page2.moveRestriction = moveRestriction
-                    if editRestriction == 'autoconfirmed':
-                        page2._editrestriction = True
-                    page2._permalink = revisionId
-                    if rev:
-                        page2._userName = username
-                        page2._ipedit = ipedit
-                        page2._editTime = parsetime2stamp(timestamp)
-                        page2._contents = text
-                    else:
-                        raise KeyError(
-                            u'BUG?>>: Last revision of [[%s]] not found'
-                            % title)
-                    page2._revisionId = revisionId
-                    section = page2.section()
-                    if 'redirect' in data:
-##                        output(u"%s is a redirect" % page2.title(asLink=True))
-                        m = self.site.redirectRegex().match(text)
+            if not (hasattr(page2, '_contents') or
+                    hasattr(page2, '_getexception')) or self.force:
+                page2.editRestriction = editRestriction
+                page2.moveRestriction = moveRestriction
+                if editRestriction == 'autoconfirmed':
+                    page2._editrestriction = True
+                page2._permalink = revisionId
+                page2._page_id = data['pageid']
+                page2._userName = username
+                page2._ipedit = ipedit
+                page2._editTime = parsetime2stamp(timestamp)
+                page2._versionhistory = [(revisionId, timestamp, username,
+                                          rev.get('comment', u''))]
+                page2._contents = text
+                page2._revisionId = revisionId
+                section = page2.section()
+                if 'redirect' in data:
+##                    output(u"%s is a redirect" % page2.title(asLink=True))
+                    m = self.site.redirectRegex().match(text)
+                    if m:
                         redirectto = m.group(1)
                         if section and "#" not in redirectto:
                             redirectto += "#" + section
                         page2._getexception = IsRedirectPage
                         page2._redirarg = redirectto
-
-                    # This is used for checking deletion conflict.
-                    # Use the data loading time.
-                    page2._startTime = time.strftime('%Y%m%d%H%M%S',
-                                                     time.gmtime())
-                    if section:
-                        m = re.search("=+[ ']*%s[ ']*=+" % re.escape(section),
-                                      text)
-                        if not m:
-                            try:
-                                page2._getexception
-                                warning(u"Section not found: %s"
-                                        % page2)
-                            except AttributeError:
-                                # There is no exception yet
-                                page2._getexception = SectionError
-                successful = True
-                # Note that there is no break here. The reason is that there
-                # might be duplicates in the pages list.
-        if not successful:
-            output(u"BUG>> title %s (%s) not found in list" % (title, page))
+                    else:
+                        # unknown redirect syntax; ask the server
+                        self._unresolved.append(page2)
+
+                # This is used for checking deletion conflict.
+                # Use the data loading time.
+                page2._startTime = time.strftime('%Y%m%d%H%M%S',
+                                                 time.gmtime())
+                if section:
+                    m = re.search("=+[ ']*%s[ ']*=+" % re.escape(section),
+                                  text)
+                    if not m:
+                        try:
+                            page2._getexception
+                            warning(u"Section not found: %s"
+                                    % page2)
+                        except AttributeError:
+                            # There is no exception yet
+                            page2._getexception = SectionError
+            # Note that there is no break here. The reason is that there
+            # might be duplicates in the pages list.
+        if not pages:
+            output(u"BUG>> title %s not found in list" % title)
             output(u'Expected one of: %s'
                    % u', '.join([unicode(page2) for page2 in self.pages]))
             raise PageNotFound
 
+    def resolveRedirectsApi(self):
+        """Get the targets of redirects the redirectRegex did not match."""
+        params = {
+            'action': 'query',
+            'redirects': 1,
+            'titles': [page.sectionFreeTitle() for page in self._unresolved],
+        }
+        data = query.GetData(params, self.site)
+        if 'error' in data:
+            raise RuntimeError(data['error'])
+        for item in data['query'].get('redirects', []):
+            for page2 in self._findPages(item['from']):
+                if page2 not in self._unresolved:
+                    continue
+                redirectto = item['to']
+                section = item.get('tofragment') or page2.section()
+                if section:
+                    redirectto += "#" + section
+                page2._getexception = IsRedirectPage
+                page2._redirarg = redirectto
+
     def headerDoneApi(self, header):
         p = re.compile('^MediaWiki (.+)$')
         m = p.match(header['general']['generator'])
@@ -5933,7 +6097,8 @@ class _GetAll(object):
             case = 'first-letter'
         if case != header['general']['case'].strip():
             warning(u'Family file %s contains case %s, but it should be %s'
-                    % (self.site.family.name, case, header.case.strip()))
+                    % (self.site.family.name, case,
+                       header['general']['case'].strip()))
 
         # Verify namespaces
         lang = self.site.lang
@@ -5973,26 +6138,23 @@ class _GetAll(object):
                         u"should be removed (namespace doesn't exist in the "
                         u"site)" % (self.site.family.name, lang, id))
 
-    def getDataApi(self):
-        pagenames = [page.sectionFreeTitle() for page in self.pages]
+    def getDataApi(self, titles, siteinfo=True):
         params = {
             'action': 'query',
-            'meta':   'siteinfo',
             'prop':   ['info', 'revisions'],
-            'titles': pagenames,
-            'siprop': ['general', 'namespaces'],
-            'rvprop': ['content', 'timestamp', 'user', 'comment',
-                       'size'],  # 'ids',
+            'titles': titles,
+            'rvprop': ['content', 'ids', 'timestamp', 'user', 'comment',
+                       'size'],
             'inprop': ['protection',
                        'subjectid'],  # , 'talkid', 'url', 'readable'
         }
+        if siteinfo:
+            params['meta'] = 'siteinfo'
+            params['siprop'] = ['general', 'namespaces']
 
         # Slow ourselves down
-        get_throttle(requestsize=len(self.pages))
+        siteThrottle(self.site)(requestsize=len(titles))
         # Now make the actual request to the server
-        now = time.time()
-
-        #get_throttle.setDelay(time.time() - now)
         return query.GetData(params, self.site)
 
 
@@ -6005,16 +6167,24 @@ def getall(site, pages, throttle=True, force=False):
     """
     # TODO: why isn't this a Site method?
     pages = list(pages)  # if pages is an iterator, we need to make it a list
+    useAPI = site.has_api() and site.versionnumber() >= 12
     output(pywikibot.translate(
         'en',
         u'Getting %(count)d page{{PLURAL:count||s}} %(API)sfrom %(site)s...',
         {'count': len(pages),
-         # API is deactivated since r8036 because some pages are missing
-         'API': (u'', u'via API ')[site.has_api() and False],
+         'API': (u'', u'via API ')[useAPI],
          'site': site}))
 
-    # default is 500/4, but It might have good point for server.
-    limit = config.special_page_limit / 4
+    if useAPI:
+        # The API returns the content of up to 50 pages per request, or
+        # 500 pages with apihighlimits (bots and sysops).
+        if site.isAllowed('apihighlimits'):
+            limit = 500
+        else:
+            limit = 50
+    else:
+        # default is 500/4, but It might have good point for server.
+        limit = config.special_page_limit / 4
     if len(pages) > limit:
         # separate export pages for bulk-retrieve
 
@@ -6034,11 +6204,150 @@ def getall(site, pages, throttle=True, force=False):
                 _GetAll(site, k, throttle, force).run()
                 pages[pagg:pagg + limit] = k
             # one time to retrieve is 7.7 sec.
-            get_throttle(requestsize=len(pages) / 10)
+            siteThrottle(site)(requestsize=len(pages) / 10)
     else:
         _GetAll(site, pages, throttle, force).run()
 
 
+def _getReferrers(site, titles, props, redirectsOnly=False):
+    """Yield (title, referrer, isRedirect) for all pages linking to or
+    transcluding any of titles, using prop=linkshere|transcludedin.
+
+    """
+    if not site.isAllowed('apihighlimits') and \
+       config.special_page_limit > 500:
+        limit = 500
+    else:
+        limit = config.special_page_limit
+    params = {
+        'action': 'query',
+        'titles': list(titles),
+    }
+    prefixes = {'linkshere': 'lh', 'transcludedin': 'ti'}
+    props = list(props)
+    for prop in props:
+        prefix = prefixes[prop]
+        params[prefix + 'prop'] = 'title|redirect'
+        params[prefix + 'limit'] = limit
+        if redirectsOnly:
+            params[prefix + 'show'] = 'redirect'
+    while props:
+        params['prop'] = props
+        data = query.GetData(dict(params), site)
+        if 'error' in data:
+            raise RuntimeError("API query error: %s" % data['error'])
+        # map the titles given by the API back to the requested ones
+        normalized = dict((item['to'], item['from'])
+                          for item in data['query'].get('normalized', []))
+        for page in data['query'].get('pages', {}).itervalues():
+            title = normalized.get(page['title'], page['title'])
+            for prop in props:
+                for ref in page.get(prop, []):
+                    yield (title,
+                           Page(site, ref['title'],
+                                defaultNamespace=ref['ns']),
+                           'redirect' in ref)
+        # continue only the modules which have more results
+        if 'query-continue' not in data:
+            break
+        props = [prop for prop in props if prop in data['query-continue']]
+        for prop in props:
+            params.update(data['query-continue'][prop])
+
+
+def getallReferences(site, pages, follow_redirects=True,
+                     withTemplateInclusion=True, onlyTemplateInclusion=False,
+                     redirectsOnly=False, step=50):
+    """Yield (page, referrer) for all pages referring to any of pages.
+
+    Like Page.getReferences(), but the references to step pages are
+    retrieved together, the referrers of each redirect are retrieved only
+    once even if it leads to several of the pages, and every referrer is
+    yielded only once per page.
+
+    Arguments: site = Site object
+               pages = iterable that yields Page objects
+               the other arguments as for Page.getReferences()
+
+    """
+    if not site.has_api() or site.versionnumber() < 24:
+        # prop=linkshere and prop=transcludedin are not available
+        for page in pages:
+            refPages = set()
+            for ref in page.getReferences(follow_redirects,
+                                          withTemplateInclusion,
+                                          onlyTemplateInclusion,
+                                          redirectsOnly):
+                if ref not in refPages:
+                    refPages.add(ref)
+                    yield page, ref
+        return
+
+    props = []
+    if not onlyTemplateInclusion:
+        props.append('linkshere')
+    if withTemplateInclusion or onlyTemplateInclusion:
+        props.append('transcludedin')
+    # referrers of the redirects seen so far
+    redirectRefs = {}
+    pages = iter(pages)
+    while True:
+        batch = {}
+        for page in pages:
+            batch.setdefault(page.title(), page)
+            if len(batch) >= step:
+                break
+        if not batch:
+            break
+        # referrers of the pages of this batch
+        batchRefs = {}
+        # (page title, referrer title) pairs yielded already
+        seen = set((title, title) for title in batch)
+        # pages and redirects to look up, with the pages they lead to
+        frontier = dict((title, [title]) for title in batch)
+        while frontier:
+            nextFrontier = {}
+
+            def newRoots(title, ref, isRedirect):
+                """Return the pages of the batch ref was not yielded for."""
+                roots = []
+                for root in frontier[title]:
+                    key = root, ref.title()
+                    if key not in seen:
+                        seen.add(key)
+                        roots.append(root)
+                if roots and isRedirect and follow_redirects:
+                    nextFrontier.setdefault(ref.title(), []).extend(roots)
+                return roots
+
+            # replay the redirects whose referrers are known already
+            todo = []
+            for title in frontier:
+                refs = batchRefs.get(title, redirectRefs.get(title))
+                if refs is None:
+                    todo.append(title)
+                    continue
+                for ref, isRedirect in refs:
+                    for root in newRoots(title, ref, isRedirect):
+                        yield batch[root], ref
+            for i in range(0, len(todo), step):
+                chunk = todo[i:i + step]
+                for title in chunk:
+                    if title in batch:
+                        batchRefs[title] = []
+                    else:
+                        redirectRefs[title] = []
+                for title, ref, isRedirect in _getReferrers(
+                        site, chunk, props, redirectsOnly):
+                    refs = batchRefs.get(title, redirectRefs.get(title))
+                    if refs is None:
+                        continue
+                    refs.append((ref, isRedirect))
+                    for root in newRoots(title, ref, isRedirect):
+                        yield batch[root], ref
+            frontier = nextFrontier
+
+
 # Library functions
 
 
@@ -6562,8 +6871,11 @@ class Site(object):
                                  % (self.__code, self.__family.name))
 
         self.nocapitalize = self.code in self.family.nocapitalize
+        # Site objects are used as keys of many caches
+        self._hash = hash(repr(self))
         self._mediawiki_messages = {}
         self._info = {}
+        self._snapshots = set()
         self._userName = [None, None]
         self.user = user
         self._userData = [False, False]
@@ -6574,12 +6886,9 @@ class Site(object):
         self._token = [None, None]
         self._patrolToken = [None, None]
         self._cookies = [None, None]
-        # Calculating valid languages took quite long, so we calculate it once
-        # in initialization instead of each time it is used.
-        self._validlanguages = []
-        for language in self.languages():
-            if not language[0].upper() + language[1:] in self.namespaces():
-                self._validlanguages.append(language)
+        # Calculating valid languages takes quite long, so we calculate it
+        # once when it is used first.
+        self._validlanguages = None
 
     def __call__(self):
         """Since the Page.site() method has a property decorator, return the
@@ -6641,7 +6950,7 @@ class Site(object):
         return '%s:%s' % (self.family.name, self.code)
 
     def __hash__(self):
-        return hash(repr(self))
+        return self._hash
 
     def linktrail(self):
         """Return regex for trailing chars displayed as part of a link.
@@ -6663,6 +6972,11 @@ class Site(object):
 
     def validLanguageLinks(self):
         """Return list of language codes that can be used in interwiki links."""
+        if self._validlanguages is None:
+            namespaces = set(self.namespaces())
+            self._validlanguages = [
+                language for language in self.languages()
+                if language[0].upper() + language[1:] not in namespaces]
         return self._validlanguages
 
     def namespaces(self):
@@ -7092,17 +7406,19 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         url = '%s://%s%s' % (self.protocol(), self.hostname(), address)
         # Try to retrieve the page until it was successfully loaded (just in
         # case the server is down or overloaded).
-        # Wait for retry_idle_time minutes (growing!) between retries.
-        retry_idle_time = 1
+        # Wait according to retry_policy between retries.
         retry_attempt = 0
         while True:
             try:
+                started = time.time()
                 request = urllib2.Request(str(url), str(data), headers)
                 f = MyURLopener.open(request)
 
                 # read & info can raise socket.error
                 text = f.read()
                 headers = f.info()
+                retry_policy.success(self, time.time() - started,
+                                     len(text))
                 break
             except KeyboardInterrupt:
                 raise
@@ -7113,21 +7429,17 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
                     raise PageNotFound(u'Page %s could not be retrieved. Check '
                                        u'your family file ?' % url)
                 # just check for HTTP Status 500 (Internal Server Error)?
-                elif e.code in [500, 502, 504]:
+                elif e.code in [429, 500, 502, 503, 504]:
                     output(u'HTTPError: %s %s' % (e.code, e.msg))
                     if config.retry_on_fail:
                         retry_attempt += 1
-                        if retry_attempt > config.maxretries:
+                        retryafter = parseRetryAfter(
+                            e.info().get('Retry-After'))
+                        if not retry_policy.retry(
+                                self, retry_attempt,
+                                u"Could not open '%s'.\nMaybe the server is "
+                                u"down." % url, retryafter):
                             raise MaxTriesExceededError()
-                        warning(u"Could not open '%s'.\nMaybe the server is "
-                                "down. Retrying in %i minutes..."
-                                % (url, retry_idle_time))
-                        time.sleep(retry_idle_time * 60)
-                        # Next time wait longer, but not longer than half an
-                        # hour
-                        retry_idle_time *= 2
-                        if retry_idle_time > 30:
-                            retry_idle_time = 30
                         continue
                     raise
                 else:
@@ -7138,15 +7450,11 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
 
                 if config.retry_on_fail:
                     retry_attempt += 1
-                    if retry_attempt > config.maxretries:
+                    if not retry_policy.retry(
+                            self, retry_attempt,
+                            u"Could not open '%s'. Maybe the server or\nyour "
+                            u"connection is down." % url):
                         raise MaxTriesExceededError()
-                    warning(u"Could not open '%s'. Maybe the server or\nyour "
-                            u"connection is down. Retrying in %i minutes..."
-                            % (url, retry_idle_time))
-                    time.sleep(retry_idle_time * 60)
-                    retry_idle_time *= 2
-                    if retry_idle_time > 30:
-                        retry_idle_time = 30
                     continue
                 raise
 
@@ -7539,6 +7847,9 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         if not isinstance(key, basestring):
             key = 'general'
 
+        if 'siteinfo' not in self._snapshots and not force:
+            self._loadSiteinfoSnapshot()
+
         if self._info and key in self._info and not force:
             if dump:
                 return self._info
@@ -7585,14 +7896,60 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
             else:
                 for k, v in data.iteritems():
                     self._info[k] = v
+        # the statistics change too often to be kept
+        sitecache.save(self, 'siteinfo',
+                       dict((k, v) for k, v in self._info.iteritems()
+                            if k != 'statistics'))
         #data pre-process
         if dump:
             return self._info
         else:
             return self._info.get(key)
 
+    def _loadSiteinfoSnapshot(self):
+        """Load the site information kept from an earlier run.
+
+        A snapshot older than config.site_snapshot_ttl is used, but
+        refreshed in the background.
+
+        """
+        self._snapshots.add('siteinfo')
+        snapshot = sitecache.load(self, 'siteinfo')
+        if snapshot is None:
+            return
+        data, age = snapshot
+        for k, v in data.iteritems():
+            self._info.setdefault(k, v)
+        if age > config.site_snapshot_ttl:
+            thread = threading.Thread(target=self._refreshSiteinfo,
+                                      args=(data.keys(),))
+            thread.setDaemon(True)
+            thread.start()
+
+    def _refreshSiteinfo(self, keys):
+        """Load the site information for keys again."""
+        # the huge siprops are loaded one by one, the others all at once
+        keys = [key for key in keys if key in ['specialpagealiases',
+                                               'interwikimap',
+                                               'namespacealiases',
+                                               'usergroups', 'magicwords',
+                                               'extensions']] + ['general']
+        try:
+            for key in keys:
+                self.siteinfo(key, force=True)
+        except Exception:
+            # the snapshot is refreshed again by the next run
+            if verbose:
+                output(u'Refreshing the site information of %s failed:\n%s'
+                       % (self, traceback.format_exc()))
+
     def mediawiki_message(self, key, forceReload=False):
         """Return the MediaWiki message text for key "key" """
+        if 'messages' not in self._snapshots and not forceReload:
+            self._snapshots.add('messages')
+            snapshot = sitecache.load(self, 'messages')
+            if snapshot and snapshot[1] <= config.site_snapshot_ttl:
+                self._mediawiki_messages.update(snapshot[0])
         # Allmessages is retrieved once for all per created Site object
         if (not self._mediawiki_messages) or forceReload:
             api = self.has_api()
@@ -7643,6 +8000,8 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
                         raise KeyError("message '%s' does not exist." % key)
                     elif datas['name'] not in self._mediawiki_messages:
                         self._mediawiki_messages[datas['name']] = datas['*']
+                        sitecache.save(self, 'messages',
+                                       {datas['name']: datas['*']}, merge=True)
 ##                    self._mediawiki_messages = _dict(
 ##                        [(tag['name'].lower(), tag['*'])
 ##                         for tag in datas if not 'missing' in tag])
@@ -7680,6 +8039,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
                             [(tag.get('name').lower(), tag.text)
                              for tag in tree.getiterator('message')])
                     else:
+                        from BeautifulSoup import BeautifulStoneSoup
                         tree = BeautifulStoneSoup(xml)
                         self._mediawiki_messages = _dict(
                             [(tag.get('name').lower(), html2unicode(tag.string))
@@ -7853,19 +8213,12 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
                         'articlefeedbackv5', 'newusers'):
             raise NotImplementedError(mode)
         params = {
-            'action': 'query',
-            'list':   'logevents',
             'letype':  mode,
-            'lelimit': int(number),
             'ledir':  'older',
             'leprop': ['ids', 'title', 'type', 'user', 'timestamp',
                        'comment', 'details'],
         }
 
-        if number > config.special_page_limit:
-            params['lelimit'] = config.special_page_limit
-            if number > 5000 and self.isAllowed('apihighlimits'):
-                params['lelimit'] = 5000
         if newer:
             params['ledir'] = 'newer'
         if user:
@@ -7887,9 +8240,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         if tag and self.versionnumber() >= 16:  # tag support from mw:r58399
             params['letag'] = tag
 
-        nbresults = 0
-        while True:
-            result = query.GetData(params, self)
+        def check(result):
             if 'error' in result and \
                result.get('error').get('code') == u'leparam_title':
                 output('%(info)s' % result.get('error'))
@@ -7898,28 +8249,11 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
             if 'error' in result:
                 output('%s' % result)
                 raise Error
+            query.checkResult(result)
 
-            # _handle_warnings from core
-            if 'warnings' in result:
-                for mod, warning in result['warnings'].items():
-                    if mod == 'info':
-                        continue
-                    if '*' in warning:
-                        text = warning['*']
-                    elif 'html' in warning:
-                        # Bugzilla 49978
-                        text = warning['html']['*']
-                    else:
-                        pywikibot.warning(
-                            u'API warning ({0})of unknown format: {1}'.
-                            format(mod, warning))
-                        continue
-                    # multiple warnings are in text separated by a newline
-                    for single_warning in text.splitlines():
-                        pywikibot.warning(u"API warning (%s): %s"
-                                          % (mod, single_warning))
-
-            for c in result['query']['logevents']:
+        while True:
+            for c in query.ListIterator(self, 'logevents', 'le', params,
+                                        total=int(number), check=check):
                 if (not namespace or c['ns'] in namespace) and \
                    'actionhidden' not in c.keys():
                     if dump:
@@ -7935,20 +8269,9 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
                         yield (p_ret, c['user'],
                                parsetime2stamp(c['timestamp']),
                                c['comment'])
-
-                nbresults += 1
-                if nbresults >= number:
-                    break
-            if 'query-continue' in result and nbresults < number:
-                params.update(result['query-continue']['logevents'])
-            elif repeat:
-                nbresults = 0
-                try:
-                    params.pop('lestart')
-                except KeyError:
-                    pass
-            else:
+            if not repeat:
                 break
+            params.pop('lestart', None)
         return
 
     @deprecate_arg("get_redirect", None)  # 20120822
@@ -8276,16 +8599,14 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
             rctype = 'edit|new'
 
         params = {
-            'action': 'query',
-            'list':   'recentchanges',
             'rcdir':   rcdir,
             'rctype':  rctype,
             'rcprop': ['user', 'comment', 'timestamp', 'title', 'ids',
                        'loginfo',
                        'sizes'],  # , 'flags', 'redirect', 'patrolled'],
-            'rcnamespace': namespace,
         }
-        params['rclimit'] = int(number)
+        if namespace is not None:
+            params['rcnamespace'] = namespace
         if nobots and not rcshow:
             rcshow = "!bot"
         elif nobots and rcshow:
@@ -8308,16 +8629,8 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
 
         seen = set()
         while True:
-            data = query.GetData(params, self)
-            if 'error' in data:
-                raise RuntimeError('%s' % data['error'])
-            try:
-                rcData = data['query']['recentchanges']
-            except KeyError:
-                raise ServerError(
-                    "The APIs don't return data, the site may be down")
-
-            for i in rcData:
+            for i in query.ListIterator(self, 'recentchanges', 'rc', params,
+                                        total=int(number)):
                 if i[keyseen] not in seen:
                     seen.add(i[keyseen])
                     page = Page(self, i['title'], defaultNamespace=i['ns'])
@@ -8556,12 +8869,8 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
             return
 
         params = {
-            'action':     'query',
-            'list':       'allpages',
-            'aplimit':     config.special_page_limit,
             'apnamespace': namespace,
             'apfrom':      start,
-            'rawcontinue': ''
         }
 
         if not includeredirects:
@@ -8569,29 +8878,9 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         elif includeredirects == 'only':
             params['apfilterredir'] = 'redirects'
 
-        while True:
-            if throttle:
-                get_throttle()
-            data = query.GetData(params, self)
-            if verbose:
-                debug(u'allpages>>> data.keys() %s' % data.keys())
-            if 'warnings' in data:
-                warning = data['warnings']['query']['*']
-                pywikibot.warning("API query warning: %s" % warning)
-            if 'error' in data:
-                raise RuntimeError("API query error: %s" % data)
-            if 'allpages' not in data['query']:
-                raise RuntimeError("API query error, no pages found: %s" % data)
-            count = 0
-            for p in data['query']['allpages']:
-                count += 1
-                yield Page(self, p['title'])
-                if count >= config.special_page_limit:
-                    break
-            if 'query-continue' in data and count < params['aplimit']:
-                params.update(data['query-continue']['allpages'])
-            else:
-                break
+        for page in query.ListIterator(self, 'allpages', 'ap', params,
+                                       pages=True, throttle=throttle):
+            yield page
 
     def _allpagesOld(self, start='!', namespace=0, includeredirects=True,
                      throttle=True):
@@ -8769,7 +9058,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
 
     def linksearch(self, siteurl, limit=500, euprotocol=None):
         """Yield Pages from results of Special:Linksearch for 'siteurl'."""
-        cache = []
+        cache = set()
         R = re.compile('title ?=\"([^<>]*?)\">[^<>]*</a></li>')
         urlsToRetrieve = [siteurl]
         if not siteurl.startswith('*.'):
@@ -8779,34 +9068,18 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
             output(u'Querying API exturlusage...')
             for url in urlsToRetrieve:
                 params = {
-                    'action': 'query',
-                    'list':   'exturlusage',
-                    'eulimit': limit,
                     'euquery': url,
                 }
                 if euprotocol:
                     params['euprotocol'] = euprotocol
-                count = 0
-                while True:
-                    data = query.GetData(params, self)
-                    if data['query']['exturlusage'] == []:
-                        break
-                    for pages in data['query']['exturlusage']:
-                        count += 1
-                        if siteurl not in pages['title']:
-                            # the links themselves have similar form
-                            if pages['pageid'] not in cache:
-                                cache.append(pages['pageid'])
-                                yield Page(self, pages['title'],
-                                           defaultNamespace=pages['ns'])
-                        if count >= limit:
-                            break
-
-                    if 'query-continue' in data and count < limit:
-                            params.update(data[
-                                u'query-continue'][u'exturlusage'])
-                    else:
-                            break
+                for pages in query.ListIterator(self, 'exturlusage', 'eu',
+                                                params, total=limit):
+                    if siteurl not in pages['title']:
+                        # the links themselves have similar form
+                        if pages['pageid'] not in cache:
+                            cache.add(pages['pageid'])
+                            yield Page(self, pages['title'],
+                                       defaultNamespace=pages['ns'])
         else:
             output(u'Querying [[Special:Linksearch]]...')
             for url in urlsToRetrieve:
@@ -8839,7 +9112,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
                             if title in cache:
                                 continue
                             else:
-                                cache.append(title)
+                                cache.add(title)
                                 yield Page(self, title)
                     offset += limit
 
@@ -9261,6 +9534,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
         if not hasattr(self, "_mw_version"):
             PATTERN = r"^(?:: )?([0-9]+)\.([0-9]+)(.*)$"
             versionpage = self.getUrl(self.get_address("Special:Version"))
+            from BeautifulSoup import BeautifulSoup
             htmldata = BeautifulSoup(versionpage, convertEntities="html")
             # try to find the live version
             versionlist = []
@@ -9559,6 +9833,7 @@ sysopnames['%s']['%s']='name' to your user-config.py"""
 # Caches to provide faster access
 _sites = {}
 _namespaceCache = {}
+_titleCache = LRUCache(config.page_title_cache)
 
 
 def getSite(code=None, fam=None, user=None, noLogin=False):
@@ -9897,13 +10172,18 @@ def setLogfileStatus(enabled, logname=None, header=False):
 
         if not logname:
             logname = '%s.log' % moduleName
+            if not pywikibot.throttle.pid and get_throttle.multiplydelay:
+                # the throttle registers the process on first use only;
+                # the log of another instance of the script must not be used
+                get_throttle.checkMultiplicity()
             if pywikibot.throttle.pid > 1:
                 logname = '%s.%s.log' % (moduleName, pywikibot.throttle.pid)
         logfn = config.datafilepath('logs', logname)
 
+        from logging import handlers
         # create file handler which logs even debug messages
         if config.loghandler.upper() == 'RFH':
-            fh = logging.handlers.RotatingFileHandler(
+            fh = handlers.RotatingFileHandler(
                 filename=logfn, maxBytes=1024 * config.logfilesize,
                 backupCount=config.logfilecount, encoding="utf-8")
         else:
@@ -9916,7 +10196,7 @@ def setLogfileStatus(enabled, logname=None, header=False):
                 # For Python > 2.5 (added in version 2.6)
                 kwargs['utc'] = True
 
-            fh = logging.handlers.TimedRotatingFileHandler(logfn, **kwargs)
+            fh = handlers.TimedRotatingFileHandler(logfn, **kwargs)
             # patch for "Issue 8117: TimedRotatingFileHandler doesn't rotate log
             # file at startup."
             # applies to python2.6 only, solution filched from python2.7 source:
@@ -10259,6 +10539,7 @@ def debug(text, layer="", decoder=None, newline=True, **kwargs):
 def debugDump(name, site, error, data, **kwargs):
     """Output a very long debug/error message to own log file."""
     name = unicode(name)
+    import pprint
     site = repr(site)
     data = pprint.pformat(data)
     if isinstance(error, BaseException):
@@ -10361,47 +10642,8 @@ def inputChoice(question, answers, hotkeys, default=None):
 
     return data
 
-page_put_queue = Queue.Queue(config.max_queue_size)
-
-
-def async_put():
-    """Daemon; take pages from the queue and try to save them on the wiki."""
-    while True:
-        (page, newtext, comment, watchArticle, minorEdit, force, callback
-         ) = page_put_queue.get()
-        if page is None:
-            # an explicit end-of-Queue marker is needed for compatibility
-            # with Python 2.4; in 2.5, we could use the Queue's task_done()
-            # and join() methods
-            return
-        try:
-            page.put(newtext, comment, watchArticle, minorEdit, force)
-            error = None
-        except Exception, error:
-            pass
-        if callback is not None:
-            callback(page, error)
-            # if callback is provided, it is responsible for exception handling
-            continue
-        if isinstance(error, SpamfilterError):
-            output(u"Saving page %s prevented by spam filter: %s"
-                   % (page, error.url))
-        elif isinstance(error, PageNotSaved):
-            output(u"Saving page %s failed: %s" % (page, error))
-        elif isinstance(error, LockedPage):
-            output(u"Page %s is locked; not saved." % page)
-        elif isinstance(error, NoUsername):
-            output(u"Page %s not saved; sysop privileges required." % page)
-        elif error is not None:
-            exception(error, tb=True)
-            output(u"Saving page %s failed!" % page)
-
-_putthread = threading.Thread(target=async_put)
-# identification for debugging purposes
-_putthread.setName('Put-Thread')
-_putthread.setDaemon(True)
-## Don't start the queue if it is not necessary.
-#_putthread.start()
+put_scheduler = putqueue.PutScheduler(config.max_queue_size,
+                                      config.max_queue_bytes)
 
 
 def stopme():
@@ -10410,6 +10652,8 @@ def stopme():
        not slow down other bots any more.
     """
     get_throttle.drop()
+    for throttle in _siteThrottles.values():
+        throttle.drop()
     #logging.shutdown()
 
 
@@ -10420,38 +10664,67 @@ def _flush():
 
     """
     def remaining():
-        # -1 because we added a None element to stop the queue
-        remainingPages = page_put_queue.qsize() - 1
-
-        remainingSeconds = datetime.timedelta(
-            seconds=(remainingPages * put_throttle.getDelay(True)))
-        return (remainingPages, remainingSeconds)
-
-    page_put_queue.put((None, ) * 7)
-
-    if page_put_queue.qsize() > 1:
-        num, sec = remaining()
-        format_values = dict(num=num, sec=sec)
+        pending = put_scheduler.pending()
+        seconds = dict((site,
+                        num * siteThrottle(site, write=True).getDelay(True))
+                       for site, num in pending.iteritems())
+        return pending, seconds
+
+    def report(pending, seconds):
+        for site in sorted(pending, key=seconds.get, reverse=True):
+            output(u'  %s: %i pages, %s'
+                   % (site, pending[site],
+                      datetime.timedelta(seconds=seconds[site])))
+
+    pending, seconds = remaining()
+    if pending:
+        # the sites are saved at the same time, so the slowest one decides
         output(u'\03{lightblue}'
-               u'Waiting for %(num)i pages to be put. '
-               u'Estimated time remaining: %(sec)s'
-               '\03{default}' % format_values)
+               u'Waiting for %i pages to be put. '
+               u'Estimated time remaining: %s'
+               '\03{default}'
+               % (sum(pending.values()),
+                  datetime.timedelta(seconds=max(seconds.values()))))
+        if len(pending) > 1:
+            report(pending, seconds)
 
-    while(_putthread.isAlive()):
+    while True:
         try:
-            _putthread.join(1)
+            if put_scheduler.join(1):
+                break
         except KeyboardInterrupt:
-            answer = inputChoice(u"""\
-There are %i pages remaining in the queue. Estimated time remaining: %s
-Really exit?"""
-                                 % remaining(),
+            pending, seconds = remaining()
+            output(u'There are %i pages remaining in the queue. '
+                   u'Estimated time remaining: %s'
+                   % (sum(pending.values()),
+                      datetime.timedelta(seconds=max(seconds.values() or
+                                                     [0]))))
+            report(pending, seconds)
+            answer = inputChoice(u'Really exit?',
                                  ['yes', 'no'], ['y', 'N'], 'N')
             if answer == 'y':
                 return
     try:
         get_throttle.drop()
+        for throttle in _siteThrottles.values():
+            throttle.drop()
     except NameError:
         pass
+    if connection_pool:
+        if verbose:
+            stats = connection_pool.stats()
+            stats['reuse_rate'] *= 100
+            output(u'HTTP connections: %(requests)i requests, %(reused)i '
+                   u'reused (%(reuse_rate).0f%%), %(handshakes)i handshakes, '
+                   u'%(resets)i resets' % stats)
+        connection_pool.close()
+    if query._cache:
+        if verbose:
+            stats = query._cache.stats()
+            stats['hit_rate'] *= 100
+            output(u'API cache: %(hits)i hits (%(hit_rate).0f%%), '
+                   u'%(misses)i misses, %(invalidated)i outdated' % stats)
+        query._cache.close()
     if config.use_diskcache and not config.use_api:
         for site in _sites.itervalues():
             if site._mediawiki_messages:
@@ -10463,8 +10736,35 @@ Really exit?"""
 import atexit
 atexit.register(_flush)
 
-get_throttle = Throttle()
-put_throttle = Throttle(write=True)
+# shared by all retry loops and throttles
+retry_policy = RetryPolicy()
+get_throttle = Throttle(policy=retry_policy)
+put_throttle = Throttle(write=True, policy=retry_policy)
+_siteThrottles = {}
+_siteThrottlesLock = threading.Lock()
+
+
+def siteThrottle(site, write=False):
+    """Return the read throttle for site, or its put throttle if write.
+
+    These are get_throttle and put_throttle for the default site. Every
+    other site has throttles of its own, so pages of several sites may be
+    loaded and saved at the same time.
+
+    """
+    if site == getSite():
+        if write:
+            return put_throttle
+        return get_throttle
+    _siteThrottlesLock.acquire()
+    try:
+        if (site, write) not in _siteThrottles:
+            _siteThrottles[site, write] = Throttle(write=write,
+                                                   policy=retry_policy,
+                                                   site=site)
+        return _siteThrottles[site, write]
+    finally:
+        _siteThrottlesLock.release()
 
 
 def decompress_gzip(data):
@@ -10520,14 +10820,51 @@ class U2RedirectHandler(urllib2.HTTPRedirectHandler):
 
 # Site Cookies handler
 COOKIEFILE = config.datafilepath('login-data', 'cookies.lwp')
-cj = cookielib.LWPCookieJar()
-if os.path.isfile(COOKIEFILE):
-    cj.load(COOKIEFILE)
 
-cookieProcessor = urllib2.HTTPCookieProcessor(cj)
 
+class _LazyObject(object):
+    """Proxy of an object which is created by factory when it is used first.
+
+    Loading the cookie jar imports cookielib, which takes some time at every
+    start of a bot, although the login cookies are kept in the login data.
+
+    """
 
-MyURLopener = urllib2.build_opener(U2RedirectHandler)
+    def __init__(self, factory):
+        self._factory = factory
+        self._object = None
+
+    def __getattr__(self, name):
+        if self._object is None:
+            self._object = self._factory()
+        return getattr(self._object, name)
+
+
+def _loadCookieJar():
+    import cookielib
+    jar = cookielib.LWPCookieJar()
+    if os.path.isfile(COOKIEFILE):
+        jar.load(COOKIEFILE)
+    return jar
+
+cj = _LazyObject(_loadCookieJar)
+
+cookieProcessor = _LazyObject(lambda: urllib2.HTTPCookieProcessor(cj))
+
+
+if config.persistent_http:
+    from pywikibot.comms import connpool
+    connection_pool = connpool.ConnectionPool(
+        maxsize=config.max_idle_connections,
+        idletimeout=config.connection_idle_timeout,
+        maxtotal=config.max_total_idle_connections)
+    MyURLopener = urllib2.build_opener(
+        U2RedirectHandler,
+        connpool.HTTPHandler(connection_pool),
+        connpool.HTTPSHandler(connection_pool))
+else:
+    connection_pool = None
+    MyURLopener = urllib2.build_opener(U2RedirectHandler)
 
 if config.proxy['host']:
     if config.proxy['auth']:
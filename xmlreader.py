@@ -14,6 +14,18 @@ For fastest processing, XmlDump uses the cElementTree library if available
 (this comes included with Python 2.5, and can be downloaded from
 http://www.effbot.org/ for earlier versions). If not found, it falls back
 to the older method using regular expressions.
+
+XmlDump.parallel_parse() splits the dump at page boundaries and lets a pool
+of worker processes parse the pages and apply a function to each of them,
+which allows to scan a dump using all CPU cores.
+
+Multistream dumps (pages-articles-multistream.xml.bz2) consist of many
+independent bz2 streams of about 100 pages each; their index file lists the
+offset of the stream containing each page. Given the index, XmlDump can
+start reading at a certain page (parse_from), read a range of streams
+(parse_range) or fetch some pages only (get_pages) without decompressing
+the whole dump, and parallel_parse() lets the worker processes decompress
+the streams themselves.
 """
 #
 # (C) Pywikibot team, 2005-2013
@@ -26,8 +38,12 @@ __version__ = '$Id$'
 import threading
 import xml.sax
 import codecs
+import collections
+import os
 import re
+from cStringIO import StringIO
 import wikipedia as pywikibot
+from pywikibot.tools import waitFor
 
 try:
     from xml.etree.cElementTree import iterparse
@@ -259,6 +275,201 @@ class XmlParserThread(threading.Thread):
         xml.sax.parse(self.filename, self.handler)
 
 
+class _Bz2Reader(object):
+    """
+    File-like object reading a bz2 file which may consist of several
+    concatenated streams, like multistream dumps do. bz2.BZ2File stops
+    reading at the end of the first stream.
+
+    @param start: offset of the first stream to read.
+    @param end: offset where to stop reading; None means end of file.
+    @param prefix: data returned before the decompressed data.
+    @param suffix: data returned after the decompressed data.
+    """
+    def __init__(self, filename, start=0, end=None, prefix='', suffix=''):
+        import bz2
+        self._bz2 = bz2
+        self._file = open(filename, 'rb')
+        self._file.seek(start)
+        self._left = None if end is None else end - start
+        self._decompressor = bz2.BZ2Decompressor()
+        self._buffer = prefix
+        self._suffix = suffix
+
+    def _fill(self, size):
+        while len(self._buffer) < size:
+            if self._left is None:
+                data = self._file.read(65536)
+            else:
+                data = self._file.read(min(65536, self._left))
+                self._left -= len(data)
+            if not data:
+                self._buffer += self._suffix
+                self._suffix = ''
+                return
+            while data:
+                try:
+                    self._buffer += self._decompressor.decompress(data)
+                except EOFError:
+                    # end of stream; continue with the next one
+                    self._decompressor = self._bz2.BZ2Decompressor()
+                    continue
+                data = self._decompressor.unused_data
+                if data:
+                    self._decompressor = self._bz2.BZ2Decompressor()
+
+    def read(self, size=-1):
+        if size < 0:
+            self._fill(float('inf'))
+            size = len(self._buffer)
+        else:
+            self._fill(size)
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+class MultistreamIndex(object):
+    """
+    The index of a multistream dump, a (possibly bz2 compressed) text file
+    with a line 'offset:pageid:title' for each page of the dump, where
+    offset is the position of the bz2 stream containing the page.
+
+    The index of a large wiki has millions of lines, so it is read line by
+    line whenever pages are looked up. Only the offsets of the streams are
+    kept, once all of them are needed, and the positions of the pages
+    looked up.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._offsets = None
+        # (start, end) of the streams of the pages looked up, by title or
+        # pageid
+        self._found = {}
+
+    def _lines(self):
+        """Yield the lines of the index."""
+        if self.filename.endswith('.bz2'):
+            f = _Bz2Reader(self.filename)
+        else:
+            f = open(self.filename, 'rb')
+        try:
+            rest = ''
+            while True:
+                data = f.read(1024 * 1024)
+                if not data:
+                    break
+                lines = (rest + data).split('\n')
+                rest = lines.pop()
+                for line in lines:
+                    if line:
+                        yield line
+            if rest:
+                yield rest
+        finally:
+            f.close()
+
+    @property
+    def offsets(self):
+        """The offsets of all streams containing pages, in dump order."""
+        if self._offsets is None:
+            offsets = []
+            for line in self._lines():
+                offset = int(line[:line.index(':')])
+                if not offsets or offset != offsets[-1]:
+                    offsets.append(offset)
+            self._offsets = offsets
+        return self._offsets
+
+    def first(self):
+        """Return the offset of the first stream containing pages."""
+        if self._offsets is not None:
+            return self._offsets[0]
+        lines = self._lines()
+        try:
+            for line in lines:
+                return int(line[:line.index(':')])
+        finally:
+            lines.close()
+        raise ValueError(u'%s is empty' % self.filename)
+
+    def find(self, titles=(), pageids=()):
+        """Return the streams containing the given pages.
+
+        The result maps the titles and pageids found to (start, end)
+        tuples, where end is the offset of the following stream or None
+        for the last one. Pages missing from the index are left out.
+        """
+        titles = set(titles)
+        pageids = set(str(pageid) for pageid in pageids)
+        result = {}
+        for key in titles | pageids:
+            if key in self._found:
+                result[key] = self._found[key]
+        wantedTitles = dict((title.encode('utf-8'), title)
+                            for title in titles if title not in result)
+        wantedIds = set(pageid for pageid in pageids if pageid not in result)
+        # pages found in the current stream, waiting for its end
+        current = None
+        waiting = []
+        for line in self._lines():
+            if not (wantedTitles or wantedIds or waiting):
+                break
+            offset, pageid, title = line.split(':', 2)
+            offset = int(offset)
+            if offset != current:
+                for key in waiting:
+                    result[key] = self._found[key] = (current, offset)
+                waiting = []
+                current = offset
+            if title in wantedTitles:
+                waiting.append(wantedTitles.pop(title))
+            if pageid in wantedIds:
+                wantedIds.discard(pageid)
+                waiting.append(pageid)
+        for key in waiting:
+            result[key] = self._found[key] = (current, None)
+        return result
+
+    def offset(self, title=None, pageid=None):
+        """Return the offset of the stream containing a page.
+
+        Raise KeyError if the page is not in the index.
+        """
+        if title is not None:
+            return self.find(titles=[title])[title][0]
+        pageid = str(pageid)
+        return self.find(pageids=[pageid])[pageid][0]
+
+    def end(self, offset):
+        """Return the offset of the stream following the one at offset.
+
+        None is returned for the last stream.
+        """
+        import bisect
+        i = bisect.bisect_right(self.offsets, offset)
+        if i < len(self.offsets):
+            return self.offsets[i]
+        return None
+
+    def ranges(self, size=1):
+        """Split the dump into ranges of size streams each.
+
+        Return a list of (start, end) offset tuples; end is None for the
+        last range.
+        """
+        result = []
+        for i in range(0, len(self.offsets), size):
+            if i + size < len(self.offsets):
+                result.append((self.offsets[i], self.offsets[i + size]))
+            else:
+                result.append((self.offsets[i], None))
+        return result
+
+
 class XmlDump(object):
     """
     Represents an XML dump file. Reads the local file at initialization,
@@ -272,9 +483,21 @@ class XmlDump(object):
         Only available for cElementTree version:
         If True, parse all revisions instead of only the latest one.
         Default: False.
+    @param index: the index file of a multistream dump. If not given, the
+        index is looked for next to a dump whose name ends with
+        'multistream.xml.bz2'.
     """
-    def __init__(self, filename, allrevisions=False):
+    def __init__(self, filename, allrevisions=False, index=None):
         self.filename = filename
+        self.allrevisions = allrevisions
+        if index is None and filename \
+                and filename.endswith('multistream.xml.bz2'):
+            index = filename[:-len('.xml.bz2')] + '-index.txt.bz2'
+            if not os.path.exists(index):
+                index = None
+        self.indexfile = index
+        self._index = None
+        self._head = None
         if allrevisions:
             self._parse = self._parse_all
         else:
@@ -293,9 +516,12 @@ Consider installing the python-celementtree package.''')
 
     def new_parse(self):
         """Generator using cElementTree iterparse function"""
+        return self._iterparse(self._open())
+
+    def _open(self):
+        """Return a file object for the (possibly compressed) dump."""
         if self.filename.endswith('.bz2'):
-            import bz2
-            source = bz2.BZ2File(self.filename)
+            source = _Bz2Reader(self.filename)
         elif self.filename.endswith('.gz'):
             import gzip
             source = gzip.open(self.filename)
@@ -309,6 +535,9 @@ Consider installing the python-celementtree package.''')
         else:
             # assume it's an uncompressed XML file
             source = open(self.filename)
+        return source
+
+    def _iterparse(self, source):
         context = iterparse(source, events=("start", "end", "start-ns"))
         self.root = None
 
@@ -373,6 +602,188 @@ Consider installing the python-celementtree package.''')
                         redirect=self.isredirect
                         )
 
+    @property
+    def index(self):
+        """The MultistreamIndex of the dump or None; loaded on first use."""
+        if self._index is None and self.indexfile:
+            self._index = MultistreamIndex(self.indexfile)
+        return self._index
+
+    def _require_index(self):
+        if self.index is None:
+            raise ValueError(u'%s is not a multistream dump with an index'
+                             % self.filename)
+        if self._head is None:
+            # the root element is in the stream(s) before the first page
+            f = _Bz2Reader(self.filename, 0, self.index.first())
+            self._head = _root_tag(f.read())
+            f.close()
+
+    def parse_range(self, start, end=None):
+        """Yield the XmlEntries of the streams between two offsets.
+
+        Only available for multistream dumps with an index. end is the
+        offset of the first stream not to be read; None means end of dump.
+        """
+        self._require_index()
+        if end is None:
+            # the last stream closes the root element
+            suffix = ''
+        else:
+            suffix = '</mediawiki>'
+        return self._iterparse(_Bz2Reader(self.filename, start, end,
+                                          self._head, suffix))
+
+    def parse_from(self, title=None, pageid=None):
+        """Yield the XmlEntries beginning with the given page.
+
+        Only available for multistream dumps with an index: the streams
+        before the one containing the page are not decompressed at all.
+        Raise KeyError if the page is not in the index.
+        """
+        self._require_index()
+        start = self.index.offset(title, pageid)
+        return self._parse_from(start, title, pageid)
+
+    def _parse_from(self, start, title, pageid):
+        found = False
+        for entry in self.parse_range(start):
+            if not found:
+                if title is not None and entry.title != title:
+                    continue
+                if pageid is not None and entry.id != str(pageid):
+                    continue
+                found = True
+            yield entry
+
+    def get_pages(self, titles=(), pageids=()):
+        """Yield the XmlEntries of the given pages, in dump order.
+
+        Only available for multistream dumps with an index; just the
+        streams containing the pages are read. Pages missing from the index
+        are skipped.
+        """
+        self._require_index()
+        titles = set(titles)
+        pageids = set(str(pageid) for pageid in pageids)
+        streams = set(self.index.find(titles, pageids).values())
+        for start, end in sorted(streams):
+            for entry in self.parse_range(start, end):
+                if entry.title in titles or entry.id in pageids:
+                    yield entry
+
+    def parallel_parse(self, function, args=(), processes=None, ordered=True,
+                       chunksize=4 * 1024 * 1024, start=None):
+        """Scan the dump with several processes; yield results of function.
+
+        The dump is read by this process and split at page boundaries into
+        chunks of about chunksize bytes, which are parsed by a pool of
+        worker processes. These call function(entry, *args) for every
+        XmlEntry:
+            - if it returns True, the XmlEntry itself is yielded,
+            - if it returns None or False, nothing is yielded,
+            - any other return value is yielded instead of the entry.
+
+        As function and args are passed to the worker processes, function
+        must be defined at module level and args must be picklable.
+
+        @param processes: number of worker processes. Default: number of
+            CPUs.
+        @param ordered: if True, the results are yielded in the order of
+            the dump, otherwise as soon as they are available.
+        @param chunksize: approximate size of the uncompressed XML sent to
+            a worker process at once, in bytes. For multistream dumps with
+            an index, the workers read the streams themselves instead, and
+            chunksize is used as the approximate compressed size of the
+            streams handled by a worker at once.
+        @param start: title of the page to start with. Only used for
+            multistream dumps with an index; the streams before the one
+            containing the page are skipped, but the pages preceding it in
+            its stream are not.
+
+        """
+        if 'iterparse' not in globals():
+            # the regex fallback can't parse chunks; scan in this process
+            for entry in self.parse():
+                result = function(entry, *args)
+                if result is True:
+                    yield entry
+                elif result is not None and result is not False:
+                    yield result
+            return
+        import multiprocessing
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(processes)
+        # Limit the number of chunks being processed or waiting to be
+        # consumed, so the reader can't fill up the memory.
+        pending = collections.deque()
+        try:
+            if self.index is not None:
+                self._require_index()
+                chunks = self._stream_chunks(chunksize, start)
+            else:
+                chunks = self._chunks(chunksize)
+            for chunk in chunks:
+                pending.append(pool.apply_async(
+                    _parse_chunk,
+                    (chunk, self.allrevisions, function, args)))
+                del chunk
+                while len(pending) >= 2 * processes:
+                    for result in _pop_results(pending, ordered):
+                        yield result
+            while pending:
+                for result in _pop_results(pending, ordered):
+                    yield result
+        finally:
+            pool.terminate()
+
+    def _stream_chunks(self, chunksize, title=None):
+        """Split a multistream dump into offset ranges for the workers.
+
+        The chunks are (filename, root tag, start, end) tuples.
+        """
+        offsets = self.index.offsets
+        if title is not None:
+            found = self.index.find(titles=[title])
+            if title in found:
+                offsets = offsets[offsets.index(found[title][0]):]
+        start = offsets[0]
+        for offset in offsets[1:]:
+            if offset - start >= chunksize:
+                yield (self.filename, self._head, start, offset)
+                start = offset
+        yield (self.filename, self._head, start, None)
+
+    def _chunks(self, chunksize):
+        """Split the dump into XML documents containing complete pages.
+
+        Each chunk consists of the root element of the dump enclosing
+        some consecutive <page> elements.
+
+        """
+        source = self._open()
+        data = ''
+        while '<page>' not in data:
+            block = source.read(65536)
+            if not block:
+                return
+            data += block
+        start = data.index('<page>')
+        head = _root_tag(data[:start])
+        data = data[start:]
+        while True:
+            block = source.read(chunksize)
+            data += block
+            if len(data) >= chunksize or not block:
+                cut = data.rfind('</page>')
+                if cut >= 0:
+                    cut += len('</page>')
+                    yield '%s%s</mediawiki>' % (head, data[:cut])
+                    data = data[cut:]
+            if not block:
+                break
+
     def regex_parse(self):
         """
         Generator which reads some lines from the XML dump file, and
@@ -448,3 +859,59 @@ Consider installing the python-celementtree package.''')
                                    moveRestriction=moveRestriction,
                                    revisionid=m.group('revisionid')
                                    )
+
+
+def _parse_chunk(chunk, allrevisions, function, args):
+    """Parse a chunk of the dump in a worker process; see parallel_parse."""
+    results = []
+    dump = XmlDump(None, allrevisions)
+    if isinstance(chunk, tuple):
+        chunk = _read_streams(*chunk)
+    for entry in dump._iterparse(StringIO(chunk)):
+        result = function(entry, *args)
+        if result is True:
+            results.append(entry)
+        elif result is not None and result is not False:
+            results.append(result)
+    return results
+
+
+def _root_tag(data):
+    """Return the start tag of the root element in the head of a dump."""
+    m = re.search('<mediawiki[^>]*>', data)
+    if m:
+        return m.group(0)
+    return '<mediawiki>'
+
+
+def _read_streams(filename, head, start, end):
+    """Read some streams of a multistream dump as a complete XML document.
+
+    Everything but the <page> elements, like the end of the root element in
+    the last stream, is removed before head is prepended.
+    """
+    f = _Bz2Reader(filename, start, end)
+    data = f.read()
+    f.close()
+    first = data.find('<page>')
+    if first < 0:
+        return '%s</mediawiki>' % head
+    last = data.rfind('</page>') + len('</page>')
+    return '%s%s</mediawiki>' % (head, data[first:last])
+
+
+def _pop_results(pending, ordered):
+    """Remove the next finished job from pending and return its results."""
+    if ordered:
+        candidates = [pending[0]]
+    else:
+        candidates = pending
+
+    def finished():
+        for job in candidates:
+            if job.ready():
+                return job
+
+    job = waitFor(finished, pending[0].wait)
+    pending.remove(job)
+    return job.get()